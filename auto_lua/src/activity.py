@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class ActivityGate:
+    # Decides per frame whether the full DSP chain is worth running. The change metric is the energy
+    # of the difference between this frame's chirps and the previous frame's mean chirp, relative to
+    # this frame's energy, over the hand detection range bins. It is computed from the raw frame with
+    # RadarProcessor's fast path matrix on every decimation-th loop only. Comparing complex spectra
+    # instead of power profiles catches a hand that moves within a range bin as well as one that
+    # appears; static reflections cancel either way.
+    # Hysteresis: a frame above enter_threshold makes the scene active at once, idle_frames frames in
+    # a row below exit_threshold make it idle. While idle only one frame in idle_every_nth is
+    # processed (none with 0); the gate itself still runs on every frame, so the first frame with
+    # activity is processed in full.
+    def __init__(self, processor, decimation=4, enter_threshold=0.002, exit_threshold=0.001, idle_frames=25, idle_every_nth=10):
+        if exit_threshold > enter_threshold:
+            raise ValueError("exit_threshold must not be above enter_threshold")
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.idle_frames = idle_frames
+        self.idle_every_nth = idle_every_nth
+
+        self.matrix = processor.roi_matrix
+        row_len = processor.roi_raw.shape[1]
+        # raw frame as (loop, rows of one loop, row) so the decimated loops are a strided view
+        self.loop_shape = (processor.num_loops, processor.roi_raw.shape[0] // processor.num_loops, row_len)
+        self.decimation = decimation
+        num_loops = len(range(0, processor.num_loops, decimation))
+        self.raw = np.empty((num_loops, *self.loop_shape[1:]), dtype=np.float32)
+        self.spectrum = np.empty((num_loops * self.loop_shape[1], self.matrix.shape[1]), dtype=np.float32)
+        self.difference = np.empty_like(self.spectrum)
+        # Mean spectrum of one loop: this frame's, and the previous frame's to compare against
+        self.mean = np.empty(self.loop_shape[1] * self.matrix.shape[1], dtype=np.float32)
+        self.reference = np.empty_like(self.mean)
+        self.has_reference = False
+
+        self.idle = False
+        self.quiet_frames = 0
+        self.idle_count = 0
+        self.last_change = None
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.wakeups = 0
+
+    @classmethod
+    def from_config(cls, config, processor):
+        # None when activity_gate.enabled is false
+        gate = config['activity_gate']
+        if not gate['enabled']:
+            return None
+        return cls(processor, gate['decimation'], gate['enter_threshold'], gate['exit_threshold'],
+                   gate['idle_frames'], gate['idle_every_nth'])
+
+    def change(self, raw_frame):
+        # Relative ROI change against the previous frame, inf for the first one
+        self.raw[...] = raw_frame.reshape(self.loop_shape)[::self.decimation]
+        np.matmul(self.raw.reshape(-1, self.raw.shape[-1]), self.matrix, out=self.spectrum)
+        loops = self.spectrum.reshape(len(self.raw), -1)
+        if self.has_reference:
+            np.subtract(loops, self.reference, out=self.difference.reshape(loops.shape))
+            difference = self.difference.reshape(-1)
+            spectrum = self.spectrum.reshape(-1)
+            change = float(np.dot(difference, difference) / max(np.dot(spectrum, spectrum), np.finfo(np.float32).tiny))
+        else:
+            change = np.inf
+        np.sum(loops, axis=0, out=self.mean)
+        np.multiply(self.mean, np.float32(1 / len(loops)), out=self.reference)
+        self.has_reference = True
+        return change
+
+    def __call__(self, raw_frame):
+        # True when raw_frame should be processed
+        change = self.last_change = self.change(raw_frame)
+        self.frames_seen += 1
+        if change > self.enter_threshold:
+            if self.idle:
+                self.wakeups += 1
+            self.idle = False
+            self.quiet_frames = 0
+        elif change < self.exit_threshold:
+            self.quiet_frames += 1
+            if self.quiet_frames >= self.idle_frames and not self.idle:
+                self.idle = True
+                self.idle_count = 0
+        if not self.idle:
+            return True
+        self.idle_count += 1
+        if self.idle_every_nth and self.idle_count % self.idle_every_nth == 0:
+            return True
+        self.frames_skipped += 1
+        return False
+
+    def reset(self):
+        self.has_reference = False
+        self.idle = False
+        self.quiet_frames = 0
+
+    def stats(self):
+        return {
+            "idle": self.idle,
+            "last_change": self.last_change,
+            "frames_seen": self.frames_seen,
+            "frames_skipped": self.frames_skipped,
+            "wakeups": self.wakeups,
+        }
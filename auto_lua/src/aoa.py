@@ -0,0 +1,113 @@
+import numpy as np
+from profile_cfg import read_cfg_commands
+
+POINT_DTYPE = np.dtype([
+    ('x', np.float32),
+    ('y', np.float32),
+    ('z', np.float32),
+    ('range', np.float32),
+    ('azimuth', np.float32),
+    ('elevation', np.float32),
+    ('velocity', np.float32),
+    ('snr', np.float32),
+])
+
+
+def grid_peaks(grid):
+    # grid: (detections, elevations, azimuths); True where a cell is >= its neighbours along both angle axes
+    peaks = np.ones(grid.shape, dtype=bool)
+    for axis in (1, 2):
+        n = grid.shape[axis]
+        if n == 1:
+            continue
+        lower = np.take(grid, np.maximum(np.arange(n) - 1, 0), axis=axis)
+        upper = np.take(grid, np.minimum(np.arange(n) + 1, n - 1), axis=axis)
+        peaks &= (grid >= lower) & (grid >= upper)
+    return peaks
+
+
+class AoAEstimator:
+    # Bartlett beamforming over the virtual array, evaluated only on CFAR detections. The steering
+    # matrix for the whole angle grid is built once, so a frame costs one (detections x antennas) @
+    # (antennas x angles) product.
+    def __init__(self, virtual_positions, num_tx, num_rx, num_doppler_bins, azimuth_fov=(-90, 90), elevation_fov=(-90, 90),
+                 angle_step=1.0, multi_obj_threshold=None):
+        # virtual_positions: (antennas, 2) [azimuth, elevation] offsets in half wavelengths, in chirp order (TX major)
+        positions = np.asarray(virtual_positions, dtype=np.float64)
+        self.num_antennas = len(positions)
+        self.multi_obj_threshold = multi_obj_threshold
+
+        azimuths = np.deg2rad(np.arange(azimuth_fov[0], azimuth_fov[1] + angle_step / 2, angle_step))
+        if np.ptp(positions[:, 1]) > 0:
+            elevations = np.deg2rad(np.arange(elevation_fov[0], elevation_fov[1] + angle_step / 2, angle_step))
+        else:
+            # A purely horizontal array cannot resolve elevation
+            elevations = np.zeros(1)
+        self.grid_shape = (len(elevations), len(azimuths))
+        elevation_grid, azimuth_grid = np.meshgrid(elevations, azimuths, indexing='ij')
+        self.azimuth_grid = azimuth_grid.reshape(-1).astype(np.float32)
+        self.elevation_grid = elevation_grid.reshape(-1).astype(np.float32)
+
+        phase = np.pi * (np.outer(np.sin(azimuth_grid.reshape(-1)) * np.cos(elevation_grid.reshape(-1)), positions[:, 0])
+                         + np.outer(np.sin(elevation_grid.reshape(-1)), positions[:, 1]))
+        # Conjugated and transposed once so beamforming is a plain matmul: (antennas, angles)
+        self.steering = (np.exp(-1j * phase).T / self.num_antennas).astype(np.complex64)
+
+        # With TDM MIMO a moving target also rotates phase between TX slots of one loop, undo that per Doppler bin
+        signed_bins = np.arange(num_doppler_bins) - num_doppler_bins // 2
+        tx_slot = np.arange(self.num_antennas) // num_rx
+        self.doppler_compensation = np.exp(-2j * np.pi * np.outer(signed_bins, tx_slot) / (num_doppler_bins * num_tx)).astype(np.complex64)
+
+    @classmethod
+    def from_config(cls, config):
+        radar = config['radar']
+        num_tx, num_rx = radar['num_tx_antennas'], radar['num_rx_antennas']
+        positions = config['aoa']['virtual_antennas'] or [[i, 0] for i in range(num_tx * num_rx)]
+        if len(positions) != num_tx * num_rx:
+            raise ValueError(f"aoa.virtual_antennas has {len(positions)} positions, {num_tx} TX x {num_rx} RX need {num_tx * num_rx}")
+        if radar['chirps'] % num_tx:
+            raise ValueError(f"{radar['chirps']} chirps per frame do not split into loops of {num_tx} TX")
+        commands = read_cfg_commands(config['cfar']['profile_cfg'])
+        azimuth_fov, elevation_fov = (-90, 90), (-90, 90)
+        if 'aoaFovCfg' in commands:
+            args = [float(a) for a in commands['aoaFovCfg'][0]]
+            azimuth_fov, elevation_fov = (args[1], args[2]), (args[3], args[4])
+        multi_obj_threshold = None
+        if 'multiObjBeamForming' in commands:
+            args = commands['multiObjBeamForming'][0]
+            if int(args[1]):
+                multi_obj_threshold = float(args[2])
+        return cls(positions, num_tx, num_rx, radar['chirps'] // num_tx, azimuth_fov, elevation_fov,
+                   config['aoa']['angle_step_deg'], multi_obj_threshold)
+
+    def estimate(self, doppler_cube, detections):
+        # doppler_cube: (doppler, antennas, range) complex; detections: cfar.DETECTION_DTYPE array
+        if len(detections) == 0:
+            return np.empty(0, dtype=POINT_DTYPE)
+        doppler_bins = detections['doppler_bin'].astype(np.intp)
+        snapshots = doppler_cube[doppler_bins, :, detections['range_bin']]
+        snapshots *= self.doppler_compensation[doppler_bins]
+        spectrum = np.abs(snapshots @ self.steering) ** 2
+
+        if self.multi_obj_threshold is None:
+            det_idx = np.arange(len(detections))
+            angle_idx = np.argmax(spectrum, axis=1)
+        else:
+            # Every local maximum within multi_obj_threshold of the strongest one becomes its own point
+            peaks = grid_peaks(spectrum.reshape(len(detections), *self.grid_shape)).reshape(len(detections), -1)
+            peaks &= spectrum >= self.multi_obj_threshold * spectrum.max(axis=1, keepdims=True)
+            det_idx, angle_idx = np.nonzero(peaks)
+
+        points = np.empty(len(det_idx), dtype=POINT_DTYPE)
+        ranges = detections['range'][det_idx]
+        azimuth = self.azimuth_grid[angle_idx]
+        elevation = self.elevation_grid[angle_idx]
+        points['range'] = ranges
+        points['azimuth'] = np.rad2deg(azimuth)
+        points['elevation'] = np.rad2deg(elevation)
+        points['velocity'] = detections['velocity'][det_idx]
+        points['snr'] = detections['snr'][det_idx]
+        points['x'] = ranges * np.cos(elevation) * np.sin(azimuth)
+        points['y'] = ranges * np.cos(elevation) * np.cos(azimuth)
+        points['z'] = ranges * np.sin(elevation)
+        return points
@@ -0,0 +1,317 @@
+import argparse
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+import numpy as np
+import yaml
+from recording import INDEX_DTYPE, index_path, open_capture
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# <magic><frame_len><chirp_len><lag><frames_per_chunk><codec>
+ARCHIVE_HEADER = struct.Struct('<8sIIII8s')
+ARCHIVE_MAGIC = b'RADARZ01'
+# Before every chunk: <frames in the chunk><compressed bytes>
+CHUNK_HEADER = struct.Struct('<II')
+CODECS = ('zstd', 'zlib')
+DEFAULT_LEVELS = {'zstd': 3, 'zlib': 1}
+# Encoder threads of a writer: enough for 25 frames/s with either codec, without taking every core
+# from the capture and DSP threads of the same process
+DEFAULT_WORKERS = 2
+# Chunk buffers a writer allocates at most, encoding, waiting to be written or being filled
+DEFAULT_MAX_CHUNKS = 8
+
+
+def default_codec():
+    # zstd compresses better and faster, zlib is always there
+    return 'zstd' if zstandard is not None else 'zlib'
+
+
+def compress(data, codec, level):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is needed for zstd archives")
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def decompress(data, codec, size):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is needed to read zstd archives")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    return zlib.decompress(data)
+
+
+def encode_chunk(frames, chirp_len, lag, codec, level):
+    # Lossless: every chirp minus the chirp lag before it in the same frame (with lag = num_tx that
+    # is the previous loop of the same TX antenna, so static reflections cancel), in wrapping int16
+    # arithmetic, then the low bytes of all values followed by the high bytes, then the codec.
+    # The first lag chirps of each frame are kept as they are, so every chunk decodes on its own.
+    chirps = frames.reshape(len(frames), -1, chirp_len)
+    delta = np.empty_like(chirps)
+    delta[:, :lag] = chirps[:, :lag]
+    np.subtract(chirps[:, lag:], chirps[:, :-lag], out=delta[:, lag:])
+    shuffled = np.ascontiguousarray(delta.view(np.uint8).reshape(-1, 2).T)
+    return compress(shuffled, codec, level)
+
+
+def decode_chunk(data, num_frames, frame_len, chirp_len, lag, codec, out=None):
+    if out is None:
+        out = np.empty((num_frames, frame_len), dtype=np.int16)
+    shuffled = np.frombuffer(decompress(data, codec, num_frames * frame_len * 2), dtype=np.uint8)
+    out.view(np.uint8).reshape(-1, 2)[:] = shuffled.reshape(2, -1).T
+    # Undoing the delta is a running sum over the loops of each of the lag chirp positions
+    loops = out.reshape(num_frames, -1, lag, chirp_len)
+    np.cumsum(loops, axis=1, dtype=np.int16, out=loops)
+    return out
+
+
+class ArchiveWriter:
+    # Same interface as FrameRecorder, but frames are compressed in chunks of frames_per_chunk on a
+    # thread pool (zlib, zstd and numpy release the GIL). append() only copies the frame into the
+    # chunk being filled; a background writer waits for the encoded chunks and writes them in order,
+    # so capture never waits on an encoder or the disk. Chunk buffers come back to a free list once
+    # written, and a new one is allocated when none is free, up to max_chunks. Past that, frames are
+    # dropped and counted in frames_dropped until a chunk is written, or with block set append() waits
+    # for one instead. The sidecar index has the FrameRecorder layout, with offset pointing at the
+    # frame's chunk.
+    def __init__(self, path, frame_len, chirp_len, lag=1, frames_per_chunk=25, codec=None, level=None, workers=None,
+                 max_chunks=None, block=False):
+        if frame_len % chirp_len or (frame_len // chirp_len) % lag:
+            raise ValueError(f"Frames of {frame_len} values do not split into chirps of {chirp_len} in multiples of lag {lag}")
+        self.path = path
+        self.frame_len = frame_len
+        self.chirp_len = chirp_len
+        self.lag = lag
+        self.frames_per_chunk = frames_per_chunk
+        self.codec = codec or default_codec()
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown codec: {self.codec}")
+        self.level = DEFAULT_LEVELS[self.codec] if level is None else level
+        self.workers = workers or DEFAULT_WORKERS
+        self.max_chunks = max(max_chunks or DEFAULT_MAX_CHUNKS, self.workers + 1)
+        self.block = block
+        self.count = 0
+        self.frames_dropped = 0
+        self.chunks_allocated = self.workers + 1
+        # Written by the writer thread, final once close() returned
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self._file = open(path, 'wb')
+        self._file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, frame_len, chirp_len, lag, frames_per_chunk, self.codec.encode()))
+        self._index_file = open(index_path(path), 'wb')
+        self._pool = ThreadPoolExecutor(self.workers)
+        self._free = Queue()
+        for _ in range(self.chunks_allocated - 1):
+            self._free.put(self._new_chunk())
+        self._chunk = self._new_chunk()
+        self._records = np.zeros(frames_per_chunk, dtype=INDEX_DTYPE)
+        self._fill = 0
+        # (encoding future, chunk, index records) in append order
+        self._queue = Queue()
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def append(self, frame, lost_packets=0, frame_number=-1, timestamp=None):
+        if self._chunk is None:
+            self._chunk = self._next_chunk()
+            if self._chunk is None:
+                self.frames_dropped += 1
+                return
+        self._chunk[self._fill] = frame.reshape(-1)
+        self._records[self._fill] = (0, time.time() if timestamp is None else timestamp, frame_number, max(lost_packets, 0))
+        self._fill += 1
+        self.count += 1
+        if self._fill == self.frames_per_chunk:
+            self._submit()
+
+    def close(self):
+        if self._fill:
+            self._submit()
+        self._queue.put(None)
+        self._writer.join()
+        self._pool.shutdown()
+        self._file.close()
+        self._index_file.close()
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def ratio(self):
+        return self.bytes_in / self.bytes_out if self.bytes_out else None
+
+    def _new_chunk(self):
+        return np.empty((self.frames_per_chunk, self.frame_len), dtype=np.int16)
+
+    def _submit(self):
+        chunk, records, fill = self._chunk, self._records[:self._fill].copy(), self._fill
+        future = self._pool.submit(encode_chunk, chunk[:fill], self.chirp_len, self.lag, self.codec, self.level)
+        self._queue.put((future, chunk, records))
+        self._fill = 0
+        self._chunk = self._next_chunk()
+
+    def _next_chunk(self):
+        # None when every chunk is in use and no more may be allocated
+        try:
+            return self._free.get_nowait()
+        except Empty:
+            pass
+        if self.chunks_allocated < self.max_chunks:
+            # Encoding or the disk is behind, rather than wait
+            self.chunks_allocated += 1
+            return self._new_chunk()
+        if self.block:
+            return self._free.get()
+        return None
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, chunk, records = item
+            if self._error is None:
+                try:
+                    data = future.result()
+                    records['offset'] = self._file.tell()
+                    self._file.write(CHUNK_HEADER.pack(len(records), len(data)))
+                    self._file.write(data)
+                    self._index_file.write(records.tobytes())
+                    self.bytes_in += len(records) * self.frame_len * 2
+                    self.bytes_out += CHUNK_HEADER.size + len(data)
+                except Exception as e:
+                    # Raised from close(); later chunks are not written, so the archive ends before the gap
+                    self._error = e
+            self._free.put(chunk)
+
+
+class ArchiveReader:
+    # Random access to an archive: the index maps a frame to its chunk, a chunk is read and decoded
+    # on its own, and the last decoded chunk is kept for sequential access
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, self.frame_len, self.chirp_len, self.lag, self.frames_per_chunk, codec = ARCHIVE_HEADER.unpack(f.read(ARCHIVE_HEADER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not a radar archive")
+        self.codec = codec.rstrip(b'\0').decode()
+        self.index = np.fromfile(index_path(path), dtype=INDEX_DTYPE)
+        # First frame of every chunk
+        self.chunk_offsets, self.chunk_starts = np.unique(self.index['offset'], return_index=True)
+        self._cached = (None, None)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, item):
+        chunk = int(np.searchsorted(self.chunk_starts, item, side='right')) - 1
+        return self.read_chunk(chunk)[item - self.chunk_starts[chunk]]
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    @property
+    def num_chunks(self):
+        return len(self.chunk_starts)
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    @property
+    def lost_packets(self):
+        return self.index['lost_packets']
+
+    def read_chunk(self, chunk):
+        # (frames in the chunk, frame_len) int16
+        with self._lock:
+            if self._cached[0] == chunk:
+                return self._cached[1]
+        frames = self._decode(chunk)
+        with self._lock:
+            self._cached = (chunk, frames)
+        return frames
+
+    def iter_chunks(self, workers=None):
+        # Decodes chunks on a thread pool, a few ahead of the consumer, and yields them in order
+        workers = workers or os.cpu_count()
+        with ThreadPoolExecutor(workers) as pool:
+            pending = deque()
+            for chunk in range(self.num_chunks):
+                pending.append(pool.submit(self._decode, chunk))
+                if len(pending) > workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _decode(self, chunk):
+        with open(self.path, 'rb') as f:
+            f.seek(int(self.chunk_offsets[chunk]))
+            num_frames, size = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+            data = f.read(size)
+        return decode_chunk(data, num_frames, self.frame_len, self.chirp_len, self.lag, self.codec)
+
+
+def archive_params(config):
+    # Chirp length in int16 values and the delta lag for the frames of config
+    radar = config['radar']
+    chirp_len = radar['num_rx_antennas'] * radar['num_adc_samples'] * 2
+    return chirp_len, config['archive']['lag'] or radar['num_tx_antennas']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs raw captures into compressed archives and back")
+    parser.add_argument('command', choices=('pack', 'unpack'))
+    parser.add_argument('source', help="capture (.bin) to pack or archive to unpack")
+    parser.add_argument('target')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--workers', type=int, help="encoder / decoder threads, archive.workers by default")
+    args = parser.parse_args()
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    archive = config['archive']
+
+    start = time.perf_counter()
+    if args.command == 'pack':
+        reader = open_capture(args.source, config['dca1000']['dataSizeOneFrame'] // 2, config['dca1000']['BYTES_IN_PACKET'])
+        chirp_len, lag = archive_params(config)
+        writer = ArchiveWriter(args.target, reader.frame_len, chirp_len, lag, archive['frames_per_chunk'],
+                               archive['codec'], archive['level'], args.workers or archive['workers'],
+                               archive['max_chunks'], block=True)
+        timestamps, lost_packets = reader.timestamps, reader.lost_packets
+        for i, frame in enumerate(reader):
+            if timestamps is None:
+                writer.append(frame, frame_number=i, timestamp=0.0)
+            else:
+                writer.append(frame, int(lost_packets[i]), reader.index['frame_number'][i], timestamps[i])
+        writer.close()
+        num_frames, ratio = writer.count, writer.ratio
+    else:
+        reader = ArchiveReader(args.source)
+        num_frames = 0
+        with open(args.target, 'wb') as f:
+            for chunk in reader.iter_chunks(args.workers or archive['workers']):
+                chunk.tofile(f)
+                num_frames += len(chunk)
+        ratio = os.path.getsize(args.target) / os.path.getsize(args.source)
+    elapsed = time.perf_counter() - start
+    frame_bytes = config['dca1000']['dataSizeOneFrame']
+    print(f"{num_frames} frames, ratio {ratio:.2f}, {num_frames * frame_bytes / elapsed / 2 ** 20:.1f} MB/s "
+          f"({num_frames / elapsed:.1f} frames/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ BAUDRATE= 115200
 RADARSS_BIN_PATH =  "C:\\ti\\mmwave_studio_02_01_01_00\\rf_eval_firmware\\radarss\\xwr68xx_radarss.bin"
 MASTERSS_BIN_PATH = "C:\\ti\\mmwave_studio_02_01_01_00\\rf_eval_firmware\\masterss\\xwr68xx_masterss.bin"
 
+-- Polled by the Python side (startup.marker_file in config.yaml), one line per finished phase
+STATUS_FILE_PATH = "C:\\ti\\mmwave_studio_02_01_01_00\\mmWaveStudio\\RunTime\\auto_communication.status"
+
 -----------------------------------------------------------
 
 -------- RADAR SETTINGS -----------------------------------
@@ -27,10 +30,26 @@ TX_START_TIME = 0
 START_CHIRP_TX = 0
 END_CHIRP_TX = 1 
 NUM_FRAMES = 0 -- Set this to 0 to continuously stream data
-CHIRP_LOOPS = 128 
+CHIRP_LOOPS = 64 -- of START_CHIRP_TX..END_CHIRP_TX, 128 chirps per frame
 PERIODICITY = 40 -- ms
 -----------------------------------------------------------
 
+-------- STATUS -------------------------------------------
+function mark(phase)
+    local status_file = io.open(STATUS_FILE_PATH, "a")
+    status_file:write(phase .. "\n")
+    status_file:close()
+end
+
+-- ar1 calls return 0 on success
+function check(result, phase)
+    if result ~= 0 then
+        mark("failed " .. phase)
+        error(phase .. " failed: " .. tostring(result))
+    end
+end
+-----------------------------------------------------------
+
 -------- INIT ---------------------------------------------
 
 dofile("C:\\ti\\mmwave_studio_02_01_01_00\\mmWaveStudio\\Scripts\\AR1xInit.lua")
@@ -38,8 +57,9 @@ ar1.selectRadarMode(0)
 ar1.selectCascadeMode(0)
 ar1.FullReset()
 ar1.SOPControl(2)
-ar1.Connect(COM_PORT,BAUDRATE,1000)
+check(ar1.Connect(COM_PORT,BAUDRATE,1000), "connect")
 ar1.Calling_IsConnected()
+mark("connected")
 -----------------------------------------------------------
 
 -------- DEVICE SETTINGS ----------------------------------
@@ -73,9 +93,12 @@ ar1.LVDSLaneConfig(0, 1, 1, 0, 0, 1, 0, 0)
 
 -------- SENSOR CONFIG ------------------------------------
 ar1.ProfileConfig(0, 60, 100, 6, 60, 0, 0, 0, 0, 0, 0, 29.982, 0, 256, 10000, 0, 131072, 30)
+-- TDM MIMO: chirp 0 on TX1, chirp 1 on TX2, so the chirps of a frame alternate TX1 / TX2
 ar1.ChirpConfig(0, 0, 0, 0, 0, 0, 0, 1, 0, 0)
+ar1.ChirpConfig(1, 1, 0, 0, 0, 0, 0, 0, 1, 0)
 ar1.DisableTestSource(0)
-ar1.FrameConfig(0, 0, 0, 128, 40, 0, 0, 1)
+ar1.FrameConfig(START_CHIRP_TX, END_CHIRP_TX, NUM_FRAMES, CHIRP_LOOPS, PERIODICITY, 0, 0, 1)
+mark("configured")
 -----------------------------------------------------------
 
 -------- ETHERNET -----------------------------------------
@@ -92,7 +115,8 @@ ar1.GetCaptureCardFPGAVersion()
 -------- CAPTURE DATA -------------------------------------
 ar1.CaptureCardConfig_StartRecord("C:\\ti\\mmwave_studio_02_01_01_00\\mmWaveStudio\\PostProc\\adc_data_post_crash.bin", 0)
 
-ar1.StartFrame()
+check(ar1.StartFrame(), "start frame")
+mark("streaming")
 os.execute("timeout /t 2 /nobreak")
 --ar1.StopFrame()
 --os.execute("timeout /t 3 /nobreak")
@@ -1,118 +1,347 @@
+import argparse
+import logging
+import logging.handlers
 import subprocess
 import time
 import threading
-from queue import Queue, Empty
+from queue import Queue
+from queue import Empty
 import numpy as np
-import matplotlib.pyplot as plt
 import yaml
 #from mmwave.dataloader import DCA1000
 from data_fetching import DCA1000
-import mmwave.dsp as dsp
-from mmwave.dsp.utils import Window
-from dashboard import RadarDashboard
-from data_handling import RadarProcessor
+from capture import CaptureEngine, kernel_drops
+from recording import FrameRecorder
+from archive import ArchiveWriter, archive_params
+from frame_handoff import FrameHandoff
+from activity import ActivityGate
+from worker_pool import FrameStages, ProcessingPool, result_dtype, STAGE_NAMES
+from metrics import MetricsRegistry, MetricsServer
+from result_stream import ResultPublisher
+from startup import sensor_startup
+from dca1000_control import ControlThread
+from profile_cfg import RadarProfile
+
+log = logging.getLogger(__name__)
 
 def load_config(config_path='config.yaml'):
     with open(config_path, 'r') as file:
-        return yaml.safe_load(file)
-
-CONFIG = load_config()
+        config = yaml.safe_load(file)
+    if config['radar'].get('profile_cfg'):
+        config = RadarProfile.load(config['radar']['profile_cfg']).apply_to(config)
+    return config
 
+def start_logging(path):
+    # Log records go through a queue to a listener thread that owns the file, so logging from the
+    # frame loop never waits on disk
+    log_queue = Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, logging.FileHandler(path), logging.StreamHandler())
+    for handler in listener.handlers:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    listener.start()
+    return listener
 
 
 class RadarSystem:
-    def __init__(self, config):
+    # headless runs without the dashboard (Dash is not even imported) and serves /metrics on
+    # publish.metrics_port; results reach other processes through the publisher in either mode
+    def __init__(self, config, headless=False):
         self.config = config
-        self.processor = RadarProcessor(config)
+        # The hand status goes to the dashboard and, with the fast path, to subscribers as soon as it
+        # is known, ahead of the rest of the frame's results
+        self.stages = FrameStages(config, on_hand=self.on_hand)
+        self.processor = self.stages.processor
+        # meta of the frame self.stages is processing, for on_hand
+        self.current_meta = None
+        self.result = np.zeros(1, dtype=result_dtype(config))[0]
+        # Idle frames skip the DSP chain (and the pool) when activity_gate.enabled is set
+        self.gate = ActivityGate.from_config(config, self.processor)
+        # With processing.workers > 0 the DSP runs in worker processes instead of the dashboard update thread
+        self.pool = None
+        if config['processing']['workers'] > 0:
+            self.pool = ProcessingPool(config, config['processing']['workers'], on_hand=self.on_hand)
         self.dca = DCA1000(config, config['dca1000']['static_ip'], config['dca1000']['adc_ip'], config['dca1000']['data_port'], config['dca1000']['config_port'])
         #self.dca = DCA1000(config['dca1000']['static_ip'], config['dca1000']['adc_ip'], config['dca1000']['data_port'], config['dca1000']['config_port'])
-        self.dashboard = RadarDashboard()
-        self.data_queue = Queue()
+        self.capture = CaptureEngine(self.dca, config)
+        # Config port commands and SYSTEM_ERROR frames go through an asyncio client on the DCA1000's config socket
+        self.control = ControlThread(config, sock=self.dca.config_socket, on_error=self.on_dca_error)
+        self.recorder = None
+        if config['recording']['enabled'] and config['recording']['format'] == 'archive':
+            archive = config['archive']
+            chirp_len, lag = archive_params(config)
+            self.recorder = ArchiveWriter(config['recording']['path'], self.dca.UINT16_IN_FRAME, chirp_len, lag,
+                                          archive['frames_per_chunk'], archive['codec'], archive['level'], archive['workers'],
+                                          archive['max_chunks'])
+        elif config['recording']['enabled']:
+            self.recorder = FrameRecorder(config['recording']['path'], self.dca.UINT16_IN_FRAME,
+                                          config['recording']['capacity_frames'], config['recording']['flush_every'])
+        self.publisher = ResultPublisher.from_config(config)
+        dashboard_config = config['dashboard']
+        # Set from any thread, the update thread restarts the clutter filters before its next frame
+        self.clutter_reset = threading.Event()
+        self.metrics = MetricsRegistry()
+        self.dashboard = None
+        self.metrics_server = None
+        if headless:
+            self.metrics_server = MetricsServer(self.metrics, config['publish']['metrics_port'])
+        else:
+            from dashboard import RadarDashboard
+            self.dashboard = RadarDashboard(max_points=dashboard_config['max_points'],
+                                            range_time_frames=dashboard_config['range_time_frames'],
+                                            range_db=dashboard_config['range_db'],
+                                            range_doppler_db=dashboard_config['range_doppler_db'],
+                                            metrics=self.metrics, on_reset_background=self.reset_clutter)
+        # Frames from the capture thread are lent from its pool, the handoff copies them into its own
+        # and decides what to drop when processing falls behind
+        processing = config['processing']
+        self.handoff = FrameHandoff(self.dca.UINT16_IN_FRAME, np.int16, policy=processing['handoff_policy'],
+                                    depth=processing['handoff_depth'], every_nth=processing['handoff_every_nth'])
+        self.setup_metrics()
+
+    def setup_metrics(self):
+        # Counters the pipeline already keeps are read when /metrics is scraped; only the stage
+        # latencies are recorded per frame
+        m = self.metrics
+        capture, reassembler, handoff = self.capture, self.dca.reassembler, self.handoff
+        m.counter_fn('packets_received_total', "UDP packets read from the data socket", lambda: capture.packets_received)
+        m.counter_fn('packets_lost_total', "Packets missing from reassembled frames", lambda: reassembler.lost_packets)
+        m.counter_fn('packets_late_total', "Packets that arrived after their frame was emitted", lambda: reassembler.late_packets)
+        m.counter_fn('kernel_drops_total', "Datagrams dropped by the kernel, full receive buffer", lambda: kernel_drops(self.dca.data_socket))
+        client = self.control.client
+        m.counter_fn('dca_system_errors_total', "SYSTEM_ERROR frames sent by the DCA1000", lambda: client.errors_received)
+        m.gauge_fn('dca_last_error_status', "Status of the last SYSTEM_ERROR frame, 0 before the first", lambda: client.last_error[1] if client.last_error else 0)
+        m.counter_fn('frames_captured_total', "Frames reassembled by the capture thread", lambda: capture.frames_captured)
+        m.counter_fn('frames_incomplete_dropped_total', "Frames dropped by the reassembler's loss policy", lambda: reassembler.frames_dropped)
+        m.counter_fn('frames_capture_dropped_total', "Frames dropped at the capture queue", lambda: capture.dropped_frames)
+        m.counter_fn('frames_handoff_skipped_total', "Frames skipped by the every_nth handoff policy", lambda: handoff.frames_skipped)
+        m.counter_fn('frames_handoff_dropped_total', "Frames dropped at the processing handoff", lambda: handoff.frames_dropped)
+        m.counter_fn('frames_handoff_replaced_total', "Waiting frames replaced by newer ones at the processing handoff", lambda: handoff.frames_replaced)
+        m.gauge_fn('capture_queue_depth', "Frames waiting between capture and the main loop", lambda: capture.queued_frames)
+        m.gauge_fn('handoff_queue_depth', "Frames waiting for processing", lambda: handoff.stats()['waiting'])
+        if self.pool is not None:
+            pool = self.pool
+            m.gauge_fn('pool_in_flight', "Frames submitted to the worker pool and not yet shown", lambda: pool.in_flight)
+        self.frames_processed = m.counter('frames_processed_total', "Frames processed and shown")
+        self.stage_latency = {name: m.histogram(f'stage_{name}_seconds', f"Time spent in {name} per frame") for name in STAGE_NAMES}
+        self.stage_latency['dashboard'] = m.histogram('stage_dashboard_seconds', "Time spent handing a frame to the dashboard")
+        self.frame_latency = m.histogram('frame_seconds', "Processing and dashboard time per frame")
+        if self.gate is not None:
+            gate = self.gate
+            m.counter_fn('frames_gated_total', "Idle frames that skipped processing", lambda: gate.frames_skipped)
+            m.counter_fn('activity_wakeups_total', "Changes from idle back to full processing", lambda: gate.wakeups)
+            m.gauge_fn('activity_idle', "1 while the scene is idle and frames are processed at the reduced rate", lambda: int(gate.idle))
+            m.gauge_fn('activity_change', "Change in the hand region from the previous frame, relative to its energy", lambda: gate.last_change)
+            self.gate_latency = m.histogram('activity_gate_seconds', "Time spent deciding whether to process a frame")
+        if isinstance(self.recorder, ArchiveWriter):
+            recorder = self.recorder
+            m.counter_fn('frames_recording_dropped_total', "Frames not archived because every chunk buffer was in use", lambda: recorder.frames_dropped)
+        if self.publisher is not None:
+            publisher = self.publisher
+            m.counter_fn('results_published_total', "Result records handed to the publisher", lambda: publisher.records_published)
+            m.counter_fn('results_dropped_total', "Result records no subscriber took", lambda: publisher.records_dropped)
 
-    def write_to_file(self, data):
-        with open(self.config['paths']['output_file'], 'a') as f:
-            f.write(data + '\n')
+    def observe(self, timings, dashboard_time):
+        for name, seconds in timings.items():
+            self.stage_latency[name].observe(seconds)
+        self.stage_latency['dashboard'].observe(dashboard_time)
+        self.frame_latency.observe(sum(timings.values()) + dashboard_time)
+        self.frames_processed.inc()
+
+    def on_dca_error(self, status):
+        # Runs on the control thread's event loop; the client counts the errors and keeps the last one
+        self.set_status(f"DCA1000 system error, status {status}")
+
+    def set_status(self, status):
+        if self.dashboard is not None:
+            self.dashboard.update_status(status)
 
     def start_mmwave_studio(self):
+        # Proceeds as soon as the Lua script and the DCA1000 report ready instead of sleeping a fixed time
+        marker, orchestrator = sensor_startup(self.config, self.dca, self.control)
+        marker.clear()
         subprocess.Popen(self.config['paths']['cmd_path'], cwd=self.config['paths']['studio_runtime_path'])
-        self.write_to_file("Starting mmWave Studio...")
-        time.sleep(170)
-        self.write_to_file("mmWave Studio should be ready now.")
+        log.info("Starting mmWave Studio...")
+        report = orchestrator.run()
+        log.info("mmWave Studio ready: %s", ", ".join(f"{phase} {seconds:.1f} s" for phase, seconds in report.items()))
 
     def update_dashboard(self):
         while True:
             try:
-                data = self.data_queue.get(timeout=1)
-                if data is None:
-                    break 
-                frame, status = data
-                if status is not None:
-                    self.dashboard.update_status(status)
-                if frame is not None:
-                    self.process_and_update_plots(frame)
+                if self.pool is not None and self.pool.in_flight:
+                    # Wait on the workers rather than the handoff while frames are out, so their results
+                    # (and hand detections ahead of them) go out when ready instead of with the next frame
+                    self.show_pool_results(timeout=0.005)
+                    item = self.handoff.get(timeout=0)
+                else:
+                    item = self.handoff.get(timeout=1)
             except Empty:
                 continue
+            if item is None:
+                break
+            raw_frame, meta = item
+            if self.clutter_reset.is_set():
+                self.clutter_reset.clear()
+                if self.pool is not None:
+                    self.pool.reset_clutter()
+                else:
+                    self.processor.reset_clutter()
+            try:
+                if self.gate is not None and not self.pass_gate(raw_frame):
+                    self.set_status(meta['status'])
+                    if self.pool is not None:
+                        self.show_pool_results()
+                elif self.pool is not None:
+                    self.process_in_pool(raw_frame, meta)
+                else:
+                    self.set_status(meta['status'])
+                    self.process_and_update_plots(raw_frame, meta)
+            finally:
+                self.handoff.release(raw_frame)
+
+    def reset_clutter(self):
+        # After a scene change: the clutter background goes back to the configured one, or is
+        # learned again from the next frames
+        self.clutter_reset.set()
+        log.info("Clutter background reset")
+
+    def pass_gate(self, raw_frame):
+        start = time.perf_counter()
+        process = self.gate(raw_frame)
+        self.gate_latency.observe(time.perf_counter() - start)
+        return process
+
+    def process_and_update_plots(self, raw_frame, meta):
+        self.current_meta = meta
+        points, hand_detected, hand_distance = self.stages(raw_frame, self.result)
+        start = time.perf_counter()
+        self.show_result(self.result, points, hand_detected, hand_distance, meta)
+        self.observe(self.stages.timings, time.perf_counter() - start)
+
+    def show_result(self, result, points, hand_detected, hand_distance, meta):
+        # Subscribers first, they are the ones waiting on the latency
+        if self.publisher is not None:
+            self.publisher.publish(meta['frame_number'], meta['timestamp'], hand_detected, hand_distance, points)
+        if self.dashboard is None:
+            return
+        iq = result['iq']
+        self.dashboard.update_plot("plot-0", (iq.real, iq.imag), "scatter", "Raw ADC Data (I/Q)")
+
+        self.dashboard.update_plot("plot-1", result['sample_profile_db'], "scatter", "Processed Frame Data")
 
-    def process_and_update_plots(self, raw_frame):
-        
-        frame = self.dca.organize(raw_frame, 
-                                      num_chirps=128, 
-                                      num_rx=self.config['radar']['num_rx_antennas'], 
-                                      num_samples=self.config['radar']['num_adc_samples'])
-        
-        #frame = self.dca.generate_frame_data(raw_frame)
-        
-        self.write_to_file(f"Size frame: {frame.shape}")
-        self.write_to_file(f"Type frame RAW: {frame.dtype}")
-        
-        real_data, imag_data = frame[0][0].real, frame[0][0].imag
-        
-        self.dashboard.update_plot("plot-0", (real_data, imag_data), "scatter", "Raw ADC Data (I/Q)")
-    
-        processed_frame = self.processor.process_frame(frame)
-        self.dashboard.update_plot("plot-1", processed_frame, "scatter", "Processed Frame Data")
-
-        range_axis, processed_frame_range_fft, _ = self.processor.process_range_fft(frame)
-        self.dashboard.update_plot("plot-2", (range_axis, processed_frame_range_fft), "scatter", "Range FFT Frame Data")
-
-        hand_detected, detected_distance = self.processor.detect_hand(processed_frame_range_fft, range_axis)
-        hand_status = f"Yes (Distance: {detected_distance:.2f}m)" if hand_detected else "No"
+        range_axis = self.processor.range_axis
+        self.dashboard.update_plot("plot-2", (range_axis, result['range_profile_db']), "scatter", "Range FFT Frame Data")
+        self.dashboard.update_range_time(range_axis, result['range_profile_db'])
+        self.dashboard.update_range_doppler(range_axis, self.processor.doppler_axis, result['range_doppler_db'])
+
+        self.dashboard.update_plot("plot-3", (points['x'], points['y']), "points", "Point Cloud")
+        self.show_hand(hand_detected, hand_distance)
+
+    def on_hand(self, hand_detected, hand_distance, meta=None):
+        # Called by FrameStages (meta is self.current_meta then) or the pool's workers
+        meta = self.current_meta if meta is None else meta
+        if self.publisher is not None and self.stages.fast_path:
+            self.publisher.publish_hand(meta['frame_number'], meta['timestamp'], hand_detected, hand_distance)
+        if self.dashboard is not None:
+            self.show_hand(hand_detected, hand_distance)
+
+    def show_hand(self, hand_detected, hand_distance):
+        hand_status = f"Yes (Distance: {hand_distance:.2f}m)" if hand_detected else "No"
         self.dashboard.update_status(f"Hand above sensor: {hand_status}")
 
+    def process_in_pool(self, raw_frame, meta):
+        # Waits for finished frames while every shared slot is busy, then shows whatever is done
+        while not self.pool.submit(raw_frame, meta):
+            self.show_pool_results(timeout=1)
+        self.show_pool_results()
+
+    def show_pool_results(self, timeout=0.0):
+        for result in self.pool.collect(timeout):
+            try:
+                start = time.perf_counter()
+                self.set_status(result['meta']['status'])
+                self.show_result(result, result['points'], result['hand_detected'], result['hand_distance'], result['meta'])
+                self.observe(result['timings'], time.perf_counter() - start)
+            finally:
+                self.pool.release(result['slot'])
+
     def run(self):
         self.start_mmwave_studio()
-        self.write_to_file("DCA1000 initialized.")
+        log.info("DCA1000 initialized.")
 
-        dashboard_thread = threading.Thread(target=self.dashboard.run, daemon=True)
-        dashboard_thread.start()
-        self.dashboard.update_status("Dashboard initialised.")
-        self.write_to_file("Dashboard thread started.")
+        dashboard_thread = None
+        if self.dashboard is not None:
+            dashboard_thread = threading.Thread(target=self.dashboard.run, daemon=True)
+            dashboard_thread.start()
+            self.dashboard.update_status("Dashboard initialised.")
+            log.info("Dashboard thread started, metrics at http://127.0.0.1:%d/metrics", self.dashboard.port)
+        else:
+            self.metrics_server.start()
+            log.info("Running headless, metrics at http://127.0.0.1:%d/metrics", self.metrics_server.port)
 
         update_thread = threading.Thread(target=self.update_dashboard, daemon=True)
         update_thread.start()
-        self.write_to_file("Dashboard update thread started.")
+        log.info("Dashboard update thread started.")
 
         try:
             self.process_frames()
         except KeyboardInterrupt:
-            print("Stopping the program...")
-        except Exception as e:
-            self.write_to_file(f"An error occurred: {str(e)}")
+            log.info("Stopping the program...")
+        except Exception:
+            log.exception("An error occurred")
         finally:
-            self.data_queue.put((None, None))
+            self.capture.stop()
+            self.control.close()
+            if self.recorder is not None:
+                self.recorder.close()
+            self.handoff.close()
             update_thread.join()
-            dashboard_thread.join()
-            print("Program stopped.")
+            if self.pool is not None:
+                self.pool.close()
+            if self.publisher is not None:
+                self.publisher.close()
+            if dashboard_thread is not None:
+                dashboard_thread.join()
+            else:
+                self.metrics_server.close()
+            log.info("Program stopped.")
 
     def process_frames(self):
+        self.capture.start()
+        log.info("Capture engine started, receive buffer: %d bytes", self.capture.rcvbuf_size)
         while True:
-            raw_frame = self.dca.read()
-            self.data_queue.put((raw_frame, "Reading raw data..."))
+            try:
+                raw_frame, lost_packets, frame_number, frame_time = self.capture.get_frame(timeout=1)
+            except Empty:
+                continue
+            try:
+                if self.recorder is not None:
+                    self.recorder.append(raw_frame, lost_packets, frame_number)
+                # Plain counters only, kernel drops need a /proc read and are left to /metrics
+                handoff = self.handoff
+                status = None
+                if self.dashboard is not None:
+                    status = (f"Reading raw data... lost packets: {self.dca.reassembler.lost_packets}, "
+                              f"dropped frames: capture {self.capture.dropped_frames}, "
+                              f"processing {handoff.frames_dropped + handoff.frames_replaced + handoff.frames_skipped}")
+                self.handoff.put(raw_frame, {"status": status, "frame_number": frame_number, "timestamp": frame_time})
+            finally:
+                self.capture.release(raw_frame)
 
 def main():
-    config = load_config()
-    radar_system = RadarSystem(config)
-    radar_system.run()
+    parser = argparse.ArgumentParser(description="Captures, processes and shows or publishes DCA1000 radar frames")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--headless', action='store_true', help="no dashboard, results only go to the publisher")
+    args = parser.parse_args()
+    config = load_config(args.config)
+    listener = start_logging(config['paths']['output_file'])
+    try:
+        radar_system = RadarSystem(config, headless=args.headless)
+        radar_system.run()
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()
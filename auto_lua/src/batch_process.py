@@ -0,0 +1,234 @@
+import argparse
+import glob
+import logging
+import multiprocessing as mp
+import os
+import re
+import time
+import numpy as np
+import yaml
+from aoa import POINT_DTYPE
+from profile_cfg import RadarProfile
+from recording import open_capture
+from worker_pool import FrameStages, result_dtype
+
+log = logging.getLogger(__name__)
+
+
+def load_config(config_path='config.yaml'):
+    with open(config_path, 'r') as file:
+        config = yaml.safe_load(file)
+    if config['radar'].get('profile_cfg'):
+        config = RadarProfile.load(config['radar']['profile_cfg']).apply_to(config)
+    return config
+
+
+def sweep_key(path):
+    # run.py names recordings file_prefix-b1-...-bn and the DCA1000 CLI appends _Raw_<part>; numbers sort numerically
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', os.path.basename(path))]
+
+
+def discover(paths, prefix=None):
+    # .bin files of a sweep in sweep order: files and globs as given, directories searched for
+    # prefix-*.bin (every .bin without a prefix)
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(glob.glob(os.path.join(path, f'{glob.escape(prefix)}-*.bin' if prefix else '*.bin')))
+        else:
+            found.extend(glob.glob(path))
+    return sorted(set(found), key=sweep_key)
+
+
+def output_path(path, output_dir):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.npz')
+
+
+def is_done(path, output_dir):
+    # Results are written under a temporary name and renamed when complete, and record the size
+    # of the capture they came from, so a capture that grew since is processed again
+    out = output_path(path, output_dir)
+    if not os.path.exists(out):
+        return False
+    with np.load(out) as result:
+        return int(result['source_bytes']) == os.path.getsize(path)
+
+
+def frame_columns(num_frames):
+    # Per-frame results, one array per column
+    return {
+        'hand_detected': np.zeros(num_frames, dtype=bool),
+        'hand_distance': np.full(num_frames, np.nan, dtype=np.float32),
+        'num_points': np.zeros(num_frames, dtype=np.int32),
+        'peak_range': np.zeros(num_frames, dtype=np.float32),
+        'peak_power_db': np.zeros(num_frames, dtype=np.float32),
+        'mean_power_db': np.zeros(num_frames, dtype=np.float32),
+    }
+
+
+# Set up once per worker process by init_worker
+_stages = None
+_result = None
+_frame_len = None
+_packet_bytes = None
+_warmup_frames = None
+
+
+def init_worker(config):
+    global _stages, _result, _frame_len, _packet_bytes, _warmup_frames
+    _stages = FrameStages(config)
+    _result = np.zeros(1, dtype=result_dtype(config))[0]
+    _frame_len = config['dca1000']['dataSizeOneFrame'] // 2
+    _packet_bytes = config['dca1000']['BYTES_IN_PACKET']
+    # mean_chirp clutter removal has no state, only ema needs the frames before a chunk
+    _warmup_frames = config['batch']['clutter_warmup_frames'] if config['clutter_removal']['mode'] == 'ema' else 0
+
+
+def process_chunk(task):
+    # FrameStages over frames [start, stop) of one capture. Every worker opens the file itself (a
+    # mapping, or the chunks of an archive), only the path and the frame range cross the process
+    # boundary on the way in.
+    path, start, stop = task
+    reader = open_capture(path, _frame_len, _packet_bytes)
+    # A worker goes from chunk to chunk and file to file, so the ema clutter background of the last
+    # one would leak into this one. It restarts here and follows the frames just before the chunk, as
+    # it would have in one pass over the capture (the first chunk starts from its first frame).
+    _stages.warm_clutter(reader[i] for i in range(max(start - _warmup_frames, 0), start))
+    range_axis = _stages.processor.range_axis
+    range_profiles = np.empty((stop - start, len(range_axis)), dtype=np.float32)
+    columns = frame_columns(stop - start)
+    clouds = []
+    for i in range(stop - start):
+        points, hand_detected, hand_distance = _stages(reader[start + i], _result)
+        profile = _result['range_profile_db']
+        range_profiles[i] = profile
+        peak = int(np.argmax(profile))
+        columns['hand_detected'][i] = hand_detected
+        if hand_distance is not None:
+            columns['hand_distance'][i] = hand_distance
+        columns['num_points'][i] = len(points)
+        columns['peak_range'][i] = range_axis[peak]
+        columns['peak_power_db'][i] = profile[peak]
+        columns['mean_power_db'][i] = _result['sample_profile_db'].mean()
+        clouds.append(points)
+    detections = np.concatenate(clouds)
+    detection_frame = np.repeat(np.arange(start, stop, dtype=np.int32), [len(points) for points in clouds])
+    return path, start, stop, range_profiles, columns, detections, detection_frame
+
+
+class FileResult:
+    # Collects the chunks of one capture, which come back from the pool in any order
+    def __init__(self, path, num_frames, num_range_bins, num_chunks):
+        self.path = path
+        self.chunks_left = num_chunks
+        self.range_profiles = np.empty((num_frames, num_range_bins), dtype=np.float32)
+        self.columns = frame_columns(num_frames)
+        self.detections = {}
+
+    def add(self, start, stop, range_profiles, columns, detections, detection_frame):
+        self.range_profiles[start:stop] = range_profiles
+        for name, values in columns.items():
+            self.columns[name][start:stop] = values
+        self.detections[start] = (detections, detection_frame)
+        self.chunks_left -= 1
+
+    def save(self, out, range_axis, frame_len, packet_bytes):
+        # Columnar .npz: range profiles as a (frames, range bins) array, one array per frame column and
+        # the point clouds of all frames flattened, with the frame each point belongs to
+        chunks = [self.detections[start] for start in sorted(self.detections)]
+        detections = np.concatenate([chunk[0] for chunk in chunks])
+        arrays = {
+            'source_bytes': np.int64(os.path.getsize(self.path)),
+            'range_axis': range_axis,
+            'range_profile_db': self.range_profiles,
+            'detection_frame': np.concatenate([chunk[1] for chunk in chunks]),
+        }
+        arrays.update({f'frame_{name}': values for name, values in self.columns.items()})
+        arrays.update({f'detection_{name}': detections[name] for name in POINT_DTYPE.names})
+        # Recordings (FrameRecorder or archive) carry timestamps and lost packets, CLI captures with
+        # packet headers lost packets only (nan timestamps), bare CLI captures neither
+        reader = open_capture(self.path, frame_len, packet_bytes)
+        if reader.index is not None:
+            arrays['frame_timestamp'] = reader.timestamps[:len(self.range_profiles)]
+            arrays['frame_lost_packets'] = reader.lost_packets[:len(self.range_profiles)]
+        tmp = out + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, out)
+
+
+def run_batch(config, files, output_dir, num_workers, chunk_frames, force=False):
+    # Splits every capture that is not done yet into chunks of chunk_frames frames, processes the
+    # chunks on num_workers processes and writes each file's results as soon as its last chunk is in
+    frame_len = config['dca1000']['dataSizeOneFrame'] // 2
+    packet_bytes = config['dca1000']['BYTES_IN_PACKET']
+    os.makedirs(output_dir, exist_ok=True)
+    todo = {}
+    skipped = 0
+    for path in files:
+        if not force and is_done(path, output_dir):
+            skipped += 1
+            continue
+        # Also builds the packet index of CLI captures with packet headers once, before the workers need it
+        num_frames = len(open_capture(path, frame_len, packet_bytes))
+        if num_frames == 0:
+            log.warning("%s holds no complete frame", path)
+            continue
+        todo[path] = num_frames
+    log.info("%d captures to process, %d already done", len(todo), skipped)
+
+    if not todo:
+        return {"files_processed": 0, "files_skipped": skipped, "frames": 0, "seconds": 0.0, "frames_per_s": 0.0}
+    tasks = [(path, start, min(start + chunk_frames, num_frames))
+             for path, num_frames in todo.items() for start in range(0, num_frames, chunk_frames)]
+    range_axis = FrameStages(config).processor.range_axis
+    pending = {}
+    frames_done = 0
+    start_time = time.perf_counter()
+    # spawn like ProcessingPool, so Windows and Linux behave the same
+    with mp.get_context('spawn').Pool(num_workers, initializer=init_worker, initargs=(config,)) as pool:
+        for path, start, stop, *chunk in pool.imap_unordered(process_chunk, tasks):
+            if path not in pending:
+                num_frames = todo[path]
+                pending[path] = FileResult(path, num_frames, len(range_axis), -(-num_frames // chunk_frames))
+            result = pending[path]
+            result.add(start, stop, *chunk)
+            frames_done += stop - start
+            if result.chunks_left == 0:
+                result.save(output_path(path, output_dir), range_axis, frame_len, packet_bytes)
+                del pending[path]
+                elapsed = time.perf_counter() - start_time
+                log.info("%s: %d frames done, %.1f frames/s overall", os.path.basename(path), todo[path], frames_done / elapsed)
+    elapsed = time.perf_counter() - start_time
+    return {
+        "files_processed": len(todo),
+        "files_skipped": skipped,
+        "frames": frames_done,
+        "seconds": elapsed,
+        "frames_per_s": frames_done / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the radar processing chain over recorded .bin captures")
+    parser.add_argument('paths', nargs='+', help="capture files, globs or directories (e.g. the Data directory of run.py)")
+    parser.add_argument('--prefix', help="file_prefix given to run.py, selects prefix-*.bin in directories")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--output', help="directory for the .npz results, batch.output_dir by default")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes, every core by default")
+    parser.add_argument('--chunk-frames', type=int, help="frames per task, batch.chunk_frames by default")
+    parser.add_argument('--force', action='store_true', help="process captures that already have results")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    config = load_config(args.config)
+    files = discover(args.paths, args.prefix)
+    if not files:
+        parser.error("no .bin captures found")
+    stats = run_batch(config, files, args.output or config['batch']['output_dir'], args.workers,
+                      args.chunk_frames or config['batch']['chunk_frames'], args.force)
+    log.info("%d captures processed, %d skipped, %d frames in %.1f s (%.1f frames/s)", stats['files_processed'],
+             stats['files_skipped'], stats['frames'], stats['seconds'], stats['frames_per_s'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+import argparse
+import json
+import platform
+import struct
+import sys
+import time
+import tracemalloc
+from queue import Empty
+import numpy as np
+import yaml
+from data_fetching import DCA1000, PACKET_HEADER, deinterleave
+from data_handling import RadarProcessor
+from activity import ActivityGate
+from clutter import MODES, ClutterFilter
+from worker_pool import ProcessingPool
+from capture import CaptureEngine
+from multi_capture import MultiCapture, board_config
+from dca1000_emulator import DCA1000Emulator, synthetic_frames
+
+
+def load_config(config_path='config.yaml'):
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def loopback_config(config):
+    dca_config = dict(config['dca1000'], static_ip='127.0.0.1', adc_ip='127.0.0.1', data_port=0, config_port=0)
+    return dict(config, dca1000=dca_config)
+
+
+def make_loopback_dca(config):
+    config = loopback_config(config)
+    return DCA1000(config, '127.0.0.1', '127.0.0.1', 0, 0)
+
+
+def make_packets(config, num_frames):
+    bytes_in_packet = config['dca1000']['BYTES_IN_PACKET']
+    frame_bytes = config['dca1000']['dataSizeOneFrame']
+    num_packets = num_frames * frame_bytes // bytes_in_packet
+    rng = np.random.default_rng(0)
+    payload = rng.integers(-2048, 2048, bytes_in_packet // 2, dtype=np.int16).tobytes()
+    return [PACKET_HEADER.pack(i + 1, (i * bytes_in_packet) & 0xffffffff, (i * bytes_in_packet) >> 32) + payload
+            for i in range(num_packets)]
+
+
+class ReplaySocket:
+    # Stands in for the data socket, serving a fixed list of packets in a loop
+    def __init__(self, packets):
+        self.packets = packets
+        self.idx = 0
+
+    def _next(self):
+        packet = self.packets[self.idx]
+        self.idx = (self.idx + 1) % len(self.packets)
+        return packet
+
+    def settimeout(self, timeout):
+        pass
+
+    def recvfrom(self, bufsize):
+        return bytes(self._next()), None
+
+    def recv_into(self, buffer):
+        packet = self._next()
+        buffer[:len(packet)] = packet
+        return len(packet)
+
+    def close(self):
+        pass
+
+
+def legacy_read(dca, timeout=1):
+    # The DCA1000.read / _read_data_packet pair as it was before recv_into and byte_count reassembly
+    def read_data_packet():
+        data, _ = dca.data_socket.recvfrom(dca.config['dca1000']['MAX_PACKET_SIZE'])
+        packet_num = struct.unpack('<1l', data[:4])[0]
+        byte_count = struct.unpack('>Q', b'\x00\x00' + data[4:10][::-1])[0]
+        packet_data = np.frombuffer(data[10:], dtype=np.uint16).astype(np.float32)
+        packet_data = (packet_data.astype(np.int16)).astype(np.float32)
+        return packet_num, byte_count, packet_data
+
+    bytes_in_frame_clipped = (dca.BYTES_IN_FRAME // dca.BYTES_IN_PACKET) * dca.BYTES_IN_PACKET
+    packets_in_frame_clipped = dca.BYTES_IN_FRAME // dca.BYTES_IN_PACKET
+
+    dca.data_socket.settimeout(timeout)
+    ret_frame = np.zeros(dca.UINT16_IN_FRAME, dtype=np.float32)
+    while True:
+        packet_num, byte_count, packet_data = read_data_packet()
+        if byte_count % bytes_in_frame_clipped == 0:
+            packets_read = 1
+            ret_frame[0:dca.UINT16_IN_PACKET] = packet_data
+            break
+
+    while True:
+        packet_num, byte_count, packet_data = read_data_packet()
+        packets_read += 1
+
+        if byte_count % bytes_in_frame_clipped == 0:
+            dca.lost_packets = packets_in_frame_clipped - packets_read
+            return ret_frame
+
+        curr_idx = ((packet_num - 1) % packets_in_frame_clipped)
+        try:
+            ret_frame[curr_idx * dca.UINT16_IN_PACKET:(curr_idx + 1) * dca.UINT16_IN_PACKET] = packet_data
+        except:
+            pass
+
+        if packets_read > packets_in_frame_clipped:
+            packets_read = 0
+
+
+def legacy_organize(raw_frame, num_chirps, num_rx, num_samples):
+    # DCA1000.organize before deinterleave: 2 lanes only, complex128
+    ret = np.zeros(len(raw_frame) // 2, dtype=complex)
+    ret[0::2] = raw_frame[0::4] + 1j * raw_frame[2::4]
+    ret[1::2] = raw_frame[1::4] + 1j * raw_frame[3::4]
+    return ret.reshape((num_chirps, num_rx, num_samples))
+
+
+def reference_deinterleave(raw_frame, num_chirps, num_rx, num_samples, num_lanes, iq_swap, ch_interleave):
+    # Index-by-index version of the DCA1000 LVDS layout, used to check deinterleave
+    chirp, rx, sample = np.meshgrid(np.arange(num_chirps), np.arange(num_rx), np.arange(num_samples), indexing='ij')
+    if ch_interleave == 1:
+        k = (chirp * num_rx + rx) * num_samples + sample
+    else:
+        k = (chirp * num_samples + sample) * num_rx + rx
+    i_idx = (k // num_lanes) * 2 * num_lanes + k % num_lanes
+    q_idx = i_idx + num_lanes
+    if iq_swap == 1:
+        i_idx, q_idx = q_idx, i_idx
+    return raw_frame[i_idx].astype(np.float64) + 1j * raw_frame[q_idx].astype(np.float64)
+
+
+def check_deinterleave(config):
+    radar = config['radar']
+    shape = (radar['chirps'], radar['num_rx_antennas'], radar['num_adc_samples'])
+    rng = np.random.default_rng(1)
+    raw = rng.integers(-32768, 32768, 2 * np.prod(shape), dtype=np.int16)
+    for num_lanes in (2, 4):
+        for iq_swap in (0, 1):
+            for ch_interleave in (0, 1):
+                expected = reference_deinterleave(raw, *shape, num_lanes, iq_swap, ch_interleave)
+                actual = deinterleave(raw, *shape, num_lanes=num_lanes, iq_swap=iq_swap, ch_interleave=ch_interleave)
+                if actual.dtype != np.complex64 or not np.array_equal(actual, expected):
+                    raise AssertionError(f"deinterleave mismatch: lanes={num_lanes} iq_swap={iq_swap} ch_interleave={ch_interleave}")
+
+
+def summarize(latencies, items_per_call=1, elapsed=None):
+    latencies = np.asarray(latencies)
+    elapsed = latencies.sum() if elapsed is None else elapsed
+    return {
+        'p50_ms': float(np.percentile(latencies, 50) * 1e3),
+        'p99_ms': float(np.percentile(latencies, 99) * 1e3),
+        'per_s': float(items_per_call * len(latencies) / elapsed),
+    }
+
+
+def peak_memory(fn):
+    # Peak Python and numpy allocations of one call, in MB
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def measure(fn, repeat):
+    fn()
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - start
+    return dict(summarize(latencies), peak_mb=peak_memory(fn))
+
+
+def bench_ingest(config, num_frames=50):
+    packets = make_packets(config, num_frames + 2)
+    dca = make_loopback_dca(config)
+    dca.data_socket.close()
+    dca.data_socket = ReplaySocket(packets)
+    results = {'read_data_packet': measure(dca._read_data_packet, len(packets))}
+    for name, read in (('read legacy', legacy_read), ('read', DCA1000.read)):
+        dca.data_socket = ReplaySocket(packets)
+        results[name] = measure(lambda: read(dca), num_frames)
+    dca.close()
+    return results
+
+
+def bench_processing(config, repeat=50):
+    radar = config['radar']
+    shape = (radar['chirps'], radar['num_rx_antennas'], radar['num_adc_samples'])
+    raw = synthetic_frames(config, config['emulator']['targets'], num_frames=1)[0]
+    dca = make_loopback_dca(config)
+    dca.close()
+    processor = RadarProcessor(config)
+    frame = dca.organize(raw)
+    out = np.empty(shape, dtype=np.complex64)
+    range_axis, range_profile_db, _ = processor.process_range_fft(frame)
+    detections = processor.detect_objects()
+    results = {
+        'organize legacy': measure(lambda: legacy_organize(raw, *shape), repeat),
+        'organize': measure(lambda: dca.organize(raw), repeat),
+        'organize out': measure(lambda: dca.organize(raw, out=out), repeat),
+        'process_frame': measure(lambda: processor.process_frame(frame), repeat),
+        'process_range_fft': measure(lambda: processor.process_range_fft(frame), repeat),
+        'detect_objects': measure(processor.detect_objects, repeat),
+        'point_cloud': measure(lambda: processor.point_cloud(detections), repeat),
+        'detect_hand': measure(lambda: processor.detect_hand(range_profile_db, range_axis), repeat),
+        'detect_hand fast': measure(lambda: processor.detect_hand_fast(raw), repeat),
+    }
+    for mode in MODES:
+        clutter = ClutterFilter(processor.range_cube.shape[1:], mode)
+        results[f'clutter {mode}'] = measure(lambda: clutter.apply(processor.range_cube), repeat)
+    gate = ActivityGate(processor)
+    results['activity gate'] = measure(lambda: gate(raw), repeat)
+
+    detector = processor.cfar
+    range_doppler = np.random.default_rng(3).exponential(1.0, processor.range_doppler.shape).astype(np.float32)
+    range_doppler[processor.num_doppler_bins // 2 + 3, 40] = 1e4
+    modes = detector.range_cfg.mode, detector.doppler_cfg.mode
+    for mode in ('CA', 'CASO', 'OS'):
+        detector.range_cfg.mode = detector.doppler_cfg.mode = mode
+        results[f'cfar range {mode}'] = measure(lambda: detector.detect_range(range_doppler[processor.num_doppler_bins // 2]), repeat)
+        results[f'cfar range-doppler {mode}'] = measure(lambda: detector.detect(range_doppler), repeat)
+    detector.range_cfg.mode, detector.doppler_cfg.mode = modes
+    return results
+
+
+def make_dashboard(config):
+    # Dash is only needed for the plot stage, the rest of the suite runs without it
+    try:
+        from dashboard import RadarDashboard
+    except ImportError:
+        return None
+    return RadarDashboard(**config['dashboard'])
+
+
+def bench_dashboard(config, repeat=50):
+    dashboard = make_dashboard(config)
+    if dashboard is None:
+        return {}
+    range_axis = np.arange(config['radar']['num_adc_samples'], dtype=np.float32) * config['radar']['range_resolution']
+    profile = np.random.default_rng(4).normal(40, 3, len(range_axis)).astype(np.float32)
+    return {'update_plot': measure(lambda: dashboard.update_plot("plot-2", (range_axis, profile), "scatter"), repeat)}
+
+
+class Chain:
+    # The per-frame work of RadarSystem.process_and_update_plots, without the debug file writes
+    def __init__(self, config, dca):
+        self.dca = dca
+        self.processor = RadarProcessor(config)
+        self.dashboard = make_dashboard(config)
+
+    def __call__(self, raw_frame):
+        frame = self.dca.organize(raw_frame)
+        processed_frame = self.processor.process_frame(frame)
+        range_axis, range_profile_db, _ = self.processor.process_range_fft(frame)
+        point_cloud = self.processor.point_cloud(self.processor.detect_objects())
+        hand = self.processor.detect_hand(range_profile_db, range_axis)
+        if self.dashboard is not None:
+            self.dashboard.update_plot("plot-0", (frame[0][0].real, frame[0][0].imag), "scatter")
+            self.dashboard.update_plot("plot-1", processed_frame, "scatter")
+            self.dashboard.update_plot("plot-2", (range_axis, range_profile_db), "scatter")
+            self.dashboard.update_range_time(range_axis, range_profile_db)
+            self.dashboard.update_range_doppler(range_axis, self.processor.doppler_axis, self.processor.range_doppler_db)
+            self.dashboard.update_plot("plot-3", (point_cloud['x'], point_cloud['y']), "points")
+        return hand
+
+
+def bench_chain(config, num_frames=200, frame_rate=0, trace_memory=False):
+    # Emulator -> loopback UDP -> CaptureEngine -> processing chain. Latency is per frame from
+    # get_frame to the hand detection result; frame_rate 0 finds the maximum sustainable rate.
+    dca = make_loopback_dca(config)
+    emulator_config = loopback_config(config)
+    emulator_config['dca1000']['adc_ip'] = config['emulator']['adc_ip']
+    emulator_config['emulator'] = dict(config['emulator'], frame_rate=frame_rate)
+    emulator = DCA1000Emulator(emulator_config, synthetic_frames(emulator_config, config['emulator']['targets']))
+    emulator.host_data = dca.data_socket.getsockname()
+    capture = CaptureEngine(dca, config)
+    chain = Chain(config, dca)
+
+    latencies = []
+    if trace_memory:
+        tracemalloc.start()
+    capture.start()
+    start = time.perf_counter()
+    emulator.start_stream(num_frames)
+    while True:
+        try:
+            raw_frame, lost_packets, _, _ = capture.get_frame(timeout=0.5)
+        except Empty:
+            if emulator.frames_sent >= num_frames:
+                break
+            continue
+        frame_start = time.perf_counter()
+        chain(raw_frame)
+        latencies.append(time.perf_counter() - frame_start)
+        capture.release(raw_frame)
+    # The last get_frame waited out its timeout after the stream ended
+    elapsed = time.perf_counter() - start - 0.5
+    capture.stop()
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    capture_stats = capture.stats()
+    emulator.stop()
+    dca.close()
+    if not latencies:
+        raise RuntimeError("No frames made it through the loopback chain")
+    result = dict(summarize(latencies, elapsed=elapsed), peak_mb=peak_mb)
+    result['packets_per_s'] = capture_stats['packets_received'] / elapsed
+    result['lost_packets'] = capture_stats['lost_packets']
+    result['kernel_drops'] = capture_stats['kernel_drops']
+    result['dropped_frames'] = capture_stats['dropped_frames']
+    return result
+
+
+def bench_pool(config, num_workers, num_frames=50):
+    # Frames/s through ProcessingPool, fed as fast as slots free up; process start-up is not timed
+    frames = synthetic_frames(config, config['emulator']['targets'])
+    pool = ProcessingPool(config, num_workers)
+    latencies = []
+
+    def drain(timeout):
+        for result in pool.collect(timeout):
+            latencies.append(time.perf_counter() - result['meta'])
+            pool.release(result['slot'])
+
+    # One frame per worker first, so every worker has imported and set up before timing starts
+    for i in range(num_workers):
+        pool.submit(frames[i % len(frames)], time.perf_counter())
+    while len(latencies) < num_workers:
+        drain(5)
+    latencies.clear()
+
+    start = time.perf_counter()
+    for i in range(num_frames):
+        while not pool.submit(frames[i % len(frames)], time.perf_counter()):
+            drain(1)
+        drain(0)
+    while len(latencies) < num_frames:
+        drain(1)
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return dict(summarize(latencies, elapsed=elapsed), peak_mb=None)
+
+
+def bench_multi(config, num_boards, num_frames=50):
+    # num_boards emulators on their own loopback addresses -> MultiCapture. Latency is from the
+    # earliest first packet of a set to the set reaching the consumer.
+    frame_rate = config['emulator']['frame_rate']
+    boards = [dict(name=f'board{i}', static_ip='127.0.0.1', adc_ip='127.0.0.1', data_port=0, config_port=0)
+              for i in range(num_boards)]
+    multi = MultiCapture(config, boards)
+    emulators = []
+    for i, board in enumerate(multi.boards):
+        emulator_config = board_config(config, dict(boards[i], adc_ip=f'127.0.0.{i + 2}'))
+        emulator_config['emulator'] = dict(config['emulator'], frame_rate=frame_rate)
+        emulator = DCA1000Emulator(emulator_config, synthetic_frames(emulator_config, config['emulator']['targets']))
+        emulator.host_data = board.dca.data_socket.getsockname()
+        emulators.append(emulator)
+
+    latencies, skews = [], []
+    multi.start()
+    start = time.perf_counter()
+    for emulator in emulators:
+        emulator.start_stream(num_frames)
+    while True:
+        try:
+            buffer, meta = multi.get_set(timeout=0.5)
+        except Empty:
+            if all(emulator.frames_sent >= num_frames for emulator in emulators):
+                break
+            continue
+        latencies.append(time.monotonic() - meta['timestamp'])
+        skews.append(meta['skew'])
+        multi.release(buffer)
+    elapsed = time.perf_counter() - start - 0.5
+    multi.stop()
+    for emulator in emulators:
+        emulator.stop()
+    multi.close()
+    if not latencies:
+        raise RuntimeError("No frame sets made it through the loopback boards")
+    result = dict(summarize(latencies, elapsed=elapsed), peak_mb=None)
+    result['max_skew_ms'] = max(skews) * 1000
+    result['frames_unmatched'] = sum(board.frames_unmatched for board in multi.boards)
+    return result
+
+
+def run_suite(config, num_frames, pool_workers=(), multi_boards=()):
+    check_deinterleave(config)
+    stages = {}
+    stages.update(bench_ingest(config, num_frames))
+    stages.update(bench_processing(config))
+    stages.update(bench_dashboard(config))
+    frame_rate = config['emulator']['frame_rate']
+    paced = bench_chain(config, num_frames * 4, frame_rate)
+    paced['peak_mb'] = bench_chain(config, num_frames, frame_rate, trace_memory=True)['peak_mb']
+    stages[f'chain {frame_rate} fps'] = paced
+    stages['chain max'] = bench_chain(config, num_frames * 4, 0)
+    for num_workers in pool_workers:
+        stages[f'pool {num_workers} workers'] = bench_pool(config, num_workers, num_frames * 2)
+    for num_boards in multi_boards:
+        stages[f'multi {num_boards} boards'] = bench_multi(config, num_boards, num_frames)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'frame_shape': [config['radar']['chirps'], config['radar']['num_rx_antennas'], config['radar']['num_adc_samples']],
+            'frame_rate': frame_rate,
+        },
+        'stages': stages,
+    }
+
+
+def compare(results, baseline, threshold):
+    # A stage regresses when its median latency grows, or its throughput drops, by more than threshold
+    regressions = []
+    for name, stats in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            continue
+        if stats['p50_ms'] > base['p50_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p50 {base['p50_ms']:.3f} -> {stats['p50_ms']:.3f} ms")
+        if stats['per_s'] < base['per_s'] * (1 - threshold):
+            regressions.append(f"{name}: {base['per_s']:,.1f} -> {stats['per_s']:,.1f} /s")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'stage':<28}{'p50 ms':>10}{'p99 ms':>10}{'per s':>14}{'peak MB':>10}")
+    for name, stats in results['stages'].items():
+        peak = '-' if stats['peak_mb'] is None else f"{stats['peak_mb']:.2f}"
+        print(f"{name:<28}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}{stats['per_s']:>14,.1f}{peak:>10}")
+    for name, stats in results['stages'].items():
+        if name.startswith('chain'):
+            print(f"{name}: {stats['packets_per_s']:,.0f} packets/s, lost packets: {stats['lost_packets']}, "
+                  f"kernel drops: {stats['kernel_drops']}, dropped frames: {stats['dropped_frames']}")
+        if name.startswith('multi'):
+            print(f"{name}: max skew {stats['max_skew_ms']:.1f} ms, unmatched frames: {stats['frames_unmatched']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the radar capture and processing path")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--save', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', help="JSON baseline to compare against, exits with 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed relative regression per stage")
+    parser.add_argument('--workers', default='1,2', help="comma separated worker counts for the process pool stages")
+    parser.add_argument('--boards', default='2', help="comma separated board counts for the multi-board capture stages")
+    args = parser.parse_args()
+    config = load_config(args.config)
+
+    pool_workers = [int(n) for n in args.workers.split(',') if n]
+    multi_boards = [int(n) for n in args.boards.split(',') if n]
+    results = run_suite(config, args.frames, pool_workers, multi_boards)
+    print_results(results)
+
+    failed = False
+    frame_rate = config['emulator']['frame_rate']
+    if frame_rate:
+        frame_budget_ms = 1e3 / frame_rate
+        p99_ms = results['stages'][f'chain {frame_rate} fps']['p99_ms']
+        print(f"frame budget: p99 {p99_ms:.2f} ms of {frame_budget_ms:.0f} ms")
+        failed = p99_ms > frame_budget_ms
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
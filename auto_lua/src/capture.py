@@ -0,0 +1,116 @@
+import os
+import select
+import socket
+import sys
+import threading
+import time
+from queue import Empty
+import numpy as np
+from frame_handoff import FrameHandoff
+
+
+def set_receive_buffer(sock, size):
+    # The kernel may clamp the request (net.core.rmem_max on Linux), so return what was granted
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+
+def kernel_drops(sock):
+    # Datagrams the kernel dropped on this socket because its receive buffer was full.
+    # Only Linux exposes a per-socket counter (last column of /proc/net/udp), elsewhere this is None.
+    if not sys.platform.startswith('linux'):
+        return None
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    proc_file = '/proc/net/udp6' if sock.family == socket.AF_INET6 else '/proc/net/udp'
+    try:
+        with open(proc_file, 'r') as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields[9] == inode:
+                    return int(fields[-1])
+    except OSError:
+        return None
+    return None
+
+
+class CaptureEngine:
+    def __init__(self, dca, config):
+        self.dca = dca
+        self.config = config
+        self.batch_size = config['capture']['batch_size']
+        # Frames are copied out of the reassembly ring into a pool of their own, so a consumer that
+        # stalls never reads a slot the ring has reused; new frames are dropped while the pool is full
+        self.frames = FrameHandoff(dca.UINT16_IN_FRAME, np.int16, policy='queue',
+                                   depth=config['capture']['frame_queue_size'])
+        self.rcvbuf_size = set_receive_buffer(dca.data_socket, config['capture']['rcvbuf_size'])
+
+        self.packets_received = 0
+        self.frames_captured = 0
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.dca.data_socket.setblocking(False)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def get_frame(self, timeout=None):
+        # Returns (frame, lost_packets, frame_number, first packet time.monotonic()); raises queue.Empty on timeout.
+        # The frame is a pool buffer, give it back with release() once done with it.
+        item = self.frames.get(timeout=timeout)
+        if item is None:
+            raise Empty
+        frame, (lost_packets, frame_number, frame_time) = item
+        return frame, lost_packets, frame_number, frame_time
+
+    def release(self, frame):
+        self.frames.release(frame)
+
+    @property
+    def dropped_frames(self):
+        return self.frames.frames_dropped
+
+    @property
+    def queued_frames(self):
+        return self.frames.stats()['waiting']
+
+    def stats(self):
+        return {
+            "packets_received": self.packets_received,
+            "lost_packets": self.dca.reassembler.lost_packets,
+            "kernel_drops": kernel_drops(self.dca.data_socket),
+            "frames_captured": self.frames_captured,
+            "incomplete_frames_dropped": self.dca.reassembler.frames_dropped,
+            "dropped_frames": self.dropped_frames,
+        }
+
+    def _run(self):
+        sock = self.dca.data_socket
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([sock], [], [], 0.1)
+            if readable:
+                self._drain(time.monotonic())
+
+    def _drain(self, timestamp):
+        # Empties the socket in batches so one wake-up handles everything the kernel has queued.
+        # Frames are stamped with the wake-up that brought their first packet.
+        for _ in range(self.batch_size):
+            try:
+                packet = self.dca._read_data_packet()
+            except BlockingIOError:
+                return
+            self.packets_received += 1
+            self.dca.reassembler.feed(packet[1], packet[2], timestamp)
+            while self.dca.reassembler.ready:
+                self._hand_off(self.dca.next_frame())
+
+    def _hand_off(self, frame):
+        self.frames_captured += 1
+        self.frames.put(frame, (self.dca.lost_packets, self.dca.frame_number, self.dca.frame_time))
+
@@ -0,0 +1,140 @@
+import numpy as np
+from profile_cfg import read_cfg_commands
+
+# cfarCfg averageMode values, OS is not in the SDK and only used on the Python side
+CFAR_MODES = {0: 'CA', 1: 'CAGO', 2: 'CASO', 3: 'OS'}
+
+DETECTION_DTYPE = np.dtype([
+    ('range_bin', np.int16),
+    ('doppler_bin', np.int16),
+    ('range', np.float32),
+    ('velocity', np.float32),
+    ('snr', np.float32),
+])
+
+
+class CFARConfig:
+    # One cfarCfg line: <subFrameIdx> <procDirection> <averageMode> <winLen> <guardLen> <noiseDiv> <cyclicMode> <thresholdScale dB> <peakGrouping>
+    def __init__(self, mode, win_len, guard_len, cyclic, threshold_db, peak_grouping):
+        if mode not in CFAR_MODES.values():
+            raise ValueError(f"Unknown CFAR mode: {mode}")
+        self.mode = mode
+        self.win_len = win_len
+        self.guard_len = guard_len
+        self.cyclic = cyclic
+        self.threshold_db = threshold_db
+        self.threshold = 10 ** (threshold_db / 10)
+        self.peak_grouping = peak_grouping
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(CFAR_MODES[int(args[2])], int(args[3]), int(args[4]), bool(int(args[6])), float(args[7]), bool(int(args[8])))
+
+
+def noise_estimate(power, axis, cfg, os_rank=0.75):
+    # Noise level around every cell along one axis, from win_len reference cells on each side
+    # beyond guard_len guard cells. Window sums come from a cumulative sum, so the cost is linear
+    # in the number of cells whatever the window size.
+    power = np.moveaxis(power, axis, -1)
+    n = power.shape[-1]
+    w, g = cfg.win_len, cfg.guard_len
+    pad = w + g
+    if cfg.mode == 'OS':
+        mode = 'wrap' if cfg.cyclic else 'reflect'
+        padded = np.pad(power, [(0, 0)] * (power.ndim - 1) + [(pad, pad)], mode=mode)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * pad + 1, axis=-1)
+        reference = np.concatenate((windows[..., :w], windows[..., w + 2 * g + 1:]), axis=-1)
+        k = min(int(os_rank * 2 * w), 2 * w - 1)
+        noise = np.partition(reference, k, axis=-1)[..., k]
+        return np.moveaxis(noise, -1, axis)
+
+    widths = [(0, 0)] * (power.ndim - 1) + [(pad, pad)]
+    if cfg.cyclic:
+        padded = np.pad(power.astype(np.float64), widths, mode='wrap')
+        valid = np.ones(n + 2 * pad)
+    else:
+        padded = np.pad(power.astype(np.float64), widths)
+        valid = np.pad(np.ones(n), (pad, pad))
+    sums = np.concatenate((np.zeros(padded.shape[:-1] + (1,)), np.cumsum(padded, axis=-1)), axis=-1)
+    counts = np.concatenate(([0], np.cumsum(valid)))
+
+    def window_sum(cumulative, start):
+        # Sum of the w cells starting at padded index start + i, for every cell i
+        return cumulative[..., start + w:start + w + n] - cumulative[..., start:start + n]
+
+    left_sum, right_sum = window_sum(sums, 0), window_sum(sums, w + 2 * g + 1)
+    left_count, right_count = window_sum(counts, 0), window_sum(counts, w + 2 * g + 1)
+
+    if cfg.mode == 'CA':
+        noise = (left_sum + right_sum) / np.maximum(left_count + right_count, 1)
+    else:
+        left_mean = left_sum / np.maximum(left_count, 1)
+        right_mean = right_sum / np.maximum(right_count, 1)
+        pick = np.maximum if cfg.mode == 'CAGO' else np.minimum
+        # Near the edges only one side has reference cells, use that side alone
+        noise = np.where(left_count == 0, right_mean, np.where(right_count == 0, left_mean, pick(left_mean, right_mean)))
+    return np.moveaxis(noise.astype(np.float32), -1, axis)
+
+
+def local_peaks(power, axis):
+    # Cells at least as large as both neighbours along axis
+    before = np.roll(power, 1, axis=axis)
+    after = np.roll(power, -1, axis=axis)
+    return (power >= before) & (power >= after)
+
+
+class CFARDetector:
+    def __init__(self, range_cfg, doppler_cfg, range_axis, doppler_axis, range_fov=None, doppler_fov=None, os_rank=0.75):
+        self.range_cfg = range_cfg
+        self.doppler_cfg = doppler_cfg
+        self.range_axis = range_axis
+        self.doppler_axis = doppler_axis
+        self.os_rank = os_rank
+
+        range_fov = range_fov or (-np.inf, np.inf)
+        doppler_fov = doppler_fov or (-np.inf, np.inf)
+        self.range_mask = (range_axis >= range_fov[0]) & (range_axis <= range_fov[1])
+        self.doppler_mask = (doppler_axis >= doppler_fov[0]) & (doppler_axis <= doppler_fov[1])
+
+    @classmethod
+    def from_profile(cls, path, range_axis, doppler_axis, os_rank=0.75):
+        commands = read_cfg_commands(path)
+        cfar = {int(args[1]): CFARConfig.from_args(args) for args in commands['cfarCfg']}
+        fov = {int(args[1]): (float(args[2]), float(args[3])) for args in commands.get('cfarFovCfg', [])}
+        return cls(cfar[0], cfar[1], range_axis, doppler_axis, fov.get(0), fov.get(1), os_rank)
+
+    def detect_range(self, profile, cells=None):
+        # 1D CFAR over a range profile given as linear power, only at the cells set in the cells mask when given
+        noise = noise_estimate(profile, 0, self.range_cfg, self.os_rank)
+        hits = (profile > noise * self.range_cfg.threshold) & self.range_mask
+        if cells is not None:
+            hits &= cells
+        if self.range_cfg.peak_grouping:
+            hits &= local_peaks(profile, 0)
+        range_bins = np.flatnonzero(hits)
+        return self._detections(range_bins, np.full(len(range_bins), -1), profile[range_bins], noise[range_bins])
+
+    def detect(self, range_doppler):
+        # 2D CFAR over a (doppler, range) linear power map: a cell is a detection when it passes
+        # the range CFAR and the Doppler CFAR
+        range_noise = noise_estimate(range_doppler, 1, self.range_cfg, self.os_rank)
+        hits = range_doppler > range_noise * self.range_cfg.threshold
+        hits &= self.range_mask[None, :] & self.doppler_mask[:, None]
+        if not hits.any():
+            return np.empty(0, dtype=DETECTION_DTYPE)
+        hits &= range_doppler > noise_estimate(range_doppler, 0, self.doppler_cfg, self.os_rank) * self.doppler_cfg.threshold
+        if self.range_cfg.peak_grouping:
+            hits &= local_peaks(range_doppler, 1)
+        if self.doppler_cfg.peak_grouping:
+            hits &= local_peaks(range_doppler, 0)
+        doppler_bins, range_bins = np.nonzero(hits)
+        return self._detections(range_bins, doppler_bins, range_doppler[doppler_bins, range_bins], range_noise[doppler_bins, range_bins])
+
+    def _detections(self, range_bins, doppler_bins, power, noise):
+        detections = np.empty(len(range_bins), dtype=DETECTION_DTYPE)
+        detections['range_bin'] = range_bins
+        detections['doppler_bin'] = doppler_bins
+        detections['range'] = self.range_axis[range_bins]
+        detections['velocity'] = np.where(doppler_bins >= 0, self.doppler_axis[doppler_bins], 0)
+        detections['snr'] = 10 * np.log10(power / np.maximum(noise, np.finfo(np.float32).tiny))
+        return detections
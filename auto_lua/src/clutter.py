@@ -0,0 +1,108 @@
+import argparse
+from itertools import islice
+import numpy as np
+import yaml
+from data_fetching import deinterleave
+from recording import open_capture
+
+MODES = ('mean_chirp', 'ema')
+
+
+class ClutterFilter:
+    # Static clutter removal on a (loops, ...) cube, in place. Static reflections (enclosure, table)
+    # are the same in every loop of a frame, so they are the mean over the loops:
+    #   mean_chirp: every frame's own mean is subtracted
+    #   ema: a background that follows that mean as an exponential moving average is subtracted, so
+    #        a hand held still fades out only slowly. It can be seeded from an empty-scene capture,
+    #        otherwise the first frame after a reset seeds it.
+    # The cube can be complex or real; every buffer is allocated here, once.
+    def __init__(self, shape, mode='ema', alpha=0.05, dtype=np.complex64):
+        if mode not in MODES:
+            raise ValueError(f"Unknown clutter removal mode: {mode}")
+        self.mode = mode
+        self.alpha = np.float32(alpha)
+        # shape of one loop
+        self.mean = np.empty(shape, dtype=dtype)
+        self.background = np.zeros(shape, dtype=dtype)
+        self.seeded = False
+
+    @classmethod
+    def from_config(cls, config, shape, dtype=np.complex64):
+        # None when clutter_removal.mode is null
+        clutter = config['clutter_removal']
+        if clutter['mode'] is None:
+            return None
+        return cls(shape, clutter['mode'], clutter['alpha'], dtype)
+
+    def reset(self):
+        # The next frame seeds the background again, e.g. after the scene changed
+        self.seeded = False
+
+    def seed(self, background):
+        self.background[...] = background
+        self.seeded = True
+
+    def apply(self, cube):
+        # sum and scale instead of np.mean, which allocates a temporary buffer
+        np.sum(cube, axis=0, out=self.mean)
+        self.mean *= np.float32(1 / len(cube))
+        if self.mode == 'mean_chirp':
+            cube -= self.mean
+            return cube
+        if self.seeded:
+            # background += alpha * (mean - background), reusing mean as scratch
+            self.mean -= self.background
+            self.mean *= self.alpha
+            self.background += self.mean
+        else:
+            self.background[...] = self.mean
+            self.seeded = True
+        cube -= self.background
+        return cube
+
+
+def estimate_background(raw_frames, config):
+    # Range-FFT background (virtual antennas, range bins) of an empty scene for ClutterFilter.seed:
+    # the range FFT is linear, so the mean over all loops of all frames is transformed just once
+    radar = config['radar']
+    geometry = (radar['chirps'], radar['num_rx_antennas'], radar['num_adc_samples'])
+    lvds = dict(num_lanes=radar['num_lvds_lanes'], iq_swap=radar['iq_swap'], ch_interleave=radar['ch_interleave'])
+    num_loops = radar['chirps'] // radar['num_tx_antennas']
+    frame = np.empty(geometry, dtype=np.complex64)
+    total = np.zeros((radar['num_tx_antennas'] * radar['num_rx_antennas'], radar['num_adc_samples']), dtype=np.complex128)
+    count = 0
+    for raw_frame in raw_frames:
+        deinterleave(raw_frame, *geometry, out=frame, **lvds)
+        total += frame.reshape(num_loops, *total.shape).mean(axis=0)
+        count += 1
+    if not count:
+        raise ValueError("No frames to estimate the background from")
+    window = np.hanning(radar['num_adc_samples']).astype(np.float32)
+    return np.fft.fft(total / count * window, axis=-1).astype(np.complex64)
+
+
+def load_background(path, shape):
+    background = np.load(path)
+    if background.shape != shape:
+        raise ValueError(f"Background {path} is {background.shape}, the radar config needs {shape}")
+    return background.astype(np.complex64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimates the static clutter background from an empty-scene capture")
+    parser.add_argument('capture', help="capture (.bin) of the empty scene")
+    parser.add_argument('background', help=".npy to write, for clutter_removal.background")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--frames', type=int, help="use only the first this many frames")
+    args = parser.parse_args()
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+
+    reader = open_capture(args.capture, config['dca1000']['dataSizeOneFrame'] // 2, config['dca1000']['BYTES_IN_PACKET'])
+    num_frames = len(reader) if args.frames is None else min(args.frames, len(reader))
+    np.save(args.background, estimate_background(islice(reader, num_frames), config))
+    print(f"Background of {num_frames} frames written to {args.background}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,30 +3,51 @@ from dash import dcc, html
 from dash.dependencies import Input, Output, State, ALL
 import plotly.graph_objs as go
 from dash.exceptions import PreventUpdate
+import logging
 import numpy as np
 import time
 import webbrowser
 import threading
 import subprocess
+from flask import Response
+from plot_transport import PlotTransport, QuantizedImage, RangeTimeRing, encode_trace
+
+log = logging.getLogger(__name__)
 
 class RadarDashboard:
-    def __init__(self, port=8050):
+    def __init__(self, port=8050, max_points=1000, range_time_frames=250, range_db=(40, 120), range_doppler_db=(70, 160), metrics=None, on_reset_background=None):
         self.app = dash.Dash(__name__)
         self.port = port
+        # Traces are downsampled to about one point per pixel of plot width
+        self.transport = PlotTransport(max_points)
+        self.range_time_frames = range_time_frames
+        self.range_db = range_db
+        self.range_doppler_db = range_doppler_db
+        # Created on the first frame, once the number of range and Doppler bins is known
+        self.range_time = None
+        self.range_axis = None
+        self.range_doppler = None
         self.plots = {
             "plot-0": {"title": "Raw ADC Data", "xaxis": {}, "yaxis": {}},
             #"plot-x": {"title": "Raw ADC Data - var ", "xaxis": {}, "yaxis": {}},
             "plot-1": {"title": "Processed ADC Data", "xaxis": {}, "yaxis": {}},
-            "plot-2": {"title": "Range Profile Plot", "xaxis": {}, "yaxis": {}}
+            "plot-2": {"title": "Range Profile Plot", "xaxis": {}, "yaxis": {}},
+            "plot-3": {"title": "Point Cloud", "xaxis": {}, "yaxis": {}},
+            "plot-4": {"title": "Range-Doppler", "xaxis": {}, "yaxis": {}}
         }
         self.status = "Initializing..."
         self.hand_status = "No"
         self.hand_distance = None
         self.hand_detection_count = 0
+        self.metrics = metrics
+        # Called from the Reset Background button, restarts the clutter removal after a scene change
+        self.on_reset_background = on_reset_background
         self.setup_layout()
         self.setup_callbacks()
+        if metrics is not None:
+            # Plain-text metrics on the Dash Flask server, for curl or a Prometheus scrape
+            self.app.server.add_url_rule('/metrics', 'metrics', self.serve_metrics)
         self.status_update_time = time.time()
-        self.plot_updates = {}
         
 
     def setup_layout(self):
@@ -34,7 +55,9 @@ class RadarDashboard:
             html.Div([
                 html.H1("Radar Dashboard", style={'display': 'inline-block', 'margin-right': '20px'}),
                 html.Button("Collect Data", id="collect-data-button", n_clicks=0,
-                            style={'float': 'right', 'margin-top': '20px'})
+                            style={'float': 'right', 'margin-top': '20px'}),
+                html.Button("Reset Background", id="reset-background-button", n_clicks=0,
+                            style={'float': 'right', 'margin-top': '20px', 'margin-right': '10px'})
             ]),
             html.Div(id="status", children=f"Status: {self.status}"),
             html.Div(id="plots-container-0", children=[self.create_plot("plot-0", "Raw ADC Data", "ADC Samples", "ADC I/Q Data")]),
@@ -44,10 +67,15 @@ class RadarDashboard:
             html.Div(id="hand-distance", children=""),
             html.Div(id="hand-detection-count", children=f"Hand detection count: {self.hand_detection_count}"),
             html.Div(id="plots-container-2", children=[self.create_plot("plot-2", "Range Profile Plot", "Range (m)", "Range FFT Output (Db)")]),
+            html.Div(id="plots-container-3", children=[self.create_plot("plot-3", "Point Cloud", "x (m)", "y (m)")]),
+            html.Div(id="plots-container-4", children=[self.create_plot("plot-4", "Range-Doppler", "Range (m)", "Velocity (m/s)")]),
+            html.Div(id="range-time-container", children=[dcc.Graph(id="range-time", figure=go.Figure(
+                layout=go.Layout(title="Range-Time", xaxis=dict(title="Range (m)"), yaxis=dict(title="Frame"))))]),
 
             dcc.Interval(id='interval-component', interval=100, n_intervals=0),
-            dcc.Store(id='plot-data-store'),
-            dcc.Store(id='status-store')
+            # Plot versions this browser already has, unchanged plots are not sent again
+            dcc.Store(id='plot-versions', data={}),
+            dcc.Store(id='range-time-version', data=0)
         ])
 
     def setup_callbacks(self):
@@ -73,82 +101,62 @@ class RadarDashboard:
             if n_clicks > 0:
                 return self.execute_data_collection()
             return dash.no_update
+
+        @self.app.callback(
+            Output("status", "children", allow_duplicate=True),
+            Input("reset-background-button", "n_clicks"),
+            prevent_initial_call=True
+        )
+        def reset_background(n_clicks):
+            if n_clicks > 0 and self.on_reset_background is not None:
+                self.on_reset_background()
+                return "Status: Clutter background reset."
+            return dash.no_update
                 
         @self.app.callback(
-            Output('plot-data-store', 'data'),
-            Output('status-store', 'data'),
+            Output({"type": "plot", "index": ALL}, "figure"),
+            Output('plot-versions', 'data'),
             Input('interval-component', 'n_intervals'),
-            State('plot-data-store', 'data'),
-            State('status-store', 'data')
+            State('plot-versions', 'data')
         )
-        def update_plots_and_status(n, current_plot_data, current_status):
-            if current_plot_data is None:
-                current_plot_data = {}
-            
-            for plot_id, (data, plot_type) in self.plot_updates.items():
-                if plot_type == "scatter":
-                    current_plot_data[plot_id] = {
-                        "data": [go.Scatter(x=data[0], y=data[1])],
-                        "layout": go.Layout(
-                            title=self.plots[plot_id]["title"],
-                            xaxis=self.plots[plot_id]["xaxis"],
-                            yaxis=self.plots[plot_id]["yaxis"]
-                        )
-                    }
-                elif plot_type == "iq_scatter":
-                    current_plot_data[plot_id] = {
-                        "data": [
-                            go.Scatter(x=data[0], y=data[1], name="Real (I)", line=dict(color="blue")),
-                            go.Scatter(x=data[0], y=data[2], name="Imaginary (Q)", line=dict(color="red"))
-                        ],
-                        "layout": go.Layout(
-                            title=self.plots[plot_id]["title"],
-                            xaxis=self.plots[plot_id]["xaxis"],
-                            yaxis=self.plots[plot_id]["yaxis"],
-                            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-                        )
-                    }
-                elif plot_type == "heatmap":
-                    current_plot_data[plot_id] = {
-                        "data": [go.Heatmap(z=data[1], x=data[0])],
-                        "layout": go.Layout(
-                            title=self.plots[plot_id]["title"],
-                            xaxis=self.plots[plot_id]["xaxis"],
-                            yaxis=self.plots[plot_id]["yaxis"]
-                        )
-                    }
-            
-            self.plot_updates.clear()
-            
-            if time.time() - self.status_update_time < 0.5:
-                return current_plot_data, self.status
-            return current_plot_data, current_status
+        def update_plots(n, client_versions):
+            client_versions = client_versions or {}
+            versions = self.transport.versions()
+            if all(client_versions.get(plot_id) == version for plot_id, version in versions.items()):
+                raise PreventUpdate
+
+            figures = []
+            for plot_id in ['plot-0', 'plot-1', 'plot-2', 'plot-3', 'plot-4']:
+                if plot_id not in versions or client_versions.get(plot_id) == versions[plot_id]:
+                    figures.append(dash.no_update)
+                    continue
+                version, traces = self.transport.traces(plot_id)
+                versions[plot_id] = version
+                figures.append({"data": traces, "layout": self.plot_layout(plot_id)})
+            return figures, versions
 
         @self.app.callback(
-        Output({"type": "plot", "index": ALL}, "figure"),
-        Input('interval-component', 'n_intervals'),
-        State('plot-data-store', 'data')
+            Output("range-time", "figure"),
+            Output("range-time", "extendData"),
+            Output("range-time-version", "data"),
+            Input('interval-component', 'n_intervals'),
+            State("range-time-version", "data")
         )
-        def update_plots(n, stored_data):
-            if not stored_data:
+        def update_range_time(n, client_version):
+            # Appends only the rows pushed since the browser's version; a new browser, or one that
+            # fell behind by more than the ring holds, gets the whole waterfall once
+            if self.range_time is None:
                 raise PreventUpdate
-            
-            figures = []
-            for plot_id in ['plot-0', 'plot-1', 'plot-2']:
-                if plot_id in stored_data:
-                    figures.append(go.Figure(data=stored_data[plot_id]["data"], 
-                                             layout=stored_data[plot_id]["layout"]))
-                else:
-                    figures.append(go.Figure(data=[go.Scatter(x=[], y=[])],
-                                             layout=go.Layout(title=f"No data for {plot_id}")))
-            return figures
-        
-        def update_plot(self, plot_id, data, plot_type="scatter"):
-            if plot_id not in self.plots and plot_id != "plot-0":
-                print(f"Plot {plot_id} not found")
-                return
-            self.plot_updates[plot_id] = (data, plot_type)
+            version, rows = self.range_time.rows_since(client_version or 0)
+            if version == client_version:
+                raise PreventUpdate
+            if rows is None:
+                return self.range_time_figure(), dash.no_update, version
+            new_rows = {"z": [rows.tolist()], "y": [list(range(version - len(rows), version))]}
+            return dash.no_update, [new_rows, [0], self.range_time_frames], version
 
+    def serve_metrics(self):
+        return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
 
     def create_plot(self, plot_id, title, x_label, y_label):
         self.plots[plot_id]["xaxis"] = dict(title=x_label)
@@ -169,9 +177,36 @@ class RadarDashboard:
             )
         )
 
+    def plot_layout(self, plot_id):
+        layout = {
+            "title": {"text": self.plots[plot_id]["title"]},
+            "xaxis": self.plots[plot_id]["xaxis"],
+            "yaxis": self.plots[plot_id]["yaxis"],
+        }
+        if plot_id == "plot-0":
+            layout["legend"] = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+        return layout
+
+    def range_time_figure(self):
+        version, rows = self.range_time.snapshot()
+        trace = {"type": "heatmap", "x": self.range_axis, "y": np.arange(version - len(rows), version), "z": rows,
+                 "zmin": 0, "zmax": 255, "colorbar": self.range_time.quantizer.colorbar()}
+        return {
+            "data": [encode_trace(trace)],
+            "layout": {"title": {"text": "Range-Time"}, "xaxis": dict(title="Range (m)"), "yaxis": dict(title="Frame")},
+        }
+
+    def create_trace(self, plot_type, x, y):
+        if plot_type == "heatmap":
+            return {"type": "heatmap", "x": x, "z": y}
+        trace = {"type": "scatter", "mode": "markers" if plot_type == "points" else "lines", "y": y}
+        if x is not None:
+            trace["x"] = x
+        return trace
+
     def update_plot(self, plot_id, data, plot_type="scatter", title=None, xaxis=None, yaxis=None):
         if plot_id not in self.plots:
-            print(f"Plot {plot_id} not found")
+            log.warning("Plot %s not found", plot_id)
             return
         if title:
             self.plots[plot_id]["title"] = title
@@ -182,17 +217,31 @@ class RadarDashboard:
         
         if isinstance(data, tuple) and len(data) == 2:
             if plot_id == "plot-0":
-                x_data = list(range(len(data[0])))
-                y_data_real = data[0]
-                y_data_imag = data[1]
-                self.plot_updates[plot_id] = ((x_data, y_data_real, y_data_imag), "iq_scatter")
+                traces = [
+                    {"type": "scatter", "mode": "lines", "y": data[0], "name": "Real (I)", "line": dict(color="blue")},
+                    {"type": "scatter", "mode": "lines", "y": data[1], "name": "Imaginary (Q)", "line": dict(color="red")}
+                ]
             else:
-                x_data, y_data = data
-                self.plot_updates[plot_id] = ((x_data, y_data), plot_type)
+                traces = [self.create_trace(plot_type, data[0], data[1])]
         else:
-            x_data = list(range(len(data)))
-            y_data = data
-            self.plot_updates[plot_id] = ((x_data, y_data), plot_type)
+            traces = [self.create_trace(plot_type, None, data)]
+        # A point cloud is not a trace, downsampling it would drop points
+        self.transport.publish(plot_id, traces, downsample=plot_type == "scatter")
+
+    def update_range_time(self, range_axis, range_profile_db):
+        if self.range_time is None:
+            self.range_axis = np.array(range_axis)
+            self.range_time = RangeTimeRing(len(range_axis), self.range_time_frames, self.range_db)
+        self.range_time.push(range_profile_db)
+
+    def update_range_doppler(self, range_axis, doppler_axis, range_doppler_db):
+        # Quantized into a reused uint8 image on a fixed dB scale, so the colors mean the same every frame
+        if self.range_doppler is None:
+            self.range_doppler = QuantizedImage(range_doppler_db.shape, self.range_doppler_db)
+        image = self.range_doppler.update(range_doppler_db)
+        self.transport.publish("plot-4", [{"type": "heatmap", "x": range_axis, "y": doppler_axis, "z": image,
+                                           "zmin": 0, "zmax": 255, "colorbar": self.range_doppler.colorbar()}],
+                               downsample=False)
 
     def update_status(self, new_status):
         if new_status is None:
@@ -221,7 +270,7 @@ class RadarDashboard:
             
             return "Status: Data collection completed successfully."
         except Exception as e:
-            print(f"Status: Error during data collection: {str(e)}")
+            log.exception("Error during data collection")
             return f"Status: Error during data collection: {str(e)}"
     
     def run(self):
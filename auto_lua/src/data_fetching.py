@@ -1,8 +1,14 @@
-import codecs
+import logging
 import socket
 import struct
 from enum import Enum
 import numpy as np
+from reassembly import FrameReassembler
+
+log = logging.getLogger(__name__)
+
+# <seq num: uint32><byte count: uint48>, little endian
+PACKET_HEADER = struct.Struct('<IIH')
 
 class CMD(Enum):
     RESET_FPGA_CMD_CODE = '0100'
@@ -23,7 +29,69 @@ class CMD(Enum):
     def __str__(self):
         return str(self.value)
 
-# MESSAGE = codecs.decode(b'5aa509000000aaee', 'hex')
+# Config port frames: <header 5aa5><cmd code: uint16><length or status: uint16>[body]<footer aaee>, little endian
+CONFIG_HEADER = b'\x5a\xa5'
+CONFIG_FOOTER = b'\xaa\xee'
+CONFIG_REPLY = struct.Struct('<2sHH2s')
+
+# CONFIG_FPGA_GEN body: raw logging, 2 LVDS lanes, LVDS capture, ethernet streaming, 16 bit, 30 s timeout
+FPGA_CONFIG = bytes.fromhex('01020102031e')
+# CONFIG_PACKET_DATA body: 1472 byte packets, 25 us (3125 cycles) between packets
+PACKET_CONFIG = bytes.fromhex('c005350c0000')
+
+def cmd_code(cmd):
+    # CMD values are the code as it appears on the wire, '0900' is 0x0009
+    return int.from_bytes(bytes.fromhex(str(cmd)), 'little')
+
+def encode_command(cmd, body=b''):
+    return b''.join((CONFIG_HEADER, struct.pack('<HH', cmd_code(cmd), len(body)), body, CONFIG_FOOTER))
+
+def encode_reply(cmd, status=0):
+    return CONFIG_REPLY.pack(CONFIG_HEADER, cmd_code(cmd), status, CONFIG_FOOTER)
+
+def decode_command(data):
+    # (CMD, body) of a command frame as the board receives it, ValueError for anything else
+    if len(data) < 8 or data[:2] != CONFIG_HEADER or data[-2:] != CONFIG_FOOTER:
+        raise ValueError(f"Malformed config command {data.hex()}")
+    code, length = struct.unpack_from('<HH', data, 2)
+    body = data[6:-2]
+    if len(body) != length:
+        raise ValueError(f"Config command with a {len(body)} byte body, the header says {length}")
+    return CMD(code.to_bytes(2, 'little').hex()), body
+
+def decode_reply(data):
+    # (CMD, status) of a reply or an unsolicited SYSTEM_ERROR frame, ValueError for anything else
+    if len(data) != CONFIG_REPLY.size:
+        raise ValueError(f"Config reply of {len(data)} bytes")
+    header, code, status, footer = CONFIG_REPLY.unpack(data)
+    if header != CONFIG_HEADER or footer != CONFIG_FOOTER:
+        raise ValueError(f"Malformed config reply {data.hex()}")
+    return CMD(code.to_bytes(2, 'little').hex()), status
+
+def deinterleave(raw_frame, num_chirps, num_rx, num_samples, num_lanes=2, iq_swap=0, ch_interleave=1, out=None):
+    # The LVDS stream comes in groups of 2 * num_lanes int16 values: num_lanes I samples followed
+    # by num_lanes Q samples (Q first with iq_swap). Concatenating the groups gives the complex samples
+    # in (chirps, rx, samples) order, or (chirps, samples, rx) when channels are interleaved
+    # (ch_interleave 0, as in adcbufCfg). Both halves are read through strided views and written
+    # once into a complex64 (chirps, rx, samples) cube.
+    if num_lanes not in (2, 4):
+        raise ValueError(f"{num_lanes} LVDS lanes are not supported")
+    if raw_frame.size != 2 * num_chirps * num_rx * num_samples:
+        raise ValueError(f"Frame of {raw_frame.size} values does not match {num_chirps}x{num_rx}x{num_samples} complex samples")
+    if out is None:
+        out = np.empty((num_chirps, num_rx, num_samples), dtype=np.complex64)
+
+    # Split the last axis of the stream order by lane, so the groups map onto it without a copy
+    if ch_interleave == 1:
+        target = out.reshape(num_chirps, num_rx, num_samples // num_lanes, num_lanes)
+    else:
+        target = out.reshape(num_chirps, num_rx // num_lanes, num_lanes, num_samples).transpose(0, 3, 1, 2)
+
+    groups = raw_frame.reshape(-1, 2, num_lanes)
+    i_data, q_data = (groups[:, 1], groups[:, 0]) if iq_swap == 1 else (groups[:, 0], groups[:, 1])
+    np.copyto(target.real, i_data.reshape(target.shape))
+    np.copyto(target.imag, q_data.reshape(target.shape))
+    return out
 
 class DCA1000:
     def __init__(self, config, static_ip, adc_ip, data_port, config_port):
@@ -43,15 +111,6 @@ class DCA1000:
 
         self.config_socket.bind(self.cfg_recv)
 
-        self.data = []
-        self.packet_count = []
-        self.byte_count = []
-
-        self.frame_buff = []
-
-        self.curr_buff = None
-        self.last_frame = None
-
         self.lost_packets = None
         self.num_chirps = self.config['radar']['chirps']
         self.num_rx = self.config['radar']['num_rx_antennas']
@@ -61,34 +120,39 @@ class DCA1000:
         self.ch_interleave = self.config['radar']['ch_interleave']
 
         self.BYTES_IN_FRAME = self.config['dca1000']['dataSizeOneFrame'] # 524288
-        self.BYTES_IN_FRAME_CLIPPED = (self.BYTES_IN_FRAME // self.config['dca1000']['BYTES_IN_PACKET']) * self.config['dca1000']['BYTES_IN_PACKET'] # 524160
-        
-        self.PACKETS_IN_FRAME = self.BYTES_IN_FRAME / self.config['dca1000']['BYTES_IN_PACKET'] #360.09
-        self.PACKETS_IN_FRAME_CLIPPED = self.BYTES_IN_FRAME // self.config['dca1000']['BYTES_IN_PACKET'] #360
-        
-        self.UINT16_IN_PACKET = self.config['dca1000']['BYTES_IN_PACKET'] // 2 #728 data points of 16 bits (I + Q) in one packet
+        self.BYTES_IN_PACKET = self.config['dca1000']['BYTES_IN_PACKET'] # 1456
+        self.UINT16_IN_PACKET = self.BYTES_IN_PACKET // 2 #728 data points of 16 bits (I + Q) in one packet
         self.UINT16_IN_FRAME = self.BYTES_IN_FRAME // 2 # 262144 data points of 16 bits in one frame
 
-    def write_to_file(self, data):
-        with open(self.config['paths']['output_file'], 'a') as f:
-            f.write(data + '\n')
+        # Packets are received straight into this buffer, the payload is read through an int16 view of it
+        self.packet_buffer = bytearray(self.config['dca1000']['MAX_PACKET_SIZE'])
+        self.packet_view = memoryview(self.packet_buffer)
+        self.packet_payload = np.frombuffer(self.packet_buffer, dtype=np.int16, offset=PACKET_HEADER.size)
+        # Frames are cut out of the byte stream by byte_count, they do not have to line up with packets
+        self.reassembler = FrameReassembler(self.BYTES_IN_FRAME, self.BYTES_IN_PACKET,
+                                            ring_frames=self.config['dca1000']['ring_frames'],
+                                            reorder_frames=self.config['dca1000']['reorder_frames'],
+                                            loss_policy=self.config['dca1000']['loss_policy'])
+        self.frame_number = None
+        self.frame_time = None
 
     def configure(self):
+        # Blocking version of DCA1000Control.configure, one command after the other
         # SYSTEM_CONNECT_CMD_CODE
         # 5a a5 09 00 00 00 aa ee
-        print(self._send_command(CMD.SYSTEM_CONNECT_CMD_CODE))
+        log.info("Response: %s", self.send_command(CMD.SYSTEM_CONNECT_CMD_CODE).hex())
 
         # READ_FPGA_VERSION_CMD_CODE
         # 5a a5 0e 00 00 00 aa ee
-        print(self._send_command(CMD.READ_FPGA_VERSION_CMD_CODE))
+        log.info("Response: %s", self.send_command(CMD.READ_FPGA_VERSION_CMD_CODE).hex())
 
         # CONFIG_FPGA_GEN_CMD_CODE
         # 5a a5 03 00 06 00 01 02 01 02 03 1e aa ee
-        print(self._send_command(CMD.CONFIG_FPGA_GEN_CMD_CODE, '0600', 'c005350c0000'))
+        log.info("Response: %s", self.send_command(CMD.CONFIG_FPGA_GEN_CMD_CODE, FPGA_CONFIG).hex())
 
         # CONFIG_PACKET_DATA_CMD_CODE 
         # 5a a5 0b 00 06 00 c0 05 35 0c 00 00 aa ee
-        print(self._send_command(CMD.CONFIG_PACKET_DATA_CMD_CODE, '0600', 'c005350c0000'))
+        log.info("Response: %s", self.send_command(CMD.CONFIG_PACKET_DATA_CMD_CODE, PACKET_CONFIG).hex())
 
     def close(self):
         self.data_socket.close()
@@ -96,96 +160,57 @@ class DCA1000:
 
     def read(self, timeout=1):
         self.data_socket.settimeout(timeout)
-        ret_frame = np.zeros(self.UINT16_IN_FRAME, dtype=np.float32)
-        while True:
+        while not self.reassembler.ready:
             packet_num, byte_count, packet_data = self._read_data_packet()
-            if byte_count % self.BYTES_IN_FRAME_CLIPPED == 0:
-                packets_read = 1
-                ret_frame[0:self.UINT16_IN_PACKET] = packet_data
-                break
+            self.reassembler.feed(byte_count, packet_data)
+        return self.next_frame()
 
-        while True:
-            packet_num, byte_count, packet_data = self._read_data_packet()
-            packets_read += 1
+    def next_frame(self):
+        # Pops the oldest reassembled frame, it is a view into the reassembler's ring
+        self.frame_number, frame, self.lost_packets, self.frame_time = self.reassembler.ready.popleft()
+        return frame
 
-            if byte_count % self.BYTES_IN_FRAME_CLIPPED == 0:
-                self.lost_packets = self.PACKETS_IN_FRAME_CLIPPED - packets_read
-                return ret_frame
-
-            curr_idx = ((packet_num - 1) % self.PACKETS_IN_FRAME_CLIPPED)
-            try:
-                ret_frame[curr_idx * self.UINT16_IN_PACKET:(curr_idx + 1) * self.UINT16_IN_PACKET] = packet_data
-            except:
-                pass
-
-            if packets_read > self.PACKETS_IN_FRAME_CLIPPED:
-                packets_read = 0
-    
     def _read_data_packet(self):
-        data, _ = self.data_socket.recvfrom(self.config['dca1000']['MAX_PACKET_SIZE'])
-        packet_num = struct.unpack('<1l', data[:4])[0]
-        byte_count = struct.unpack('>Q', b'\x00\x00' + data[4:10][::-1])[0]
-        packet_data = np.frombuffer(data[10:], dtype=np.uint16).astype(np.float32)
-        packet_data = (packet_data.astype(np.int16)).astype(np.float32)
+        # Returns a view of the shared packet buffer, only valid until the next call
+        nbytes = self.data_socket.recv_into(self.packet_buffer)
+        packet_num, byte_count_lo, byte_count_hi = PACKET_HEADER.unpack_from(self.packet_view)
+        byte_count = byte_count_lo | (byte_count_hi << 32)
+        packet_data = self.packet_payload[:(nbytes - PACKET_HEADER.size) // 2]
         return packet_num, byte_count, packet_data
 
-    def send_command(self, cmd, length='0000', body='', timeout=1):
+    def send_command(self, cmd, body=b'', timeout=1, warn=True):
+        # The raw reply, b'' on timeout
         self.config_socket.settimeout(timeout)
 
-        resp = ''
-        msg = codecs.decode(''.join((self.config['dca1000']['CONFIG_HEADER'], str(cmd), length, body, self.config['dca1000']['CONFIG_FOOTER'])), 'hex')
+        resp = b''
+        msg = encode_command(cmd, body)
         try:
             self.config_socket.sendto(msg, self.cfg_dest)
             resp, addr = self.config_socket.recvfrom(self.config['dca1000']['MAX_PACKET_SIZE'])
-        except socket.timeout as e:
-            print(e)
+        except socket.timeout:
+            if warn:
+                log.warning("No response to command %s", cmd)
         return resp
 
     
 
-    def _listen_for_error(self):
-        self.config_socket.settimeout(None)
-        msg = self.config_socket.recvfrom(self.config['dca1000']['MAX_PACKET_SIZE'])
-        if msg == b'5aa50a000300aaee':
-            print('stopped:', msg)
+    def _listen_for_error(self, timeout=0.0):
+        # Status of a SYSTEM_ERROR frame waiting on the config socket, None if there is none.
+        # DCA1000Control listens for these continuously instead.
+        self.config_socket.settimeout(timeout)
+        try:
+            msg, addr = self.config_socket.recvfrom(self.config['dca1000']['MAX_PACKET_SIZE'])
+            cmd, status = decode_reply(msg)
+        except (socket.timeout, BlockingIOError, ValueError):
+            return None
+        if cmd != CMD.SYSTEM_ERROR_CMD_CODE:
+            return None
+        log.warning("DCA1000 system error, status %d", status)
+        return status
 
     def _stop_stream(self):
-        return self._send_command(CMD.RECORD_STOP_CMD_CODE)
-
-    def dp_reshape2LaneLVDS(raw_data):
-        raw_data_4 = raw_data.reshape(4, -1)
-        raw_data_I = raw_data_4[:2, :].reshape(-1, order='F')
-        raw_data_Q = raw_data_4[2:, :].reshape(-1, order='F')
-        frame_data = np.column_stack((raw_data_I, raw_data_Q))
-        return frame_data
-    
-    def generate_frame_data(self, raw_data):
-        if self.num_lanes == 2:
-            frame_data = self.dp_reshape2LaneLVDS(raw_data)
-        else:
-            raise ValueError(f"{self.num_lanes} LVDS lanes are not supported")
-
-        #switch ReIm to ImRe
-        if self.iq_swap == 1:
-            frame_data[:, [0, 1]] = frame_data[:, [1, 0]]
-
-        frame_complex = frame_data[:, 0] + 1j * frame_data[:, 1]
-
-        frame_complex = frame_complex.reshape(self.num_chirps, self.num_rx, self.num_samples)
-
-        if self.ch_interleave == 1:
-            frame_complex = frame_complex.transpose(0, 2, 1)
+        return self.send_command(CMD.RECORD_STOP_CMD_CODE)
 
-        return frame_complex.astype(np.single)
-    
-    @staticmethod
-    def organize(raw_frame, num_chirps, num_rx, num_samples):   
-        ret = np.zeros(len(raw_frame) // 2, dtype=complex)
-
-        # Separate IQ data
-        ret[0::2] = raw_frame[0::4] + 1j * raw_frame[2::4]
-        ret[1::2] = raw_frame[1::4] + 1j * raw_frame[3::4]
-        return ret.reshape((num_chirps, num_rx, num_samples))
-
-    
-    
+    def organize(self, raw_frame, out=None):
+        return deinterleave(raw_frame, self.num_chirps, self.num_rx, self.num_samples,
+                            num_lanes=self.num_lanes, iq_swap=self.iq_swap, ch_interleave=self.ch_interleave, out=out)
@@ -1,36 +1,221 @@
+import time
 import numpy as np
 import mmwave.dsp as dsp
-from mmwave.dsp.utils import Window
+from cfar import CFARDetector
+from clutter import ClutterFilter, load_background
+from aoa import AoAEstimator
+from data_fetching import deinterleave
+
+# numpy >= 2.0 can write FFTs into a given (complex64) buffer, older versions always return a new complex128 array
+FFT_HAS_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+
+def fft_into(buffer, axis):
+    if FFT_HAS_OUT:
+        np.fft.fft(buffer, axis=axis, out=buffer)
+    else:
+        buffer[...] = np.fft.fft(buffer, axis=axis)
+    return buffer
+
 
 class RadarProcessor:
     def __init__(self, config):
         self.config = config
-        self.num_chirps_per_frame = config['radar']['num_tx_antennas'] * config['radar']['num_loops_per_frame']
+        self.num_tx = config['radar']['num_tx_antennas']
+        self.num_rx = config['radar']['num_rx_antennas']
+        self.num_chirps_per_frame = config['radar']['chirps']
+        # TDM MIMO: consecutive chirps cycle through the TX antennas, one loop gives every virtual antenna once
+        self.num_loops = self.num_chirps_per_frame // self.num_tx
+        self.num_virtual_antennas = self.num_tx * self.num_rx
         self.num_range_bins = config['radar']['num_adc_samples']
-        self.num_doppler_bins = config['radar']['num_loops_per_frame']
+        self.num_doppler_bins = self.num_loops
         self.range_resolution, self.bandwidth = dsp.range_resolution(config['radar']['num_adc_samples'], config['radar']['sample_rate'])
         self.doppler_resolution = dsp.doppler_resolution(self.bandwidth)
 
+        # Everything below only depends on the config, so it is computed once and reused every frame
+        self.range_axis = (np.arange(self.num_range_bins) * config['radar']['range_resolution']).astype(np.float32)
+        self.doppler_axis = (np.arange(-(self.num_doppler_bins // 2), self.num_doppler_bins - self.num_doppler_bins // 2)
+                             * config['radar']['velocity_resolution']).astype(np.float32)
+        self.range_window = np.hanning(self.num_range_bins).astype(np.float32)
+        doppler_window = np.hanning(self.num_doppler_bins)
+        # Alternating the sign of the loops moves zero Doppler to the middle, the FFT output comes out fftshifted
+        self.doppler_window = (doppler_window * (-1.0) ** np.arange(self.num_doppler_bins)).astype(np.float32)[:, None, None]
+        # Turns summed Doppler power back into mean power per chirp and antenna (Parseval), on the scale of a single chirp
+        self.profile_scale = np.float32(1.0 / (self.num_doppler_bins * np.sum(doppler_window ** 2) * self.num_virtual_antennas))
+
+        cube_shape = (self.num_loops, self.num_virtual_antennas, self.num_range_bins)
+        self.range_cube = np.empty(cube_shape, dtype=np.complex64)
+        self.doppler_cube = np.empty(cube_shape, dtype=np.complex64)
+        self.power_cube = np.empty(cube_shape, dtype=np.float32)
+        self.sample_power = np.empty((self.num_chirps_per_frame, self.num_rx, self.num_range_bins), dtype=np.float32)
+        self.range_doppler = np.empty((self.num_doppler_bins, self.num_range_bins), dtype=np.float32)
+        self.range_doppler_db = np.empty_like(self.range_doppler)
+        self.range_profile = np.empty(self.num_range_bins, dtype=np.float32)
+        self.range_profile_db = np.empty_like(self.range_profile)
+        self.sample_profile_db = np.empty(self.num_range_bins, dtype=np.float32)
+
+        self.cfar = CFARDetector.from_profile(config['cfar']['profile_cfg'], self.range_axis, self.doppler_axis,
+                                              os_rank=config['cfar']['os_rank'])
+        self.aoa = AoAEstimator.from_config(config)
+
+        # Hand detection fast path: the range profile at the bins between min_range and max_range and the
+        # CFAR window around them, straight from the raw LVDS frame by one real matrix multiply. The
+        # matrix holds a partial DFT with the range window folded in, its rows placed where the
+        # deinterleaved I and Q samples sit in the raw stream. Summing Doppler power equals summing the
+        # loop power weighted by the squared Doppler window (Parseval), so no Doppler FFT is needed.
+        radar = config['radar']
+        n = self.num_range_bins
+        hand_config = config['hand_detection']
+        hand_bins = np.flatnonzero((self.range_axis >= hand_config['min_range']) & (self.range_axis <= hand_config['max_range']))
+        margin = self.cfar.range_cfg.win_len + self.cfar.range_cfg.guard_len + 1
+        # CFAR of a hand bin only reads these, the others stay 0 in roi_profile
+        self.roi_bins = np.unique(np.arange(hand_bins[0] - margin, hand_bins[-1] + margin + 1) % n)
+        self.roi_mask = np.zeros(n, dtype=bool)
+        self.roi_mask[hand_bins] = True
+        dft = self.range_window[:, None] * np.exp(-2j * np.pi * np.arange(n)[:, None] * self.roi_bins[None, :] / n)
+        # Without channel interleaving every RX's samples are contiguous, so one matrix row block serves all of them
+        rx_per_row = 1 if radar['ch_interleave'] == 1 else self.num_rx
+        positions = deinterleave(np.arange(2 * rx_per_row * n, dtype=np.int16), 1, rx_per_row, n, num_lanes=radar['num_lvds_lanes'],
+                                 iq_swap=radar['iq_swap'], ch_interleave=radar['ch_interleave'])[0]
+        matrix = np.zeros((2 * rx_per_row * n, rx_per_row, 2, len(self.roi_bins)), dtype=np.float32)
+        for rx in range(rx_per_row):
+            i_rows, q_rows = positions[rx].real.astype(np.intp), positions[rx].imag.astype(np.intp)
+            # (I + jQ)(Wr + jWi) = (I Wr - Q Wi) + j(I Wi + Q Wr)
+            matrix[i_rows, rx, 0], matrix[q_rows, rx, 0] = dft.real, -dft.imag
+            matrix[i_rows, rx, 1], matrix[q_rows, rx, 1] = dft.imag, dft.real
+        self.roi_matrix = matrix.reshape(2 * rx_per_row * n, -1)
+        num_rows = self.num_chirps_per_frame * self.num_rx // rx_per_row
+        self.roi_raw = np.empty((num_rows, 2 * rx_per_row * n), dtype=np.float32)
+        self.roi_spectrum = np.empty((num_rows, self.roi_matrix.shape[1]), dtype=np.float32)
+        self.roi_loop_weight = (self.num_doppler_bins * doppler_window ** 2 * self.profile_scale).astype(np.float32)
+        self.roi_profile = np.zeros(n, dtype=np.float32)
+
+        # Static clutter removal after the range FFT; the fast path keeps its own filter over the real
+        # and imaginary parts of its bins, which follows the same background since both are linear
+        self.clutter = ClutterFilter.from_config(config, cube_shape[1:])
+        self.roi_clutter = ClutterFilter.from_config(config, (self.num_virtual_antennas, 2, len(self.roi_bins)), np.float32)
+        # Background of an empty scene to start from, instead of the first frame
+        self.clutter_background = None
+        if self.clutter is not None and config['clutter_removal']['background']:
+            self.clutter_background = load_background(config['clutter_removal']['background'], cube_shape[1:])
+            self.seed_clutter(self.clutter_background)
+
+        self.latency_budget = config['processing']['latency_budget_ms'] / 1e3
+        self.last_latency = 0.0
+        self.frames_over_budget = 0
+
+    def seed_clutter(self, background):
+        # background: (virtual antennas, range bins) range FFT of the empty scene, see clutter.estimate_background
+        self.clutter.seed(background)
+        roi = background[:, self.roi_bins]
+        self.roi_clutter.seed(np.stack((roi.real, roi.imag), axis=1))
+
+    def reset_clutter(self):
+        # Back to the configured background, or to seeding from the next frame without one
+        if self.clutter is None:
+            return
+        if self.clutter_background is not None:
+            self.seed_clutter(self.clutter_background)
+        else:
+            self.clutter.reset()
+            self.roi_clutter.reset()
+
+    def warm_clutter(self, frame, raw_frame):
+        # Runs frame (organized) and raw_frame (the same frame as it came in) through the clutter
+        # filters only, so the ema background follows them without the rest of the chain
+        if self.clutter is None:
+            return
+        cube = frame.reshape(self.num_loops, self.num_virtual_antennas, self.num_range_bins)
+        np.multiply(cube, self.range_window, out=self.range_cube)
+        fft_into(self.range_cube, axis=-1)
+        self.clutter.apply(self.range_cube)
+        self.roi_raw[...] = raw_frame.reshape(self.roi_raw.shape)
+        np.matmul(self.roi_raw, self.roi_matrix, out=self.roi_spectrum)
+        self.roi_clutter.apply(self.roi_spectrum.reshape(self.num_loops, self.num_virtual_antennas, 2, -1))
+
     def detect_hand(self, processed_frame, range_axis):
+        # CFAR over the range profile (in dB) instead of a fixed threshold, so gain and scene changes do not matter
+        detections = self.cfar.detect_range(10 ** (processed_frame / 10))
+        return self.hand_from_detections(detections, range_axis)
+
+    def detect_hand_fast(self, raw_frame):
+        # detect_hand straight from a raw frame, without organizing it and computing only the range
+        # bins it looks at, so the decision does not wait for the full cube
+        self.roi_raw[...] = raw_frame.reshape(self.roi_raw.shape)
+        np.matmul(self.roi_raw, self.roi_matrix, out=self.roi_spectrum)
+        # (loop, virtual antenna, real / imaginary, bin)
+        spectrum = self.roi_spectrum.reshape(self.num_loops, self.num_virtual_antennas, 2, -1)
+        if self.roi_clutter is not None:
+            self.roi_clutter.apply(spectrum)
+        np.square(self.roi_spectrum, out=self.roi_spectrum)
+        power = spectrum.sum(axis=(1, 2))
+        self.roi_profile[self.roi_bins] = self.roi_loop_weight @ power
+        return self.hand_from_detections(self.cfar.detect_range(self.roi_profile, self.roi_mask), self.range_axis)
+
+    def hand_from_detections(self, detections, range_axis):
+        # The strongest range CFAR detection between min_range and max_range
         hand_config = self.config['hand_detection']
-        valid_range_indices = np.where((range_axis >= hand_config['min_range']) & (range_axis <= hand_config['max_range']))[0]
-        hand_detected = np.any(processed_frame[valid_range_indices] > hand_config['threshold_db'])
-        
+        detected_ranges = range_axis[detections['range_bin']]
+        in_range = (detected_ranges >= hand_config['min_range']) & (detected_ranges <= hand_config['max_range'])
+        hand_detected = bool(np.any(in_range))
+
         if hand_detected:
-            max_value_index = np.argmax(processed_frame[valid_range_indices])
-            detected_distance = range_axis[valid_range_indices[max_value_index]]
+            detected_distance = detected_ranges[in_range][np.argmax(detections['snr'][in_range])]
         else:
             detected_distance = None
-        
+
         return hand_detected, detected_distance
 
+    def detect_objects(self):
+        # 2D CFAR over the range-Doppler map of the last process_cube call
+        return self.cfar.detect(self.range_doppler)
+
+    def point_cloud(self, detections):
+        # Angle of arrival for each detection of the last process_cube call
+        return self.aoa.estimate(self.doppler_cube, detections)
+
     def process_frame(self, frame):
-        magnitudes = np.abs(frame[0][0])
-        return 20 * np.log10(magnitudes)
+        # Mean sample power over all chirps and antennas instead of the magnitude of one chirp
+        np.abs(frame, out=self.sample_power)
+        np.square(self.sample_power, out=self.sample_power)
+        self.sample_profile_db[:] = self.sample_power.reshape(-1, self.num_range_bins).mean(axis=0)
+        return to_db(self.sample_profile_db, out=self.sample_profile_db)
 
     def process_range_fft(self, frame):
-        max_range = self.config['radar']['range_resolution'] * self.num_range_bins
-        radar_cube = dsp.range_processing(frame, window_type_1d=Window.HANNING)
-        magnitude_db = 20 * np.log10(np.abs(radar_cube[0][0]))
-        range_axis = np.linspace(0, max_range, self.num_range_bins)
-        return range_axis, magnitude_db, radar_cube
\ No newline at end of file
+        range_doppler_db, range_profile_db = self.process_cube(frame)
+        return self.range_axis, range_profile_db, self.range_cube
+
+    def process_cube(self, frame):
+        # Range FFT, Doppler FFT and non-coherent integration over all loops and virtual antennas.
+        # Returns the range-Doppler map and the integrated range profile in dB; both are buffers
+        # that the next call overwrites.
+        start = time.perf_counter()
+        cube = frame.reshape(self.num_loops, self.num_virtual_antennas, self.num_range_bins)
+        np.multiply(cube, self.range_window, out=self.range_cube)
+        fft_into(self.range_cube, axis=-1)
+        if self.clutter is not None:
+            self.clutter.apply(self.range_cube)
+        np.multiply(self.range_cube, self.doppler_window, out=self.doppler_cube)
+        fft_into(self.doppler_cube, axis=0)
+
+        np.abs(self.doppler_cube, out=self.power_cube)
+        np.square(self.power_cube, out=self.power_cube)
+        np.sum(self.power_cube, axis=1, out=self.range_doppler)
+        np.sum(self.range_doppler, axis=0, out=self.range_profile)
+        self.range_profile *= self.profile_scale
+
+        to_db(self.range_doppler, out=self.range_doppler_db)
+        to_db(self.range_profile, out=self.range_profile_db)
+
+        self.last_latency = time.perf_counter() - start
+        if self.last_latency > self.latency_budget:
+            self.frames_over_budget += 1
+        return self.range_doppler_db, self.range_profile_db
+
+
+def to_db(power, out=None):
+    # 10 * log10 of a power, equal to 20 * log10 of the magnitude
+    out = np.maximum(power, np.finfo(np.float32).tiny, out=out)
+    np.log10(out, out=out)
+    out *= 10
+    return out
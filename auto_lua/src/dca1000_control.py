@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+import time
+from data_fetching import CMD, FPGA_CONFIG, PACKET_CONFIG, decode_reply, encode_command
+
+log = logging.getLogger(__name__)
+
+
+class DCA1000Error(RuntimeError):
+    pass
+
+
+class CommandTimeout(DCA1000Error):
+    pass
+
+
+class _ControlProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._received(data)
+
+    def error_received(self, exc):
+        log.warning("DCA1000 config port: %s", exc)
+
+
+class DCA1000Control:
+    # asyncio client for the DCA1000 config port. Each command has its own timeout and retries, and
+    # commands with different codes can be in flight at the same time since the board echoes the code
+    # in its reply. SYSTEM_ERROR frames the board sends on its own are picked up whenever they arrive,
+    # nothing ever blocks on the socket; only the last one is kept, next to a count of all of them.
+    def __init__(self, config, timeout=None, retries=None, on_error=None):
+        dca = config['dca1000']
+        self.local = (dca['static_ip'], dca['config_port'])
+        self.remote = (dca['adc_ip'], dca['config_port'])
+        self.timeout = dca['command_timeout'] if timeout is None else timeout
+        self.retries = dca['command_retries'] if retries is None else retries
+        # Called with the status of every SYSTEM_ERROR frame
+        self.on_error = on_error
+        self.transport = None
+        self._pending = {}
+        self._locks = {}
+        # (monotonic time, status) of the last SYSTEM_ERROR frame, None before the first
+        self.last_error = None
+        self._error_waiter = None
+
+        self.commands_sent = 0
+        self.retries_used = 0
+        self.errors_received = 0
+        self.unexpected_replies = 0
+
+    async def connect(self, sock=None):
+        # sock reuses an already bound config socket, e.g. DCA1000.config_socket
+        loop = asyncio.get_running_loop()
+        if sock is not None:
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: _ControlProtocol(self), sock=sock)
+        else:
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: _ControlProtocol(self), local_addr=self.local)
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+
+    def _received(self, data):
+        try:
+            cmd, status = decode_reply(data)
+        except ValueError:
+            self.unexpected_replies += 1
+            return
+        if cmd == CMD.SYSTEM_ERROR_CMD_CODE:
+            self.errors_received += 1
+            log.warning("DCA1000 system error, status %d", status)
+            self.last_error = (time.monotonic(), status)
+            if self._error_waiter is not None and not self._error_waiter.done():
+                self._error_waiter.set_result(self.last_error)
+            if self.on_error is not None:
+                self.on_error(status)
+            return
+        future = self._pending.get(cmd)
+        if future is None or future.done():
+            # A reply to a retried command that already got one
+            self.unexpected_replies += 1
+            return
+        future.set_result(status)
+
+    async def command(self, cmd, body=b'', timeout=None, retries=None):
+        # Status field of the reply; CommandTimeout when every attempt timed out
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        msg = encode_command(cmd, body)
+        lock = self._locks.setdefault(cmd, asyncio.Lock())
+        async with lock:
+            for attempt in range(retries + 1):
+                future = asyncio.get_running_loop().create_future()
+                self._pending[cmd] = future
+                self.transport.sendto(msg, self.remote)
+                self.commands_sent += 1
+                if attempt:
+                    self.retries_used += 1
+                try:
+                    return await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    continue
+                finally:
+                    self._pending.pop(cmd, None)
+        raise CommandTimeout(f"No reply to {cmd.name} after {retries + 1} attempts of {timeout * 1000:.0f} ms")
+
+    async def checked(self, cmd, body=b'', **kwargs):
+        status = await self.command(cmd, body, **kwargs)
+        if status != 0:
+            raise DCA1000Error(f"{cmd.name} failed with status {status}")
+        return status
+
+    async def system_connect(self, **kwargs):
+        return await self.checked(CMD.SYSTEM_CONNECT_CMD_CODE, **kwargs)
+
+    async def fpga_version(self, **kwargs):
+        # The version comes back in the status field
+        return await self.command(CMD.READ_FPGA_VERSION_CMD_CODE, **kwargs)
+
+    async def configure(self, fpga_config=FPGA_CONFIG, packet_config=PACKET_CONFIG):
+        # The same commands as DCA1000.configure, sent together instead of one timeout after the other
+        await self.system_connect()
+        version, _, _ = await asyncio.gather(self.fpga_version(),
+                                             self.checked(CMD.CONFIG_FPGA_GEN_CMD_CODE, fpga_config),
+                                             self.checked(CMD.CONFIG_PACKET_DATA_CMD_CODE, packet_config))
+        log.info("DCA1000 configured, FPGA version %04x", version)
+        return version
+
+    async def record_start(self, **kwargs):
+        return await self.checked(CMD.RECORD_START_CMD_CODE, **kwargs)
+
+    async def record_stop(self, **kwargs):
+        return await self.checked(CMD.RECORD_STOP_CMD_CODE, **kwargs)
+
+    async def next_error(self):
+        # (monotonic time, status) of the next SYSTEM_ERROR frame
+        if self._error_waiter is None or self._error_waiter.done():
+            self._error_waiter = asyncio.get_running_loop().create_future()
+        return await asyncio.shield(self._error_waiter)
+
+
+class ControlThread:
+    # Runs a DCA1000Control on its own event loop in a daemon thread, for the thread-based capture
+    # code: run(control.client.record_start()) blocks only the calling thread
+    def __init__(self, config, sock=None, on_error=None):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.run(self._connect(config, sock, on_error))
+
+    async def _connect(self, config, sock, on_error):
+        # The client's locks and futures have to be created on the loop that uses them
+        return await DCA1000Control(config, on_error=on_error).connect(sock)
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.client.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,244 @@
+import argparse
+import random
+import socket
+import threading
+import time
+import numpy as np
+import yaml
+from data_fetching import CMD, PACKET_HEADER, decode_command, encode_reply
+from recording import open_capture
+
+
+def load_config(config_path='config.yaml'):
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def interleave(cube, num_lanes=2, iq_swap=0, ch_interleave=1):
+    # Inverse of data_fetching.deinterleave: complex (chirps, rx, samples) cube to the LVDS int16 stream
+    num_chirps, num_rx, num_samples = cube.shape
+    if ch_interleave == 1:
+        source = cube.reshape(num_chirps, num_rx, num_samples // num_lanes, num_lanes)
+    else:
+        source = cube.reshape(num_chirps, num_rx // num_lanes, num_lanes, num_samples).transpose(0, 3, 1, 2)
+    raw_frame = np.empty(2 * cube.size, dtype=np.int16)
+    groups = raw_frame.reshape(-1, 2, num_lanes)
+    i_idx, q_idx = (1, 0) if iq_swap == 1 else (0, 1)
+    groups[:, i_idx] = np.clip(np.round(source.real), -32768, 32767).reshape(-1, num_lanes)
+    groups[:, q_idx] = np.clip(np.round(source.imag), -32768, 32767).reshape(-1, num_lanes)
+    return raw_frame
+
+
+def synthetic_frames(config, targets, num_frames=8, noise=20.0, seed=0):
+    # Point targets as [range m, velocity m/s, azimuth deg, amplitude] seen by a TDM MIMO uniform
+    # linear array; targets move by their velocity from one frame to the next
+    radar = config['radar']
+    num_chirps, num_tx, num_rx, num_samples = radar['chirps'], radar['num_tx_antennas'], radar['num_rx_antennas'], radar['num_adc_samples']
+    num_loops = num_chirps // num_tx
+    frame_period = 1.0 / config['emulator']['frame_rate'] if config['emulator']['frame_rate'] else 0.04
+    rng = np.random.default_rng(seed)
+
+    chirp = np.arange(num_chirps)[:, None, None]
+    virtual_antenna = (chirp % num_tx) * num_rx + np.arange(num_rx)[None, :, None]
+    sample = np.arange(num_samples)[None, None, :]
+    frames = []
+    for k in range(num_frames):
+        cube = rng.normal(0, noise, (num_chirps, num_rx, num_samples)) + 1j * rng.normal(0, noise, (num_chirps, num_rx, num_samples))
+        for target_range, velocity, azimuth, amplitude in targets:
+            range_bin = (target_range + velocity * frame_period * k) / radar['range_resolution']
+            doppler_bin = velocity / radar['velocity_resolution']
+            phase = (range_bin * sample / num_samples
+                     + doppler_bin * chirp / (num_loops * num_tx)
+                     + 0.5 * virtual_antenna * np.sin(np.deg2rad(azimuth)))
+            cube = cube + amplitude * np.exp(2j * np.pi * phase)
+        frames.append(interleave(cube, radar['num_lvds_lanes'], radar['iq_swap'], radar['ch_interleave']))
+    return frames
+
+
+class DCA1000Emulator:
+    # Stands in for the DCA1000 board: answers the config port commands and, between RECORD_START and
+    # RECORD_STOP, streams frames to the host data port as <seq num><byte count><payload> packets,
+    # paced at frame_rate (0 sends as fast as possible) with optional packet loss and reordering
+    def __init__(self, config, frames):
+        self.config = config
+        self.frames = frames
+        emulator = config['emulator']
+        dca = config['dca1000']
+        self.host_data = (dca['static_ip'], dca['data_port'])
+        self.frame_rate = emulator['frame_rate']
+        self.packet_delay = emulator['packet_delay_us'] / 1e6
+        self.loss_rate = emulator['loss_rate']
+        self.reorder_rate = emulator['reorder_rate']
+        self.bytes_in_packet = dca['BYTES_IN_PACKET']
+        self.random = random.Random(emulator['seed'])
+
+        self.config_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.config_socket.bind((dca['adc_ip'], dca['config_port']))
+        self.config_socket.settimeout(0.1)
+        self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.data_socket.bind((dca['adc_ip'], dca['data_port']))
+
+        self.commands_received = 0
+        self.frames_sent = 0
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.packets_reordered = 0
+
+        self._client = None
+        # For tests of the host side: config port replies to leave out, and statuses other than 0 by command
+        self.drop_replies = 0
+        self.reply_status = {}
+        self._stop_event = threading.Event()
+        self._streaming = threading.Event()
+        self._config_thread = threading.Thread(target=self._serve_config, daemon=True)
+        self._stream_thread = None
+
+    def start(self):
+        self._config_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.stop_stream()
+        if self._config_thread.is_alive():
+            self._config_thread.join()
+        self.config_socket.close()
+        self.data_socket.close()
+
+    def start_stream(self, num_frames=None):
+        if self._streaming.is_set():
+            return
+        self._streaming.set()
+        self._stream_thread = threading.Thread(target=self._stream, args=(num_frames,), daemon=True)
+        self._stream_thread.start()
+
+    def stop_stream(self):
+        self._streaming.clear()
+        if self._stream_thread is not None:
+            self._stream_thread.join()
+            self._stream_thread = None
+
+    def wait(self):
+        # Blocks until a stream started with num_frames has sent all of them
+        if self._stream_thread is not None:
+            self._stream_thread.join()
+
+    def stats(self):
+        return {
+            "commands_received": self.commands_received,
+            "frames_sent": self.frames_sent,
+            "packets_sent": self.packets_sent,
+            "packets_dropped": self.packets_dropped,
+            "packets_reordered": self.packets_reordered,
+        }
+
+    def _serve_config(self):
+        while not self._stop_event.is_set():
+            try:
+                msg, addr = self.config_socket.recvfrom(self.config['dca1000']['MAX_PACKET_SIZE'])
+            except socket.timeout:
+                continue
+            try:
+                cmd, _ = decode_command(msg)
+            except ValueError:
+                continue
+            self.commands_received += 1
+            self._client = addr
+            if cmd == CMD.RECORD_START_CMD_CODE:
+                self.start_stream()
+            elif cmd == CMD.RECORD_STOP_CMD_CODE:
+                threading.Thread(target=self.stop_stream, daemon=True).start()
+            if self.drop_replies:
+                self.drop_replies -= 1
+                continue
+            # The board echoes the command code with a status of 0 for success
+            self.config_socket.sendto(encode_reply(cmd, self.reply_status.get(cmd, 0)), addr)
+
+    def send_error(self, status):
+        # Unsolicited SYSTEM_ERROR frame to the last host that sent a command
+        self.config_socket.sendto(encode_reply(CMD.SYSTEM_ERROR_CMD_CODE, status), self._client)
+
+    def _stream(self, num_frames):
+        # The byte stream is the frames back to back, packets are cut from it regardless of frame boundaries
+        packet = bytearray(PACKET_HEADER.size + self.bytes_in_packet)
+        payload = memoryview(packet)[PACKET_HEADER.size:]
+        pending = bytearray()
+        held = None
+        seq, byte_count = 1, 0
+        start = time.perf_counter()
+        frame_idx = 0
+        while self._streaming.is_set() and (num_frames is None or frame_idx < num_frames):
+            pending += self.frames[frame_idx % len(self.frames)].tobytes()
+            offset = 0
+            while len(pending) - offset >= self.bytes_in_packet:
+                PACKET_HEADER.pack_into(packet, 0, seq, byte_count & 0xffffffff, byte_count >> 32)
+                payload[:] = pending[offset:offset + self.bytes_in_packet]
+                seq += 1
+                byte_count += self.bytes_in_packet
+                offset += self.bytes_in_packet
+
+                if self.loss_rate and self.random.random() < self.loss_rate:
+                    self.packets_dropped += 1
+                    continue
+                if held is None and self.reorder_rate and self.random.random() < self.reorder_rate:
+                    # Sent after the next packet
+                    held = bytes(packet)
+                    self.packets_reordered += 1
+                    continue
+                self._send(packet)
+                if held is not None:
+                    self._send(held)
+                    held = None
+            del pending[:offset]
+            frame_idx += 1
+            self.frames_sent += 1
+
+            if self.frame_rate:
+                delay = start + frame_idx / self.frame_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        if held is not None:
+            self._send(held)
+        self._streaming.clear()
+
+    def _send(self, packet):
+        self.data_socket.sendto(packet, self.host_data)
+        self.packets_sent += 1
+        if self.packet_delay:
+            time.sleep(self.packet_delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulates a DCA1000 on the local machine")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--source', default=None, help="recording or DCA1000 CLI .bin to stream instead of synthetic targets")
+    parser.add_argument('--frames', type=int, default=None, help="stop after this many frames")
+    parser.add_argument('--start', action='store_true', help="stream right away instead of waiting for RECORD_START")
+    args = parser.parse_args()
+    config = load_config(args.config)
+    # The emulated board sits on the adc_ip of the emulator section and streams to the host on static_ip
+    config = dict(config, dca1000=dict(config['dca1000'], static_ip=config['emulator']['host_ip'], adc_ip=config['emulator']['adc_ip']))
+
+    if args.source:
+        frames = open_capture(args.source, config['dca1000']['dataSizeOneFrame'] // 2, config['dca1000']['BYTES_IN_PACKET'])
+    else:
+        frames = synthetic_frames(config, config['emulator']['targets'])
+
+    emulator = DCA1000Emulator(config, frames)
+    emulator.start()
+    if args.start:
+        emulator.start_stream(args.frames)
+    print(f"Emulating DCA1000 on {config['emulator']['adc_ip']}, streaming to {emulator.host_data}")
+    try:
+        while True:
+            time.sleep(1)
+            print(emulator.stats())
+            if args.frames is not None and emulator.frames_sent >= args.frames:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
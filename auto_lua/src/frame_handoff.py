@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+from queue import Empty
+import numpy as np
+
+# queue: bounded FIFO, new frames are dropped while it is full
+# latest: the newest frame replaces the oldest waiting one, the consumer always gets the freshest data
+# every_nth: only every n-th frame is offered, then as queue
+HANDOFF_POLICIES = ('queue', 'latest', 'every_nth')
+
+
+class FrameHandoff:
+    # Hands frames from a producer thread to a consumer thread through a fixed pool of buffers.
+    # put() copies the frame into a free buffer, so the producer's buffer can be reused right away;
+    # the consumer gets a pool buffer and gives it back with release(). At most depth frames wait,
+    # which bounds both memory and how far the consumer can fall behind.
+    def __init__(self, frame_shape, dtype=np.int16, policy='latest', depth=1, every_nth=2):
+        if policy not in HANDOFF_POLICIES:
+            raise ValueError(f"Unknown handoff policy: {policy}")
+        self.policy = policy
+        self.depth = depth
+        self.every_nth = every_nth
+        # depth waiting, one held by the consumer and one being filled by the producer
+        self._free = deque(np.empty(frame_shape, dtype=dtype) for _ in range(depth + 2))
+        self._waiting = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.frames_offered = 0
+        self.frames_delivered = 0
+        self.frames_skipped = 0
+        self.frames_dropped = 0
+        self.frames_replaced = 0
+
+    def put(self, frame, meta=None):
+        # Returns False when the policy dropped the frame
+        with self._cond:
+            self.frames_offered += 1
+            if self.policy == 'every_nth' and (self.frames_offered - 1) % self.every_nth:
+                self.frames_skipped += 1
+                return False
+            if len(self._waiting) >= self.depth:
+                if self.policy != 'latest':
+                    self.frames_dropped += 1
+                    return False
+                buffer, _ = self._waiting.popleft()
+                self._free.append(buffer)
+                self.frames_replaced += 1
+            if not self._free:
+                # The consumer holds more buffers than it released
+                self.frames_dropped += 1
+                return False
+            buffer = self._free.popleft()
+
+        if isinstance(frame, (list, tuple)):
+            # A set of frames, one per row of the buffer
+            for row, part in zip(buffer, frame):
+                np.copyto(row, part.reshape(row.shape))
+        else:
+            np.copyto(buffer, frame.reshape(buffer.shape))
+        with self._cond:
+            self._waiting.append((buffer, meta))
+            self._cond.notify()
+        return True
+
+    def get(self, timeout=None):
+        # Returns (buffer, meta), or None once closed and drained; raises queue.Empty on timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._waiting or self._closed, timeout):
+                raise Empty
+            if not self._waiting:
+                return None
+            self.frames_delivered += 1
+            return self._waiting.popleft()
+
+    def release(self, buffer):
+        with self._cond:
+            self._free.append(buffer)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "offered": self.frames_offered,
+                "delivered": self.frames_delivered,
+                "skipped": self.frames_skipped,
+                "dropped": self.frames_dropped,
+                "replaced": self.frames_replaced,
+                "waiting": len(self._waiting),
+            }
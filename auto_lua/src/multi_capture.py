@@ -0,0 +1,172 @@
+import selectors
+import threading
+import time
+from collections import deque
+import numpy as np
+from capture import kernel_drops, set_receive_buffer
+from data_fetching import DCA1000
+from frame_handoff import FrameHandoff
+
+
+def board_config(config, board):
+    # config with the dca1000 section overridden by one entry of boards
+    return dict(config, dca1000=dict(config['dca1000'], **{k: v for k, v in board.items() if k != 'name'}))
+
+
+class BoardCapture:
+    # One board: its own DCA1000 (data socket and reassembler), the frames waiting for a match and counters
+    def __init__(self, name, config, max_pending):
+        dca = config['dca1000']
+        self.name = name
+        self.dca = DCA1000(config, dca['static_ip'], dca['adc_ip'], dca['data_port'], dca['config_port'])
+        self.rcvbuf_size = set_receive_buffer(self.dca.data_socket, config['capture']['rcvbuf_size'])
+        # Frames are copied out of the reassembly ring into these slots until their set is complete
+        self.slots = np.empty((max_pending, self.dca.UINT16_IN_FRAME), dtype=np.int16)
+        self.free = deque(range(max_pending))
+        # (first packet time, frame number, slot, lost packets), oldest first
+        self.pending = deque()
+
+        self.packets_received = 0
+        self.frames_captured = 0
+        self.frames_unmatched = 0
+
+    def stats(self):
+        return {
+            "packets_received": self.packets_received,
+            "lost_packets": self.dca.reassembler.lost_packets,
+            "kernel_drops": kernel_drops(self.dca.data_socket),
+            "frames_captured": self.frames_captured,
+            "incomplete_frames_dropped": self.dca.reassembler.frames_dropped,
+            "frames_unmatched": self.frames_unmatched,
+        }
+
+
+class MultiCapture:
+    # Captures several DCA1000 boards on one thread: a selector wakes up for whichever data sockets
+    # are readable, each board's packets go to its own reassembler, and every frame is stamped with
+    # the monotonic time of the wake-up that brought its first packet. Frames whose first packets are
+    # within skew_tolerance of each other across all boards are handed on together as one set, a
+    # (num_boards, frame_len) buffer from a FrameHandoff; a frame that cannot be matched is dropped.
+    def __init__(self, config, boards):
+        multi = config['multi_capture']
+        self.skew_tolerance = multi['skew_tolerance_ms'] / 1000
+        self.batch_size = config['capture']['batch_size']
+        self.boards = [BoardCapture(board['name'], board_config(config, board), multi['max_pending'])
+                       for board in boards]
+        self.frame_len = self.boards[0].dca.UINT16_IN_FRAME
+        processing = config['processing']
+        self.sets = FrameHandoff((len(self.boards), self.frame_len), np.int16, policy=processing['handoff_policy'],
+                                 depth=processing['handoff_depth'], every_nth=processing['handoff_every_nth'])
+
+        self.selector = selectors.DefaultSelector()
+        for board in self.boards:
+            self.selector.register(board.dca.data_socket, selectors.EVENT_READ, board)
+
+        self.sets_aligned = 0
+        self.last_skew = None
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        for board in self.boards:
+            board.dca.data_socket.setblocking(False)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.sets.close()
+
+    def close(self):
+        self.selector.close()
+        for board in self.boards:
+            board.dca.close()
+
+    def get_set(self, timeout=None):
+        # (buffer, meta) where buffer[i] is the frame of boards[i] and meta holds per-board frame
+        # numbers, timestamps and lost packets; None once stopped. Give the buffer back with release().
+        return self.sets.get(timeout)
+
+    def release(self, buffer):
+        self.sets.release(buffer)
+
+    def stats(self):
+        return {
+            "sets_aligned": self.sets_aligned,
+            "last_skew_ms": None if self.last_skew is None else self.last_skew * 1000,
+            "handoff": self.sets.stats(),
+            "boards": {board.name: board.stats() for board in self.boards},
+        }
+
+    def register_metrics(self, metrics):
+        metrics.counter_fn('frame_sets_aligned_total', "Time-aligned frame sets handed to processing", lambda: self.sets_aligned)
+        metrics.gauge_fn('frame_set_skew_seconds', "First packet spread of the last frame set", lambda: self.last_skew)
+        for board in self.boards:
+            prefix = f'board_{board.name}'
+            reassembler = board.dca.reassembler
+            metrics.counter_fn(f'{prefix}_packets_received_total', f"UDP packets read from {board.name}",
+                               lambda board=board: board.packets_received)
+            metrics.counter_fn(f'{prefix}_packets_lost_total', f"Packets missing from {board.name} frames",
+                               lambda reassembler=reassembler: reassembler.lost_packets)
+            metrics.counter_fn(f'{prefix}_frames_captured_total', f"Frames reassembled from {board.name}",
+                               lambda board=board: board.frames_captured)
+            metrics.counter_fn(f'{prefix}_frames_unmatched_total', f"{board.name} frames without a match on every board",
+                               lambda board=board: board.frames_unmatched)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            events = self.selector.select(0.1)
+            if not events:
+                continue
+            timestamp = time.monotonic()
+            for key, _ in events:
+                self._drain(key.data, timestamp)
+            self._align()
+
+    def _drain(self, board, timestamp):
+        dca = board.dca
+        for _ in range(self.batch_size):
+            try:
+                packet = dca._read_data_packet()
+            except BlockingIOError:
+                return
+            board.packets_received += 1
+            dca.reassembler.feed(packet[1], packet[2], timestamp)
+            while dca.reassembler.ready:
+                frame = dca.next_frame()
+                board.frames_captured += 1
+                if not board.free:
+                    # Nothing matched for max_pending frames, make room by giving up on the oldest
+                    board.free.append(board.pending.popleft()[2])
+                    board.frames_unmatched += 1
+                slot = board.free.popleft()
+                board.slots[slot] = frame
+                board.pending.append((dca.frame_time, dca.frame_number, slot, dca.lost_packets))
+
+    def _align(self):
+        # Pairs up the oldest waiting frame of every board. While they are further apart than the
+        # tolerance, the oldest one has no partner on some board and is dropped.
+        boards = self.boards
+        while all(board.pending for board in boards):
+            heads = [board.pending[0][0] for board in boards]
+            oldest, newest = min(heads), max(heads)
+            if newest - oldest > self.skew_tolerance:
+                board = boards[heads.index(oldest)]
+                board.free.append(board.pending.popleft()[2])
+                board.frames_unmatched += 1
+                continue
+            entries = [board.pending.popleft() for board in boards]
+            meta = {
+                "timestamp": oldest,
+                "skew": newest - oldest,
+                "frame_numbers": [entry[1] for entry in entries],
+                "timestamps": heads,
+                "lost_packets": [entry[3] for entry in entries],
+            }
+            self.sets.put([board.slots[entry[2]] for board, entry in zip(boards, entries)], meta)
+            for board, entry in zip(boards, entries):
+                board.free.append(entry[2])
+            self.sets_aligned += 1
+            self.last_skew = newest - oldest
@@ -0,0 +1,132 @@
+import base64
+import threading
+import numpy as np
+
+ARRAY_KEYS = ('x', 'y', 'z')
+
+
+def encode_array(values, dtype=np.float32):
+    # Plotly.js typed array spec: base64 of the raw little endian values, decoded in the browser
+    # without building or parsing a JSON number list. 2D arrays (heatmaps) carry their shape.
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    encoded = {"dtype": values.dtype.str[1:], "bdata": base64.b64encode(values).decode('ascii')}
+    if values.ndim > 1:
+        encoded["shape"] = ",".join(str(n) for n in values.shape)
+    return encoded
+
+
+def minmax_indices(y, max_points):
+    # Indices of the min and max of each of max_points / 2 buckets, in order, so peaks and the
+    # envelope of the trace survive; None when the trace already fits
+    n = len(y)
+    if n <= max_points:
+        return None
+    buckets = max_points // 2
+    size = -(-n // buckets)
+    padded = np.pad(y, (0, buckets * size - n), mode='edge').reshape(buckets, size)
+    idx = np.stack((padded.argmin(axis=1), padded.argmax(axis=1)), axis=1) + np.arange(buckets)[:, None] * size
+    return np.unique(np.minimum(idx, n - 1))
+
+
+def encode_trace(trace, max_points=None):
+    # Copy of a trace dict with its arrays min/max downsampled to max_points (line traces only) and
+    # encoded as typed arrays
+    trace = dict(trace)
+    if max_points and 'y' in trace and np.ndim(trace['y']) == 1:
+        idx = minmax_indices(trace['y'], max_points)
+        if idx is not None:
+            trace['x'] = np.asarray(trace['x'])[idx] if 'x' in trace else idx
+            trace['y'] = np.asarray(trace['y'])[idx]
+    for key in ARRAY_KEYS:
+        if key in trace:
+            dtype = np.uint8 if np.asarray(trace[key]).dtype == np.uint8 else np.float32
+            trace[key] = encode_array(trace[key], dtype)
+    return trace
+
+
+class PlotTransport:
+    # Latest traces of each plot under a version number. Traces are copied on publish (the processing
+    # buffers are reused every frame) but only downsampled and encoded when the browser pulls a version
+    # it does not have yet, at most once per version.
+    def __init__(self, max_points=1000):
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._plots = {}
+        self._encoded = {}
+
+    def publish(self, plot_id, traces, downsample=True):
+        # traces: Plotly trace dicts whose x / y / z may be numpy arrays; a missing x means sample index
+        traces = [dict(trace, **{key: np.array(trace[key]) for key in ARRAY_KEYS if key in trace}) for trace in traces]
+        with self._lock:
+            version = self._plots[plot_id][0] + 1 if plot_id in self._plots else 1
+            self._plots[plot_id] = (version, traces, downsample)
+
+    def version(self, plot_id):
+        with self._lock:
+            return self._plots[plot_id][0] if plot_id in self._plots else 0
+
+    def versions(self):
+        with self._lock:
+            return {plot_id: plot[0] for plot_id, plot in self._plots.items()}
+
+    def traces(self, plot_id):
+        # (version, encoded trace dicts) of the latest published data
+        with self._lock:
+            version, traces, downsample = self._plots[plot_id]
+            cached = self._encoded.get(plot_id)
+        if cached is not None and cached[0] == version:
+            return cached
+        encoded = (version, [encode_trace(trace, self.max_points if downsample else None) for trace in traces])
+        with self._lock:
+            self._encoded[plot_id] = encoded
+        return encoded
+
+class QuantizedImage:
+    # uint8 image of a dB map on a fixed scale: low dB -> 0, high dB -> 255. Updated in place, the
+    # float scratch buffer is reused too, so an update allocates nothing.
+    def __init__(self, shape, db_scale):
+        self.low, self.high = db_scale
+        self.image = np.zeros(shape, dtype=np.uint8)
+        self._scratch = np.empty(shape, dtype=np.float32)
+
+    def update(self, db, out=None):
+        out = self.image if out is None else out
+        np.subtract(db, self.low, out=self._scratch)
+        self._scratch *= 255.0 / (self.high - self.low)
+        np.clip(self._scratch, 0, 255, out=self._scratch)
+        np.copyto(out, self._scratch, casting='unsafe')
+        return out
+
+    def colorbar(self):
+        return dict(tickvals=[0, 255], ticktext=[f"{self.low} dB", f"{self.high} dB"])
+
+
+class RangeTimeRing:
+    # Waterfall of the last `history` range profiles as a (history, range) uint8 ring; row
+    # version % history holds the profile pushed as that version. Memory and the cost of a push
+    # stay the same however long the session runs.
+    def __init__(self, num_range_bins, history, db_scale):
+        self.history = history
+        self.quantizer = QuantizedImage(num_range_bins, db_scale)
+        self.rows = np.zeros((history, num_range_bins), dtype=np.uint8)
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def push(self, profile_db):
+        with self._lock:
+            self.quantizer.update(profile_db, out=self.rows[self.version % self.history])
+            self.version += 1
+
+    def rows_since(self, version):
+        # (version, rows pushed after the given version) or (version, None) when those rows are
+        # no longer all in the ring and the caller needs a full snapshot
+        with self._lock:
+            if version <= 0 or version > self.version or self.version - version > self.history:
+                return self.version, None
+            return self.version, self.rows[np.arange(version, self.version) % self.history]
+
+    def snapshot(self):
+        # (version, oldest to newest rows)
+        with self._lock:
+            first = max(self.version - self.history, 0)
+            return self.version, self.rows[np.arange(first, self.version) % self.history]
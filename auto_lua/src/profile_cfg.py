@@ -0,0 +1,232 @@
+import hashlib
+import math
+
+SPEED_OF_LIGHT = 299792458.0
+
+
+def read_cfg_lines(path):
+    # CLI command lines of a profile .cfg in file order, without comments and blank lines
+    lines = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('%'):
+                continue
+            lines.append(' '.join(line.split()))
+    return lines
+
+
+def read_cfg_commands(path):
+    # Collects the CLI commands of a profile .cfg as {command: [args of each line, ...]}, skipping comments
+    commands = {}
+    for line in read_cfg_lines(path):
+        name, *args = line.split()
+        commands.setdefault(name, []).append(args)
+    return commands
+
+
+class ChannelCfg:
+    # channelCfg <rxChannelEn> <txChannelEn> <cascading>
+    def __init__(self, rx_mask, tx_mask):
+        self.rx_mask = rx_mask
+        self.tx_mask = tx_mask
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(int(args[0]), int(args[1]))
+
+    @property
+    def num_rx(self):
+        return bin(self.rx_mask).count('1')
+
+
+class AdcCfg:
+    # adcCfg <numADCBits 0:12, 1:14, 2:16 bit> <adcOutputFmt 0:real, 1:complex1x, 2:complex2x>
+    def __init__(self, adc_bits, output_fmt):
+        self.adc_bits = adc_bits
+        self.output_fmt = output_fmt
+
+    @classmethod
+    def from_args(cls, args):
+        return cls({0: 12, 1: 14, 2: 16}[int(args[0])], int(args[1]))
+
+    @property
+    def values_per_sample(self):
+        # Complex samples are an I and a Q int16, real ones a single int16
+        return 1 if self.output_fmt == 0 else 2
+
+
+class AdcBufCfg:
+    # adcbufCfg <subFrameIdx> <adcOutFmt 0:complex, 1:real> <sampleSwap> <chanInterleave 0:interleaved, 1:not> <chirpThreshold>
+    def __init__(self, complex_output, sample_swap, ch_interleave, chirp_threshold):
+        self.complex_output = complex_output
+        self.sample_swap = sample_swap
+        self.ch_interleave = ch_interleave
+        self.chirp_threshold = chirp_threshold
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(int(args[1]) == 0, int(args[2]), int(args[3]), int(args[4]))
+
+
+class ProfileCfg:
+    # profileCfg <id> <startFreq GHz> <idleTime us> <adcStartTime us> <rampEndTime us> <txOutPower> <txPhaseShift>
+    #            <freqSlope MHz/us> <txStartTime us> <numAdcSamples> <digOutSampleRate ksps> <hpf1> <hpf2> <rxGain dB>
+    def __init__(self, profile_id, start_freq_ghz, idle_time_us, adc_start_time_us, ramp_end_time_us, freq_slope_mhz_us,
+                 num_adc_samples, sample_rate_ksps, rx_gain_db):
+        self.profile_id = profile_id
+        self.start_freq_ghz = start_freq_ghz
+        self.idle_time_us = idle_time_us
+        self.adc_start_time_us = adc_start_time_us
+        self.ramp_end_time_us = ramp_end_time_us
+        self.freq_slope_mhz_us = freq_slope_mhz_us
+        self.num_adc_samples = num_adc_samples
+        self.sample_rate_ksps = sample_rate_ksps
+        self.rx_gain_db = rx_gain_db
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(int(args[0]), float(args[1]), float(args[2]), float(args[3]), float(args[4]), float(args[7]),
+                   int(args[9]), float(args[10]), float(args[13]))
+
+    @property
+    def bandwidth(self):
+        # Hz swept while the ADC samples
+        return self.freq_slope_mhz_us * 1e12 * self.num_adc_samples / (self.sample_rate_ksps * 1e3)
+
+
+class ChirpCfg:
+    # chirpCfg <startIdx> <endIdx> <profileId> <startFreqVar> <freqSlopeVar> <idleTimeVar> <adcStartTimeVar> <txEnable mask>
+    def __init__(self, start_idx, end_idx, profile_id, tx_mask):
+        self.start_idx = start_idx
+        self.end_idx = end_idx
+        self.profile_id = profile_id
+        self.tx_mask = tx_mask
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(int(args[0]), int(args[1]), int(args[2]), int(args[7]))
+
+
+class FrameCfg:
+    # frameCfg <chirpStartIdx> <chirpEndIdx> <numLoops> <numFrames> <framePeriodicity ms> <triggerSelect> <triggerDelay ms>
+    def __init__(self, chirp_start_idx, chirp_end_idx, num_loops, num_frames, frame_period_ms):
+        self.chirp_start_idx = chirp_start_idx
+        self.chirp_end_idx = chirp_end_idx
+        self.num_loops = num_loops
+        self.num_frames = num_frames
+        self.frame_period_ms = frame_period_ms
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(int(args[0]), int(args[1]), int(args[2]), int(args[3]), float(args[4]))
+
+
+class RadarProfile:
+    # Typed view of a profile .cfg plus the frame geometry that follows from it, so config.yaml
+    # does not have to repeat profileCfg / frameCfg numbers by hand
+    def __init__(self, lines):
+        self.lines = lines
+        self.commands = {}
+        for line in lines:
+            name, *args = line.split()
+            self.commands.setdefault(name, []).append(args)
+        try:
+            self.channel = ChannelCfg.from_args(self.commands['channelCfg'][0])
+            self.adc = AdcCfg.from_args(self.commands['adcCfg'][0])
+            self.adcbuf = AdcBufCfg.from_args(self.commands['adcbufCfg'][0])
+            self.profiles = {p.profile_id: p for p in (ProfileCfg.from_args(args) for args in self.commands['profileCfg'])}
+            self.chirps = [ChirpCfg.from_args(args) for args in self.commands['chirpCfg']]
+            self.frame = FrameCfg.from_args(self.commands['frameCfg'][0])
+        except KeyError as e:
+            raise ValueError(f"Profile is missing {e.args[0]}") from None
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"Malformed profile command: {e}") from None
+
+    @classmethod
+    def load(cls, path):
+        return cls(read_cfg_lines(path))
+
+    def hash(self):
+        # Identifies the commands actually sent, comments and spacing do not count
+        return hashlib.sha256('\n'.join(self.lines).encode()).hexdigest()
+
+    @property
+    def frame_chirps(self):
+        # chirpCfg entries of one loop, in frame order
+        indices = range(self.frame.chirp_start_idx, self.frame.chirp_end_idx + 1)
+        return [next(c for c in self.chirps if c.start_idx <= i <= c.end_idx) for i in indices]
+
+    @property
+    def profile(self):
+        return self.profiles[self.frame_chirps[0].profile_id]
+
+    @property
+    def tx_order(self):
+        # TX of every chirp of one loop. The processing chain expects TDM MIMO: one TX per chirp, each
+        # TX once per loop, so the virtual antennas are TX major in chirp order.
+        order = []
+        for index, chirp in zip(range(self.frame.chirp_start_idx, self.frame.chirp_end_idx + 1), self.frame_chirps):
+            if bin(chirp.tx_mask).count('1') != 1:
+                raise ValueError(f"Chirp {index} enables TX mask {chirp.tx_mask}, TDM MIMO needs exactly one TX per chirp")
+            order.append(chirp.tx_mask.bit_length() - 1)
+        if len(set(order)) != len(order):
+            raise ValueError(f"Frame chirps use TX {order}, TDM MIMO needs each TX once per loop")
+        return order
+
+    @property
+    def num_tx(self):
+        return len(self.tx_order)
+
+    @property
+    def num_rx(self):
+        return self.channel.num_rx
+
+    @property
+    def num_adc_samples(self):
+        return self.profile.num_adc_samples
+
+    @property
+    def num_loops(self):
+        return self.frame.num_loops
+
+    @property
+    def chirps_per_frame(self):
+        return len(self.frame_chirps) * self.frame.num_loops
+
+    @property
+    def bytes_per_frame(self):
+        return self.chirps_per_frame * self.num_rx * self.num_adc_samples * self.adc.values_per_sample * 2
+
+    def packets_per_frame(self, bytes_in_packet):
+        return math.ceil(self.bytes_per_frame / bytes_in_packet)
+
+    @property
+    def range_resolution(self):
+        return SPEED_OF_LIGHT / (2 * self.profile.bandwidth)
+
+    @property
+    def max_range(self):
+        return self.profile.sample_rate_ksps * 1e3 * SPEED_OF_LIGHT / (2 * self.profile.freq_slope_mhz_us * 1e12)
+
+    @property
+    def velocity_resolution(self):
+        profile = self.profile
+        wavelength = SPEED_OF_LIGHT / (profile.start_freq_ghz * 1e9)
+        chirp_time = (profile.idle_time_us + profile.ramp_end_time_us) * 1e-6
+        return wavelength / (2 * self.chirps_per_frame * chirp_time)
+
+    def apply_to(self, config):
+        # config.yaml with the radar geometry and frame size taken from this profile. The TX count is
+        # checked instead of taken over: aoa.virtual_antennas and archive.lag are written for it.
+        if self.num_tx != config['radar']['num_tx_antennas']:
+            raise ValueError(f"Profile frame chirps use {self.num_tx} TX (order {self.tx_order}), "
+                             f"config.yaml radar.num_tx_antennas is {config['radar']['num_tx_antennas']}")
+        radar = dict(config['radar'], num_adc_samples=self.num_adc_samples, num_tx_antennas=self.num_tx,
+                     num_rx_antennas=self.num_rx, num_loops_per_frame=self.num_loops, chirps=self.chirps_per_frame,
+                     sample_rate=self.profile.sample_rate_ksps, range_resolution=self.range_resolution,
+                     velocity_resolution=self.velocity_resolution, ch_interleave=self.adcbuf.ch_interleave,
+                     # sampleSwap 0 puts I in the LSB half, so it comes first in the stream; 1 puts Q first
+                     iq_swap=self.adcbuf.sample_swap)
+        dca1000 = dict(config['dca1000'], dataSizeOneFrame=self.bytes_per_frame)
+        return dict(config, radar=radar, dca1000=dca1000)
@@ -0,0 +1,165 @@
+from collections import deque
+import numpy as np
+
+
+class FrameReassembler:
+    # Rebuilds frames from the DCA1000 byte stream. Every payload is written at its byte_count
+    # offset into a ring of ring_frames contiguous frame slots, so frame f always lives in slot
+    # f % ring_frames and a packet that straddles two frames is simply written across the border.
+    # Finished frames are views into the ring until their slot is reused for a later frame; one still
+    # in ready by then is swapped for a copy, so take frames out of ready before feeding more packets.
+    # Each ready entry is (frame number, frame, lost packets, time its first packet was fed).
+    def __init__(self, frame_bytes, packet_bytes, ring_frames=4, reorder_frames=1, loss_policy='zero_fill', start_slack=16):
+        if loss_policy not in ('zero_fill', 'drop'):
+            raise ValueError(f"Unknown loss policy: {loss_policy}")
+        if ring_frames < reorder_frames + 2:
+            raise ValueError("ring_frames must be at least reorder_frames + 2")
+        self.frame_bytes = frame_bytes
+        self.packet_bytes = packet_bytes
+        self.ring_frames = ring_frames
+        self.reorder_frames = reorder_frames
+        self.loss_policy = loss_policy
+        # Packets into a frame the first packet of a stream may be and still start that frame
+        self.start_slack = start_slack
+
+        self.ring = np.zeros((ring_frames, frame_bytes // 2), dtype=np.int16)
+        self.ring_flat = self.ring.reshape(-1)
+        self.ring_bytes = ring_frames * frame_bytes
+
+        # Packets overlapping one frame, +1 because frames do not start on packet boundaries
+        self.max_packets = -(-frame_bytes // packet_bytes) + 1
+        # Per slot bookkeeping stays in plain Python containers, numpy scalar access costs more per packet
+        self.received = [bytearray(self.max_packets) for _ in range(ring_frames)]
+        self.bytes_received = [0] * ring_frames
+        self.slot_frame = [-1] * ring_frames
+        self.slot_time = [float('nan')] * ring_frames
+
+        self.ready = deque()
+        self.next_frame = None
+        self.head_frame = None
+
+        self.frames_completed = 0
+        self.frames_dropped = 0
+        self.lost_packets = 0
+        self.late_packets = 0
+
+    def reset(self):
+        for slot in range(self.ring_frames):
+            self._open_slot(slot, -1)
+        self.next_frame = None
+        self.head_frame = None
+
+    def feed(self, byte_count, payload, timestamp=float('nan')):
+        start = byte_count
+        end = start + 2 * len(payload)
+        if self.next_frame is None:
+            # Start on the frame of the first packet we see when it is one of that frame's first few
+            # packets (the ones before it are only reordered), otherwise on the next frame border,
+            # since the stream was joined halfway through a frame
+            self.next_frame = start // self.frame_bytes
+            if start - self.next_frame * self.frame_bytes > self.start_slack * self.packet_bytes:
+                self.next_frame += 1
+            self.head_frame = self.next_frame
+
+        first_frame = start // self.frame_bytes
+        last_frame = (end - 1) // self.frame_bytes
+        if last_frame < self.next_frame:
+            if self.next_frame - first_frame > self.ring_frames:
+                # byte_count jumped backwards by more than the ring, the stream was restarted
+                self.reset()
+                self.feed(byte_count, payload, timestamp)
+                return
+            self.late_packets += 1
+            return
+
+        if first_frame < self.next_frame:
+            skip = self.next_frame * self.frame_bytes - start
+            payload = payload[skip // 2:]
+            start += skip
+            first_frame = self.next_frame
+
+        if last_frame - self.head_frame > self.ring_frames:
+            # Whole frames went missing, skip straight to this packet instead of walking through them
+            self._flush(self.head_frame)
+            self.frames_dropped += first_frame - self.next_frame
+            self.lost_packets += (first_frame - self.next_frame) * self.frame_bytes // self.packet_bytes
+            self.next_frame = first_frame
+        if last_frame > self.head_frame:
+            self.head_frame = last_frame
+            self._flush(last_frame - self.reorder_frames - 1)
+            self._flush(last_frame - self.ring_frames)
+
+        self._detach(first_frame, last_frame)
+        self._write(start, payload)
+        packet_idx = byte_count // self.packet_bytes
+        for frame in range(first_frame, last_frame + 1):
+            slot = frame % self.ring_frames
+            if self.slot_frame[slot] != frame:
+                self._open_slot(slot, frame, timestamp)
+            frame_start = frame * self.frame_bytes
+            received = self.received[slot]
+            packet = packet_idx - frame_start // self.packet_bytes
+            if not received[packet]:
+                received[packet] = 1
+                self.bytes_received[slot] += min(end, frame_start + self.frame_bytes) - max(start, frame_start)
+
+        self._emit_complete()
+
+    def _open_slot(self, slot, frame, timestamp=float('nan')):
+        self.slot_frame[slot] = frame
+        self.slot_time[slot] = timestamp
+        self.received[slot][:] = bytes(self.max_packets)
+        self.bytes_received[slot] = 0
+
+    def _detach(self, first_frame, last_frame):
+        # Ready frames whose slot one of first_frame..last_frame is about to reuse get their own copy
+        for i, (frame, data, lost, timestamp) in enumerate(self.ready):
+            if data.base is not self.ring or frame >= first_frame:
+                continue
+            if first_frame + (frame - first_frame) % self.ring_frames <= last_frame:
+                self.ready[i] = (frame, data.copy(), lost, timestamp)
+
+    def _write(self, start, payload):
+        offset = (start % self.ring_bytes) // 2
+        head = min(len(payload), len(self.ring_flat) - offset)
+        self.ring_flat[offset:offset + head] = payload[:head]
+        if head < len(payload):
+            self.ring_flat[:len(payload) - head] = payload[head:]
+
+    def _emit_complete(self):
+        while True:
+            slot = self.next_frame % self.ring_frames
+            if self.slot_frame[slot] != self.next_frame or self.bytes_received[slot] < self.frame_bytes:
+                return
+            self.ready.append((self.next_frame, self.ring[slot], 0, self.slot_time[slot]))
+            self.frames_completed += 1
+            self.next_frame += 1
+
+    def _flush(self, up_to_frame):
+        # Gives up on every frame up to and including up_to_frame, emitting or dropping it per the loss policy
+        while self.next_frame <= up_to_frame:
+            frame = self.next_frame
+            slot = frame % self.ring_frames
+            if self.slot_frame[slot] != frame:
+                self._open_slot(slot, frame)
+            self._detach(frame, frame)
+            first_packet = frame * self.frame_bytes // self.packet_bytes
+            num_packets = ((frame + 1) * self.frame_bytes - 1) // self.packet_bytes - first_packet + 1
+            missing = np.flatnonzero(np.frombuffer(self.received[slot], dtype=np.uint8, count=num_packets) == 0)
+            self.lost_packets += len(missing)
+
+            if len(missing) == 0:
+                self.ready.append((frame, self.ring[slot], 0, self.slot_time[slot]))
+                self.frames_completed += 1
+            elif self.loss_policy == 'zero_fill':
+                frame_start = frame * self.frame_bytes
+                for packet in missing + first_packet:
+                    lo = max(packet * self.packet_bytes, frame_start) - frame_start
+                    hi = min((packet + 1) * self.packet_bytes, frame_start + self.frame_bytes) - frame_start
+                    self.ring[slot, lo // 2:hi // 2] = 0
+                self.ready.append((frame, self.ring[slot], len(missing), self.slot_time[slot]))
+                self.frames_completed += 1
+            else:
+                self.frames_dropped += 1
+            self.next_frame += 1
+        self._emit_complete()
@@ -0,0 +1,359 @@
+import json
+import os
+import threading
+import time
+from queue import Queue
+import numpy as np
+from data_fetching import PACKET_HEADER
+
+# Sidecar index next to the frame file, one record per frame
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('timestamp', '<f8'),
+    ('frame_number', '<i8'),
+    ('lost_packets', '<u4'),
+])
+
+
+# Packets of a CLI capture with packet headers in byte_count order, and the packets of each frame
+PACKET_DTYPE = np.dtype([
+    ('slot', '<u8'),  # position of the packet in the file, in packet strides
+    ('byte_count', '<u8'),
+    ('size', '<u4'),
+])
+FRAME_PACKETS_DTYPE = np.dtype([
+    ('frame_number', '<i8'),
+    ('first_packet', '<u8'),
+    ('num_packets', '<u4'),
+    ('lost_packets', '<u4'),
+])
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def packet_index_path(path):
+    return path + '.pidx.npz'
+
+
+def has_packet_headers(path, packet_bytes):
+    # True for a DCA1000 CLI capture made with sequenceNumberEnable 1, which stores every packet as
+    # <seq num><byte count><payload> like it came off the wire. Two headers a packet apart whose seq
+    # and byte_count advance together are taken as proof; ADC samples do not line up like that.
+    stride = PACKET_HEADER.size + packet_bytes
+    with open(path, 'rb') as f:
+        first = f.read(PACKET_HEADER.size)
+        f.seek(stride)
+        second = f.read(PACKET_HEADER.size)
+    if len(second) < PACKET_HEADER.size:
+        return False
+    seq0, lo0, hi0 = PACKET_HEADER.unpack(first)
+    seq1, lo1, hi1 = PACKET_HEADER.unpack(second)
+    byte_count0, byte_count1 = lo0 | hi0 << 32, lo1 | hi1 << 32
+    return 0 < seq1 - seq0 < 64 and byte_count1 - byte_count0 == (seq1 - seq0) * packet_bytes
+
+
+class FrameRecorder:
+    # Appends int16 frames to a preallocated, memory-mapped file. append() only copies the frame into
+    # the mapping (page cache); a background writer appends the index records and flushes the mapping
+    # to disk, so capture never waits on the disk. The data file holds the frames back to back, like a
+    # DCA1000 CLI capture made with sequenceNumberEnable 0.
+    def __init__(self, path, frame_len, capacity_frames=1500, flush_every=25):
+        self.path = path
+        self.frame_len = frame_len
+        self.frame_bytes = frame_len * 2
+        self.capacity = capacity_frames
+        self.grow_frames = capacity_frames
+        self.flush_every = flush_every
+        self.count = 0
+
+        with open(path, 'wb') as f:
+            f.truncate(self.capacity * self.frame_bytes)
+        self.frames = np.memmap(path, dtype=np.int16, mode='r+', shape=(self.capacity, frame_len))
+        self._map_lock = threading.Lock()
+        self._index_file = open(index_path(path), 'wb')
+        self._queue = Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def append(self, frame, lost_packets=0, frame_number=-1, timestamp=None):
+        if self.count == self.capacity:
+            self._grow()
+        self.frames[self.count] = frame
+        record = (self.count * self.frame_bytes, time.time() if timestamp is None else timestamp, frame_number, max(lost_packets, 0))
+        self._queue.put(record)
+        self.count += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        with self._map_lock:
+            self.frames.flush()
+            del self.frames
+        # Drop the preallocated tail so the file only holds recorded frames
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.count * self.frame_bytes)
+        self._index_file.close()
+
+    def _grow(self):
+        with self._map_lock:
+            # Windows cannot resize a file that is still mapped, release the old mapping first
+            self.frames.flush()
+            del self.frames
+            self.capacity += self.grow_frames
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.capacity * self.frame_bytes)
+            self.frames = np.memmap(self.path, dtype=np.int16, mode='r+', shape=(self.capacity, self.frame_len))
+
+    def _write_loop(self):
+        records = np.empty(1, dtype=INDEX_DTYPE)
+        pending = 0
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            records[0] = record
+            self._index_file.write(records.tobytes())
+            pending += 1
+            if pending >= self.flush_every or self._queue.empty():
+                with self._map_lock:
+                    self.frames.flush()
+                self._index_file.flush()
+                pending = 0
+
+
+def cli_sequence_numbers(path):
+    # sequenceNumberEnable of the cf.json the DCA1000 CLI recorded path with, None when there is none.
+    # The CLI writes to fileBasePath relative to where it runs, .\\Data\\ in the shipped cf.json, so
+    # the cf.json is next to the capture or one directory up.
+    directory = os.path.dirname(os.path.abspath(path))
+    for candidate in (os.path.join(directory, 'cf.json'), os.path.join(os.path.dirname(directory), 'cf.json')):
+        if os.path.exists(candidate):
+            with open(candidate, 'r') as f:
+                capture = json.load(f)['DCA1000Config']['captureConfig']
+            return bool(capture.get('sequenceNumberEnable', 0))
+    return None
+
+
+def open_capture(path, frame_len, packet_bytes=1456):
+    # Reader for any capture: FrameRecorder recordings and bare CLI captures through RecordingReader,
+    # CLI captures with packet headers through PacketCaptureReader and archives (recording.format
+    # archive) through archive.ArchiveReader. The layout of a CLI capture comes from its cf.json, or
+    # from looking at the file when there is none.
+    # archive imports this module, so it is only imported here
+    from archive import ARCHIVE_MAGIC, ArchiveReader
+    with open(path, 'rb') as f:
+        magic = f.read(len(ARCHIVE_MAGIC))
+    if magic == ARCHIVE_MAGIC:
+        reader = ArchiveReader(path)
+        if reader.frame_len != frame_len:
+            raise ValueError(f"{path} holds frames of {reader.frame_len} values, the radar config needs {frame_len}")
+        return reader
+    if not os.path.exists(index_path(path)):
+        packetized = cli_sequence_numbers(path)
+        if packetized is None:
+            packetized = has_packet_headers(path, packet_bytes)
+        if packetized:
+            return PacketCaptureReader(path, frame_len, packet_bytes)
+    return RecordingReader(path, frame_len, packet_bytes)
+
+
+class RecordingReader:
+    # Random access to a FrameRecorder file, or a DCA1000 CLI .bin made with sequenceNumberEnable 0
+    # (bare int16 samples), through np.memmap. Frames are zero-copy views into the mapping; nothing
+    # is read from disk until a frame is touched. CLI captures with packet headers, the default of
+    # the cf.json files, do not hold frames back to back and are refused instead of misframed.
+    def __init__(self, path, frame_len, packet_bytes=1456):
+        self.path = path
+        self.frame_len = frame_len
+        if not os.path.exists(index_path(path)) and has_packet_headers(path, packet_bytes):
+            raise ValueError(f"{path} is a DCA1000 CLI capture with packet headers (sequenceNumberEnable 1), "
+                             f"not bare frames, open it with open_capture")
+        num_frames = os.path.getsize(path) // (frame_len * 2)
+        if num_frames:
+            self.frames = np.memmap(path, dtype=np.int16, mode='r', shape=(num_frames, frame_len))
+        else:
+            self.frames = np.empty((0, frame_len), dtype=np.int16)
+
+        self.index = None
+        if os.path.exists(index_path(path)):
+            # A recording still being written can have a few more index records than flushed frames or vice versa
+            index = np.fromfile(index_path(path), dtype=INDEX_DTYPE)
+            self.index = index[:num_frames]
+            self.frames = self.frames[:len(self.index)]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, item):
+        return self.frames[item]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    @property
+    def timestamps(self):
+        return None if self.index is None else self.index['timestamp']
+
+    @property
+    def lost_packets(self):
+        return None if self.index is None else self.index['lost_packets']
+
+    def frame_at(self, timestamp):
+        # Index of the last frame recorded at or before timestamp
+        if self.index is None:
+            raise ValueError(f"{self.path} has no index, frames have no timestamps")
+        return max(int(np.searchsorted(self.index['timestamp'], timestamp, side='right')) - 1, 0)
+
+
+class PacketCaptureReader:
+    # Random access to a DCA1000 CLI capture made with sequenceNumberEnable 1, where every packet is
+    # stored behind its <seq num><byte count> header. The headers are walked once: packets are put in
+    # seq order (the CLI writes them as they arrive) and every frame gets the range of packets that
+    # overlap it, by byte_count, like FrameReassembler does live. That index is kept next to the
+    # capture in a .pidx.npz, so later opens, e.g. one per batch_process chunk, only map the file.
+    # A frame is gathered from its packets on access, missing packets are zero filled and frames
+    # without any packet are left out.
+    def __init__(self, path, frame_len, packet_bytes=1456):
+        self.path = path
+        self.frame_len = frame_len
+        self.frame_bytes = frame_len * 2
+        self.packet_bytes = packet_bytes
+        self.stride = PACKET_HEADER.size + packet_bytes
+        self.data = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.empty(0, dtype=np.uint8)
+        self.packets, self.frame_packets = self._load_index()
+
+        self.index = np.zeros(len(self.frame_packets), dtype=INDEX_DTYPE)
+        self.index['offset'] = self.packets['slot'][self.frame_packets['first_packet']] * self.stride if len(self.index) else 0
+        self.index['timestamp'] = np.nan
+        self.index['frame_number'] = self.frame_packets['frame_number']
+        self.index['lost_packets'] = self.frame_packets['lost_packets']
+
+    def _load_index(self):
+        source_bytes = len(self.data)
+        try:
+            with np.load(packet_index_path(self.path)) as cached:
+                if (int(cached['source_bytes']), int(cached['frame_bytes']), int(cached['packet_bytes'])) == \
+                        (source_bytes, self.frame_bytes, self.packet_bytes):
+                    return cached['packets'], cached['frame_packets']
+        except (OSError, KeyError, ValueError):
+            pass
+        packets, frame_packets = self._build_index()
+        try:
+            tmp = packet_index_path(self.path) + '.tmp.npz'
+            np.savez(tmp, source_bytes=source_bytes, frame_bytes=self.frame_bytes, packet_bytes=self.packet_bytes,
+                     packets=packets, frame_packets=frame_packets)
+            os.replace(tmp, packet_index_path(self.path))
+        except OSError:
+            # Read-only capture directory, the index is built again next time
+            pass
+        return packets, frame_packets
+
+    def _build_index(self):
+        # Every packet but the last is packet_bytes long, so the headers sit at fixed strides
+        num_slots = -(-len(self.data) // self.stride)
+        if num_slots and len(self.data) - (num_slots - 1) * self.stride < PACKET_HEADER.size:
+            num_slots -= 1
+        headers = np.empty(num_slots, dtype=np.dtype([('seq', '<u4'), ('lo', '<u4'), ('hi', '<u2')]))
+        for field, start, dtype in (('seq', 0, '<u4'), ('lo', 4, '<u4'), ('hi', 8, '<u2')):
+            width = np.dtype(dtype).itemsize
+            columns = np.lib.stride_tricks.as_strided(self.data[start:], (num_slots, width), (self.stride, 1))
+            headers[field] = np.ascontiguousarray(columns).view(dtype).reshape(-1)
+        packets = np.empty(num_slots, dtype=PACKET_DTYPE)
+        packets['slot'] = np.arange(num_slots)
+        packets['byte_count'] = headers['lo'].astype(np.uint64) | headers['hi'].astype(np.uint64) << np.uint64(32)
+        packets['size'] = self.packet_bytes
+        if num_slots:
+            packets['size'][-1] = min(self.packet_bytes, len(self.data) - (num_slots - 1) * self.stride - PACKET_HEADER.size)
+
+        order = np.argsort(headers['seq'], kind='stable')
+        seq = headers['seq'][order].astype(np.int64)
+        # A packet the capture holds twice counts once
+        unique = np.concatenate([[True], np.diff(seq) != 0]) if num_slots else np.ones(0, dtype=bool)
+        packets, seq = packets[order][unique], seq[unique]
+        num_slots = len(packets)
+        byte_count = packets['byte_count'].astype(np.int64)
+        # seq and byte_count must advance together, otherwise packets are not packet_bytes apart and
+        # the fixed strides above read samples as headers
+        if np.any(np.diff(byte_count) != np.diff(seq) * self.packet_bytes) or np.any(byte_count % 2):
+            raise ValueError(f"{self.path}: packet headers do not advance by {self.packet_bytes} bytes per packet")
+
+        if not num_slots:
+            return packets, np.empty(0, dtype=FRAME_PACKETS_DTYPE)
+        end = byte_count + packets['size']
+        # Whole frames only: from the first frame border to the end of the last packet
+        first_frame = -(-int(byte_count[0]) // self.frame_bytes)
+        last_frame = int(end[-1]) // self.frame_bytes - 1
+        frames = np.arange(first_frame, max(last_frame + 1, first_frame), dtype=np.int64)
+        frame_start = frames * self.frame_bytes
+        first_packet = np.searchsorted(end, frame_start, side='right')
+        stop_packet = np.searchsorted(byte_count, frame_start + self.frame_bytes, side='left')
+        num_packets = stop_packet - first_packet
+        expected = (frame_start + self.frame_bytes - 1) // self.packet_bytes - frame_start // self.packet_bytes + 1
+        keep = num_packets > 0
+        frame_packets = np.empty(int(keep.sum()), dtype=FRAME_PACKETS_DTYPE)
+        frame_packets['frame_number'] = frames[keep]
+        frame_packets['first_packet'] = first_packet[keep]
+        frame_packets['num_packets'] = num_packets[keep]
+        frame_packets['lost_packets'] = (expected - num_packets)[keep]
+        return packets, frame_packets
+
+    def __len__(self):
+        return len(self.frame_packets)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            indices = range(*item.indices(len(self)))
+            frames = np.empty((len(indices), self.frame_len), dtype=np.int16)
+            for row, i in enumerate(indices):
+                self.read_frame(i, out=frames[row])
+            return frames
+        return self.read_frame(item)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read_frame(i)
+
+    def read_frame(self, i, out=None):
+        if out is None:
+            out = np.empty(self.frame_len, dtype=np.int16)
+        entry = self.frame_packets[i]
+        first, count = int(entry['first_packet']), int(entry['num_packets'])
+        packets = self.packets[first:first + count]
+        frame_start = int(entry['frame_number']) * self.frame_bytes
+        frame_end = frame_start + self.frame_bytes
+        out_bytes = out.view(np.uint8)
+        if not entry['lost_packets'] and count > 2 and np.all(np.diff(packets['slot']) == 1):
+            # Usual case, the frame's packets are back to back in the file: the whole packets in the
+            # middle are copied as one strided block
+            first_slot, first_byte = int(packets['slot'][0]), int(packets['byte_count'][0])
+            head = first_byte + self.packet_bytes - frame_start
+            middle = (count - 2) * self.packet_bytes
+            payloads = np.lib.stride_tricks.as_strided(self.data[(first_slot + 1) * self.stride + PACKET_HEADER.size:],
+                                                       (count - 2, self.packet_bytes), (self.stride, 1))
+            first = (first_slot * self.stride + PACKET_HEADER.size) + frame_start - first_byte
+            out_bytes[:head] = self.data[first:first + head]
+            out_bytes[head:head + middle].reshape(count - 2, self.packet_bytes)[...] = payloads
+            last = (first_slot + count - 1) * self.stride + PACKET_HEADER.size
+            out_bytes[head + middle:] = self.data[last:last + self.frame_bytes - head - middle]
+            return out
+        if entry['lost_packets']:
+            out_bytes[:] = 0
+        slots, byte_counts, sizes = packets['slot'].tolist(), packets['byte_count'].tolist(), packets['size'].tolist()
+        for slot, byte_count, size in zip(slots, byte_counts, sizes):
+            lo, hi = max(byte_count, frame_start), min(byte_count + size, frame_end)
+            payload = slot * self.stride + PACKET_HEADER.size
+            out_bytes[lo - frame_start:hi - frame_start] = self.data[payload + lo - byte_count:payload + hi - byte_count]
+        return out
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    @property
+    def lost_packets(self):
+        return self.index['lost_packets']
+
+    def frame_at(self, timestamp):
+        raise ValueError(f"{self.path} is a CLI capture, frames have no timestamps")
@@ -0,0 +1,258 @@
+import argparse
+import os
+import socket
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import yaml
+from aoa import POINT_DTYPE
+
+TRANSPORTS = ('udp', 'unix', 'shm')
+
+
+def record_dtype(max_points):
+    # One frame's results as a fixed-size, packed little-endian record. Only the first num_points
+    # entries of points are valid; timestamp is the time.monotonic() of the frame's first packet.
+    # With the hand detection fast path a frame gets two records: an early one with complete 0 that
+    # only holds the hand fields, as soon as the hand is known, and the full one with complete 1.
+    return np.dtype([
+        ('frame_number', '<u4'),
+        ('timestamp', '<f8'),
+        ('hand_detected', 'u1'),
+        ('hand_distance', '<f4'),  # nan without a hand
+        ('complete', 'u1'),
+        ('num_points', '<u2'),
+        ('points', POINT_DTYPE.newbyteorder('<'), (max_points,)),
+    ])
+
+
+def ring_dtype(max_points):
+    # A shared memory ring slot: seq is odd while the writer is in the slot
+    return np.dtype([('seq', '<u8'), ('record', record_dtype(max_points))])
+
+
+def parse_address(transport, address):
+    if transport == 'udp':
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def attach_shared_memory(name):
+    # Before Python 3.13 an attached segment is registered with this process's resource tracker,
+    # which unlinks it when the process exits, under the publisher's feet
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        if os.name == 'posix':
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class ResultPublisher:
+    # Packs every frame's results into one preallocated record and hands its bytes to _send. Nothing
+    # ever blocks: a record no one is there to receive is dropped and counted.
+    def __init__(self, max_points):
+        self.max_points = max_points
+        self.buffer = np.zeros(1, dtype=record_dtype(max_points))
+        self.record = self.buffer[0]
+        self.no_points = np.zeros(0, dtype=POINT_DTYPE)
+        self.records_published = 0
+        self.records_dropped = 0
+        self.points_truncated = 0
+
+    @classmethod
+    def from_config(cls, config):
+        # None when publish.transport is null
+        publish = config['publish']
+        transport = publish['transport']
+        if transport is None:
+            return None
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown publish transport: {transport}")
+        address = parse_address(transport, publish['address'])
+        if transport == 'shm':
+            return ShmPublisher(address, publish['max_points'], publish['shm_slots'])
+        return SocketPublisher(transport, address, publish['max_points'])
+
+    def publish(self, frame_number, timestamp, hand_detected, hand_distance, points, complete=True):
+        record = self.record
+        record['frame_number'] = frame_number
+        record['timestamp'] = timestamp
+        record['hand_detected'] = hand_detected
+        record['hand_distance'] = np.nan if hand_distance is None else hand_distance
+        record['complete'] = complete
+        num_points = min(len(points), self.max_points)
+        self.points_truncated += len(points) - num_points
+        record['num_points'] = num_points
+        record['points'][:num_points] = points[:num_points]
+        self._send(self.buffer)
+        self.records_published += 1
+
+    def publish_hand(self, frame_number, timestamp, hand_detected, hand_distance):
+        # The early record of a frame, from the hand detection fast path
+        self.publish(frame_number, timestamp, hand_detected, hand_distance, self.no_points, complete=False)
+
+    def _send(self, buffer):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SocketPublisher(ResultPublisher):
+    # One datagram per record to a local UDP port or Unix domain socket
+    def __init__(self, transport, address, max_points):
+        super().__init__(max_points)
+        family = socket.AF_INET if transport == 'udp' else socket.AF_UNIX
+        self.address = address
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def _send(self, buffer):
+        try:
+            self.sock.sendto(buffer, self.address)
+        except (BlockingIOError, ConnectionRefusedError, FileNotFoundError):
+            # No subscriber, or one that does not keep up
+            self.records_dropped += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class ShmPublisher(ResultPublisher):
+    # A ring of slots in shared memory behind a uint64 count of records written. A reader goes
+    # through the slots it has not seen yet and checks each slot's seq after copying it, like a
+    # seqlock, so a record overwritten meanwhile is never returned torn.
+    def __init__(self, name, max_points, slots=64):
+        super().__init__(max_points)
+        dtype = ring_dtype(max_points)
+        size = 8 + slots * dtype.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a run that did not exit cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.count = np.ndarray(1, dtype='<u8', buffer=self.shm.buf)
+        self.ring = np.ndarray(slots, dtype=dtype, buffer=self.shm.buf, offset=8)
+        self.count[0] = 0
+        self.ring['seq'] = 0
+
+    def _send(self, buffer):
+        n = int(self.count[0])
+        slot = self.ring[n % len(self.ring)]
+        slot['seq'] = 2 * n + 1
+        slot['record'] = buffer[0]
+        slot['seq'] = 2 * n + 2
+        self.count[0] = n + 1
+
+    def close(self):
+        del self.count, self.ring
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ResultSubscriber:
+    # Reference consumer of a ResultPublisher: recv() returns the next record (a numpy structured
+    # scalar of record_dtype) or None on timeout
+    def __init__(self, transport, address, max_points, slots=64):
+        self.transport = transport
+        self.address = address
+        self.dtype = record_dtype(max_points)
+        self.records_missed = 0
+        if transport == 'shm':
+            self.shm = attach_shared_memory(address)
+            ring = ring_dtype(max_points)
+            self.count = np.ndarray(1, dtype='<u8', buffer=self.shm.buf)
+            self.ring = np.ndarray(slots, dtype=ring, buffer=self.shm.buf, offset=8)
+            # Only records written from now on
+            self.next = int(self.count[0])
+            return
+        if transport == 'unix' and os.path.exists(address):
+            os.unlink(address)
+        self.sock = socket.socket(socket.AF_INET if transport == 'udp' else socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        self.buffer = np.zeros(1, dtype=self.dtype)
+
+    def recv(self, timeout=None):
+        if self.transport == 'shm':
+            return self._read_ring(timeout)
+        self.sock.settimeout(timeout)
+        try:
+            size = self.sock.recv_into(self.buffer)
+        except socket.timeout:
+            return None
+        if size != self.dtype.itemsize:
+            raise ValueError(f"Got a {size} byte record, expected {self.dtype.itemsize}: publish.max_points differs")
+        return self.buffer[0].copy()
+
+    def _read_ring(self, timeout, poll_interval=0.0005):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            count = int(self.count[0])
+            if count > self.next:
+                if count - self.next > len(self.ring):
+                    # Overwritten before we got to them
+                    self.records_missed += count - len(self.ring) - self.next
+                    self.next = count - len(self.ring)
+                n = self.next
+                slot = self.ring[n % len(self.ring)]
+                record = slot['record'].copy()
+                if slot['seq'] == 2 * n + 2:
+                    self.next += 1
+                    return record
+                # The writer lapped us while copying, skip ahead
+                self.records_missed += 1
+                self.next += 1
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        if self.transport == 'shm':
+            del self.count, self.ring
+            self.shm.close()
+        else:
+            self.sock.close()
+            if self.transport == 'unix':
+                os.unlink(self.address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prints the per-frame results published by a headless RadarSystem")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--transport', choices=TRANSPORTS, help="publish.transport by default")
+    parser.add_argument('--address', help="publish.address by default")
+    args = parser.parse_args()
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    publish = config['publish']
+    transport = args.transport or publish['transport'] or 'udp'
+    address = parse_address(transport, args.address or publish['address'])
+
+    subscriber = ResultSubscriber(transport, address, publish['max_points'], publish['shm_slots'])
+    try:
+        while True:
+            record = subscriber.recv(timeout=1.0)
+            if record is None:
+                continue
+            # Capture and publisher share the host, so the monotonic clocks compare directly
+            age = (time.monotonic() - record['timestamp']) * 1000
+            hand = f"hand at {record['hand_distance']:.2f} m" if record['hand_detected'] else "no hand"
+            if not record['complete']:
+                print(f"frame {record['frame_number']}: {hand} (early), {age:.1f} ms after capture")
+                continue
+            print(f"frame {record['frame_number']}: {hand}, {record['num_points']} points, {age:.1f} ms after capture")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import logging
+import os
+from profile_cfg import RadarProfile
+
+log = logging.getLogger(__name__)
+
+# What the mmWave SDK demo prints once it is ready for the next command
+CLI_PROMPT = b'mmwDemo:/>'
+
+
+class CLIError(RuntimeError):
+    pass
+
+
+def open_cli_port(port, baud=115200, timeout=2.0):
+    # pyserial is only needed when talking to a board
+    import serial
+    return serial.Serial(port, baud, timeout=timeout)
+
+
+class CLILoader:
+    # Sends profile .cfg commands over the CLI port of the mmWave SDK demo. Each command is written as
+    # soon as the device has answered the previous one with its prompt, and the answer has to contain
+    # "Done". port is anything with write() and pyserial's read_until(), e.g. a serial.Serial on a pty.
+    def __init__(self, port, prompt=CLI_PROMPT, cache_path=None):
+        self.port = port
+        self.prompt = prompt
+        # Hash of the last profile loaded completely, so an unchanged one is not sent again
+        self.cache_path = cache_path
+        self.commands_sent = 0
+
+    def command(self, line):
+        # Returns the response lines, raises CLIError unless the device acknowledged with Done
+        self.port.write((line + '\n').encode())
+        self.commands_sent += 1
+        response = self.port.read_until(self.prompt)
+        if not response.endswith(self.prompt):
+            raise CLIError(f"No prompt after '{line}', got {response!r}")
+        lines = [text.strip() for text in response[:-len(self.prompt)].decode(errors='replace').splitlines()]
+        # The demo echoes the command first
+        lines = [text for text in lines if text and text != line]
+        if 'Done' not in lines:
+            raise CLIError(f"'{line}' failed: {' | '.join(lines) or 'no response'}")
+        return lines
+
+    def cached_hash(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return None
+        with open(self.cache_path, 'r') as f:
+            return f.read().strip()
+
+    def _store_hash(self, digest):
+        if self.cache_path is None:
+            return
+        if digest is None:
+            if os.path.exists(self.cache_path):
+                os.remove(self.cache_path)
+            return
+        with open(self.cache_path, 'w') as f:
+            f.write(digest)
+
+    def load(self, profile, force=False, stop_at='sensorStart'):
+        # Sends the profile up to (not including) stop_at. Returns False when the same profile was
+        # already loaded and force is not set. The cached hash is dropped first, so a load that stops
+        # on an error is never mistaken for a complete one.
+        if isinstance(profile, str):
+            profile = RadarProfile.load(profile)
+        digest = profile.hash()
+        if not force and self.cached_hash() == digest:
+            log.info("Profile %s already loaded, not sending it again", digest[:12])
+            return False
+        self._store_hash(None)
+        if hasattr(self.port, 'reset_input_buffer'):
+            self.port.reset_input_buffer()
+        sent = 0
+        for line in profile.lines:
+            if line.split()[0] == stop_at:
+                break
+            self.command(line)
+            sent += 1
+            log.debug(">>> %s", line)
+        self._store_hash(digest)
+        log.info("Profile %s loaded, %d commands", digest[:12], sent)
+        return True
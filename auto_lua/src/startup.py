@@ -0,0 +1,103 @@
+import logging
+import os
+import select
+import time
+from dca1000_control import CommandTimeout
+
+log = logging.getLogger(__name__)
+
+
+class StartupError(RuntimeError):
+    pass
+
+
+class MarkerFile:
+    # The status file auto_communication.lua appends one line to per finished phase, or
+    # "failed <phase>" before it stops
+    def __init__(self, path):
+        self.path = path
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def lines(self):
+        try:
+            with open(self.path, 'r') as f:
+                return [line.strip() for line in f if line.strip()]
+        except OSError:
+            return []
+
+    def probe(self, phase):
+        def reached():
+            lines = self.lines()
+            failed = [line for line in lines if line.startswith('failed')]
+            if failed:
+                raise StartupError(f"mmWave Studio script: {failed[0]}")
+            return phase in lines
+        return reached
+
+
+def config_port_probe(control, timeout=0.2):
+    # The DCA1000 answers SYSTEM_CONNECT once its FPGA is up; no answer yet is expected while polling
+    def reached():
+        try:
+            control.run(control.client.system_connect(timeout=timeout, retries=0))
+        except CommandTimeout:
+            return False
+        return True
+    return reached
+
+
+def data_packet_probe(sock):
+    # Readable means the first packet is queued; it is left in the socket for the capture thread
+    def reached():
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+    return reached
+
+
+class StartupOrchestrator:
+    # Runs readiness probes phase by phase, moving on as soon as a probe succeeds instead of
+    # waiting a fixed time. Each phase has its own timeout on top of the overall one.
+    def __init__(self, total_timeout, poll_interval=0.2):
+        self.total_timeout = total_timeout
+        self.poll_interval = poll_interval
+        self.phases = []
+        self.report = {}
+
+    def add_phase(self, name, probe, timeout):
+        self.phases.append((name, probe, timeout))
+        return self
+
+    def run(self):
+        # Returns {phase: seconds it took}; raises StartupError on a timeout or a failed probe
+        start = time.monotonic()
+        for name, probe, timeout in self.phases:
+            phase_start = time.monotonic()
+            deadline = min(phase_start + timeout, start + self.total_timeout)
+            while not probe():
+                if time.monotonic() >= deadline:
+                    self.report[name] = time.monotonic() - phase_start
+                    raise StartupError(f"{name} not ready after {self.report[name]:.1f} s "
+                                       f"({time.monotonic() - start:.1f} s since start)")
+                time.sleep(self.poll_interval)
+            self.report[name] = time.monotonic() - phase_start
+            log.info("Startup phase %s ready after %.1f s", name, self.report[name])
+        log.info("Sensor ready after %.1f s", time.monotonic() - start)
+        return self.report
+
+
+def sensor_startup(config, dca, control):
+    # Phases of auto_communication.lua followed by the DCA1000 itself
+    startup = config['startup']
+    timeouts = startup['phase_timeouts']
+    marker = MarkerFile(startup['marker_file'])
+    orchestrator = StartupOrchestrator(startup['total_timeout'], startup['poll_interval'])
+    orchestrator.add_phase('connected', marker.probe('connected'), timeouts['connected'])
+    orchestrator.add_phase('configured', marker.probe('configured'), timeouts['configured'])
+    if startup['probe_config_port']:
+        orchestrator.add_phase('dca1000', config_port_probe(control), timeouts['dca1000'])
+    orchestrator.add_phase('streaming', marker.probe('streaming'), timeouts['streaming'])
+    orchestrator.add_phase('first_packet', data_packet_probe(dca.data_socket), timeouts['first_packet'])
+    return marker, orchestrator
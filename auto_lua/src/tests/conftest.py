@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules are run from auto_lua/src and import each other by their flat names
+sys.path.insert(0, SRC_DIR)
+
+
+@pytest.fixture(autouse=True)
+def src_dir(monkeypatch):
+    # config.yaml and the paths in it are relative to auto_lua/src
+    monkeypatch.chdir(SRC_DIR)
@@ -0,0 +1,111 @@
+import threading
+import numpy as np
+import pytest
+import archive
+from archive import ArchiveReader, ArchiveWriter
+from recording import open_capture
+
+FRAME_LEN = 4 * 1024
+CHIRP_LEN = 256
+
+
+def make_frames(num_frames, seed=0):
+    # Static chirps plus noise, like a scene without movement
+    rng = np.random.default_rng(seed)
+    static = rng.integers(-3000, 3000, CHIRP_LEN * 2)
+    chirps = np.tile(static, (num_frames, FRAME_LEN // len(static)))
+    return (chirps + rng.integers(-30, 30, chirps.shape)).astype(np.int16)
+
+
+def write_archive(path, frames, **kwargs):
+    writer = ArchiveWriter(str(path), FRAME_LEN, CHIRP_LEN, lag=2, frames_per_chunk=4, codec='zlib', **kwargs)
+    for i, frame in enumerate(frames):
+        writer.append(frame, lost_packets=i % 3, frame_number=100 + i, timestamp=float(i))
+    writer.close()
+    return writer
+
+
+def test_round_trip(tmp_path):
+    frames = make_frames(10)
+    writer = write_archive(tmp_path / 'capture.bin', frames)
+    assert writer.count == 10
+    assert writer.ratio > 1
+
+    reader = ArchiveReader(str(tmp_path / 'capture.bin'))
+    assert len(reader) == 10 and reader.num_chunks == 3
+    np.testing.assert_array_equal(np.stack(list(reader)), frames)
+    np.testing.assert_array_equal(reader[9], frames[9])
+    np.testing.assert_array_equal(reader[2], frames[2])
+    np.testing.assert_array_equal(reader.index['frame_number'], np.arange(100, 110))
+    np.testing.assert_array_equal(reader.lost_packets, np.arange(10) % 3)
+    np.testing.assert_array_equal(reader.timestamps, np.arange(10))
+
+
+def test_default_workers(tmp_path):
+    writer = ArchiveWriter(str(tmp_path / 'capture.bin'), FRAME_LEN, CHIRP_LEN, codec='zlib')
+    writer.close()
+    assert writer.workers == archive.DEFAULT_WORKERS
+
+
+def hold_encoders(monkeypatch):
+    release = threading.Event()
+    encode_chunk = archive.encode_chunk
+
+    def slow_encode(*args):
+        release.wait(5)
+        return encode_chunk(*args)
+
+    monkeypatch.setattr(archive, 'encode_chunk', slow_encode)
+    return release
+
+
+def test_append_does_not_wait_for_encoding(tmp_path, monkeypatch):
+    # With the encoders held up, append() keeps taking frames into new chunks up to max_chunks and
+    # drops the rest instead of allocating more
+    release = hold_encoders(monkeypatch)
+    frames = make_frames(40)
+    writer = ArchiveWriter(str(tmp_path / 'capture.bin'), FRAME_LEN, CHIRP_LEN, lag=2, frames_per_chunk=4,
+                           codec='zlib', workers=1, max_chunks=4)
+    for frame in frames:
+        writer.append(frame)
+    assert writer.chunks_allocated == 4
+    assert writer.frames_dropped == 40 - 4 * 4
+    release.set()
+    writer.close()
+    assert writer.count == 16
+    np.testing.assert_array_equal(np.stack(list(ArchiveReader(str(tmp_path / 'capture.bin')))), frames[:16])
+
+
+def test_blocking_writer_keeps_every_frame(tmp_path, monkeypatch):
+    release = hold_encoders(monkeypatch)
+    threading.Timer(0.2, release.set).start()
+    frames = make_frames(40)
+    writer = ArchiveWriter(str(tmp_path / 'capture.bin'), FRAME_LEN, CHIRP_LEN, lag=2, frames_per_chunk=4,
+                           codec='zlib', workers=1, max_chunks=3, block=True)
+    for frame in frames:
+        writer.append(frame)
+    writer.close()
+    assert writer.chunks_allocated == 3 and writer.frames_dropped == 0
+    np.testing.assert_array_equal(np.stack(list(ArchiveReader(str(tmp_path / 'capture.bin')))), frames)
+
+
+def test_encoder_error_is_raised_on_close(tmp_path, monkeypatch):
+    def failing_encode(*args):
+        raise MemoryError("encoder")
+
+    monkeypatch.setattr(archive, 'encode_chunk', failing_encode)
+    writer = ArchiveWriter(str(tmp_path / 'capture.bin'), FRAME_LEN, CHIRP_LEN, lag=2, frames_per_chunk=4, codec='zlib')
+    for frame in make_frames(5):
+        writer.append(frame)
+    with pytest.raises(MemoryError):
+        writer.close()
+
+
+def test_open_capture_reads_archives(tmp_path):
+    frames = make_frames(6)
+    write_archive(tmp_path / 'capture.bin', frames)
+    reader = open_capture(str(tmp_path / 'capture.bin'), FRAME_LEN)
+    assert isinstance(reader, ArchiveReader)
+    np.testing.assert_array_equal(reader[5], frames[5])
+    with pytest.raises(ValueError):
+        open_capture(str(tmp_path / 'capture.bin'), FRAME_LEN // 2)
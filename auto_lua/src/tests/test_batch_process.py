@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import batch_process
+from dca1000_emulator import synthetic_frames
+
+
+@pytest.fixture
+def ema_config():
+    config = batch_process.load_config()
+    config['clutter_removal'] = dict(config['clutter_removal'], mode='ema', alpha=0.2, background=None)
+    config['batch'] = dict(config['batch'], clutter_warmup_frames=100)
+    return config
+
+
+def write_capture(path, config, seed):
+    frames = np.stack(synthetic_frames(config, config['emulator']['targets'], num_frames=6, seed=seed))
+    frames.tofile(path)
+    return str(path)
+
+
+def run_chunks(path, chunks):
+    results = [batch_process.process_chunk((path, start, stop)) for start, stop in chunks]
+    return np.concatenate([result[3] for result in results]), np.concatenate([result[4]['hand_distance'] for result in results])
+
+
+def test_chunks_match_one_pass(tmp_path, ema_config):
+    path = write_capture(tmp_path / 'a.bin', ema_config, seed=0)
+    batch_process.init_worker(ema_config)
+    one_pass, one_pass_hand = run_chunks(path, [(0, 6)])
+    # Chunks in any order, each warmed up on the frames before it
+    batch_process.init_worker(ema_config)
+    chunked, chunked_hand = run_chunks(path, [(4, 6), (2, 4), (0, 2)])
+    chunked = np.concatenate([chunked[4:], chunked[2:4], chunked[:2]])
+    chunked_hand = np.concatenate([chunked_hand[4:], chunked_hand[2:4], chunked_hand[:2]])
+    np.testing.assert_allclose(chunked, one_pass, rtol=1e-5, atol=1e-3)
+    np.testing.assert_allclose(chunked_hand, one_pass_hand)
+
+
+def test_no_background_from_previous_file(tmp_path, ema_config):
+    first = write_capture(tmp_path / 'a.bin', ema_config, seed=0)
+    second = write_capture(tmp_path / 'b.bin', ema_config, seed=1)
+    batch_process.init_worker(ema_config)
+    fresh, _ = run_chunks(second, [(0, 3)])
+    batch_process.init_worker(ema_config)
+    run_chunks(first, [(0, 6)])
+    after_other_file, _ = run_chunks(second, [(0, 3)])
+    np.testing.assert_array_equal(after_other_file, fresh)
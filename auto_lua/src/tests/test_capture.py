@@ -0,0 +1,49 @@
+import time
+from queue import Empty
+import numpy as np
+import pytest
+import yaml
+from capture import CaptureEngine
+from data_fetching import DCA1000
+from dca1000_emulator import DCA1000Emulator, synthetic_frames
+
+
+@pytest.fixture
+def config():
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    config['dca1000'] = dict(config['dca1000'], static_ip='127.0.0.1', adc_ip='127.0.0.2', data_port=0, config_port=0)
+    config['emulator'] = dict(config['emulator'], frame_rate=25)
+    return config
+
+
+def test_stalled_consumer_gets_intact_frames(config):
+    frames = synthetic_frames(config, config['emulator']['targets'], num_frames=5)
+    emulator = DCA1000Emulator(config, frames)
+    dca = DCA1000(config, '127.0.0.1', '127.0.0.1', 0, 0)
+    emulator.host_data = dca.data_socket.getsockname()
+    capture = CaptureEngine(dca, config)
+    capture.start()
+    try:
+        emulator.start_stream(20)
+        # Stall for about a dozen frame periods while the capture thread keeps reassembling
+        time.sleep(0.5)
+        received = []
+        while True:
+            try:
+                frame, lost_packets, frame_number, _ = capture.get_frame(timeout=0.5)
+            except Empty:
+                break
+            received.append((frame_number, lost_packets, frame.copy()))
+            capture.release(frame)
+    finally:
+        capture.stop()
+        emulator.stop()
+        dca.close()
+
+    assert received[0][0] == 0
+    assert capture.dropped_frames > 0
+    assert len(received) + capture.dropped_frames == capture.frames_captured
+    for frame_number, lost_packets, frame in received:
+        assert lost_packets == 0
+        np.testing.assert_array_equal(frame, frames[frame_number % len(frames)].reshape(-1))
@@ -0,0 +1,74 @@
+import asyncio
+import socket
+import time
+import pytest
+import yaml
+from data_fetching import CMD
+from dca1000_control import CommandTimeout, ControlThread, DCA1000Error
+from dca1000_emulator import DCA1000Emulator, synthetic_frames
+
+
+@pytest.fixture
+def config():
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    config['dca1000'] = dict(config['dca1000'], static_ip='127.0.0.1', adc_ip='127.0.0.2', data_port=0, config_port=0,
+                             command_timeout=0.05, command_retries=2)
+    return config
+
+
+@pytest.fixture
+def emulator(config):
+    emulator = DCA1000Emulator(config, synthetic_frames(config, config['emulator']['targets'], num_frames=1))
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+@pytest.fixture
+def control(config, emulator):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    errors = []
+    host_config = dict(config, dca1000=dict(config['dca1000'], config_port=emulator.config_socket.getsockname()[1]))
+    control = ControlThread(host_config, sock=sock, on_error=errors.append)
+    control.errors = errors
+    yield control
+    control.close()
+
+
+def test_retry_after_dropped_reply(control, emulator):
+    emulator.drop_replies = 1
+    assert control.run(control.client.system_connect()) == 0
+    assert control.client.retries_used == 1
+    assert emulator.commands_received == 2
+
+
+def test_timeout_after_every_retry(control, emulator):
+    emulator.drop_replies = 100
+    with pytest.raises(CommandTimeout):
+        control.run(control.client.system_connect())
+    assert emulator.commands_received == 3
+    assert control.client.retries_used == 2
+
+
+def test_status_reply(control, emulator):
+    emulator.reply_status[CMD.CONFIG_FPGA_GEN_CMD_CODE] = 5
+    assert control.run(control.client.command(CMD.CONFIG_FPGA_GEN_CMD_CODE)) == 5
+    with pytest.raises(DCA1000Error):
+        control.run(control.client.checked(CMD.CONFIG_FPGA_GEN_CMD_CODE))
+    assert control.client.retries_used == 0
+
+
+def test_system_errors_keep_the_last(control, emulator):
+    control.run(control.client.system_connect())
+    waiter = asyncio.run_coroutine_threadsafe(control.client.next_error(), control.loop)
+    for status in range(1, 101):
+        emulator.send_error(status)
+    assert 1 <= waiter.result(1)[1] <= 100
+    deadline = time.monotonic() + 1
+    while control.client.errors_received < 100 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert control.client.errors_received == 100
+    assert control.client.last_error[1] == 100
+    assert control.errors == list(range(1, 101))
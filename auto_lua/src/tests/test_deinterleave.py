@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from data_fetching import deinterleave
+from dca1000_emulator import interleave
+
+NUM_CHIRPS, NUM_RX, NUM_SAMPLES = 6, 4, 16
+
+
+def random_cube(seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (NUM_CHIRPS, NUM_RX, NUM_SAMPLES)
+    return (rng.integers(-2000, 2000, shape) + 1j * rng.integers(-2000, 2000, shape)).astype(np.complex64)
+
+
+@pytest.mark.parametrize('num_lanes', [2, 4])
+@pytest.mark.parametrize('iq_swap', [0, 1])
+@pytest.mark.parametrize('ch_interleave', [0, 1])
+def test_round_trip(num_lanes, iq_swap, ch_interleave):
+    cube = random_cube()
+    raw_frame = interleave(cube, num_lanes, iq_swap, ch_interleave)
+    assert raw_frame.dtype == np.int16 and raw_frame.size == 2 * cube.size
+    out = deinterleave(raw_frame, NUM_CHIRPS, NUM_RX, NUM_SAMPLES, num_lanes, iq_swap, ch_interleave)
+    np.testing.assert_array_equal(out, cube)
+
+
+@pytest.mark.parametrize('num_lanes', [2, 4])
+@pytest.mark.parametrize('ch_interleave', [0, 1])
+def test_iq_swap_swaps_halves(num_lanes, ch_interleave):
+    cube = random_cube(1)
+    raw_frame = interleave(cube, num_lanes, 0, ch_interleave)
+    out = deinterleave(raw_frame, NUM_CHIRPS, NUM_RX, NUM_SAMPLES, num_lanes, 1, ch_interleave)
+    np.testing.assert_array_equal(out, cube.imag + 1j * cube.real)
+
+
+def test_stream_layout():
+    # Two lanes, no interleaving: I0 I1 Q0 Q1 I2 I3 Q2 Q3 ... along the samples of chirp 0, rx 0
+    cube = random_cube(2)
+    raw_frame = interleave(cube, 2, 0, 1)
+    first = cube[0, 0, :4]
+    np.testing.assert_array_equal(raw_frame[:8], [first[0].real, first[1].real, first[0].imag, first[1].imag,
+                                                  first[2].real, first[3].real, first[2].imag, first[3].imag])
+    # Channels interleaved: the same sample of every rx comes first
+    raw_frame = interleave(cube, 2, 0, 0)
+    first = cube[0, :2, 0]
+    np.testing.assert_array_equal(raw_frame[:4], [first[0].real, first[1].real, first[0].imag, first[1].imag])
+
+
+def test_rejects_bad_input():
+    raw_frame = np.zeros(2 * NUM_CHIRPS * NUM_RX * NUM_SAMPLES, dtype=np.int16)
+    with pytest.raises(ValueError):
+        deinterleave(raw_frame, NUM_CHIRPS, NUM_RX, NUM_SAMPLES, num_lanes=3)
+    with pytest.raises(ValueError):
+        deinterleave(raw_frame[:-2], NUM_CHIRPS, NUM_RX, NUM_SAMPLES)
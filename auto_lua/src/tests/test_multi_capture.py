@@ -0,0 +1,116 @@
+import socket
+import time
+from queue import Empty
+import numpy as np
+import pytest
+import yaml
+from data_fetching import PACKET_HEADER
+from dca1000_emulator import DCA1000Emulator, synthetic_frames
+from multi_capture import MultiCapture, board_config
+
+BOARDS = [dict(name=f'board{i}', static_ip='127.0.0.1', adc_ip='127.0.0.1', data_port=0, config_port=0) for i in range(2)]
+
+
+@pytest.fixture
+def config():
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    config['emulator'] = dict(config['emulator'], frame_rate=25)
+    # Every set is kept until the test reads them
+    config['processing'] = dict(config['processing'], handoff_policy='queue', handoff_depth=16)
+    return config
+
+
+@pytest.fixture
+def multi(config):
+    multi = MultiCapture(config, BOARDS)
+    multi.start()
+    yield multi
+    multi.stop()
+    multi.close()
+
+
+def collect_sets(multi, timeout=0.5):
+    sets = []
+    while True:
+        try:
+            item = multi.get_set(timeout)
+        except Empty:
+            return sets
+        buffer, meta = item
+        sets.append((meta, buffer.copy()))
+        multi.release(buffer)
+
+
+def test_offset_board(config, multi):
+    # board0 starts three frame periods before board1: its first three frames have no partner
+    offset_frames, num_frames = 3, 10
+    frames, emulators = [], []
+    for i, board in enumerate(multi.boards):
+        emulator_config = board_config(config, dict(BOARDS[i], adc_ip=f'127.0.0.{i + 2}'))
+        frames.append(synthetic_frames(emulator_config, config['emulator']['targets'], num_frames=5, seed=i))
+        emulator = DCA1000Emulator(emulator_config, frames[i])
+        emulator.host_data = board.dca.data_socket.getsockname()
+        emulators.append(emulator)
+    try:
+        emulators[0].start_stream(num_frames)
+        time.sleep(offset_frames / config['emulator']['frame_rate'])
+        emulators[1].start_stream(num_frames)
+        for emulator in emulators:
+            emulator.wait()
+        sets = collect_sets(multi)
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+
+    # A stream's last frame does not end on a packet border, its tail is never sent
+    assert len(sets) == num_frames - offset_frames - 1
+    for meta, buffer in sets:
+        first, second = meta['frame_numbers']
+        assert first == second + offset_frames
+        assert meta['skew'] <= config['multi_capture']['skew_tolerance_ms'] / 1000
+        assert meta['lost_packets'] == [0, 0]
+        np.testing.assert_array_equal(buffer[0], frames[0][first % 5].reshape(-1))
+        np.testing.assert_array_equal(buffer[1], frames[1][second % 5].reshape(-1))
+    assert multi.boards[0].frames_unmatched == offset_frames
+    assert multi.boards[1].frames_unmatched == 0
+
+
+def test_frames_after_a_gap(config, multi):
+    # Both boards lose everything from partway into frame 1 to partway into frame 5; frame 1 is given
+    # up on in the same feed that reuses its ring slot and must still come out with its own data
+    packet_bytes = config['dca1000']['BYTES_IN_PACKET']
+    frame_bytes = config['dca1000']['dataSizeOneFrame']
+    num_frames = 8
+    first_lost, last_lost = (3 * frame_bytes // 2) // packet_bytes, (11 * frame_bytes // 2) // packet_bytes
+    streams = [np.concatenate([frame.reshape(-1) for frame in synthetic_frames(config, config['emulator']['targets'],
+                                                                               num_frames=num_frames, seed=i)])
+               for i in range(2)]
+    targets = [board.dca.data_socket.getsockname() for board in multi.boards]
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # The boards' packets interleaved, so their frames arrive together
+        for packet, offset in enumerate(range(0, len(streams[0]) * 2 - packet_bytes + 1, packet_bytes)):
+            if first_lost <= packet < last_lost:
+                continue
+            for target, stream in zip(targets, streams):
+                payload = stream.view(np.uint8)[offset:offset + packet_bytes].tobytes()
+                sender.sendto(PACKET_HEADER.pack(packet + 1, offset, 0) + payload, target)
+            if packet % 64 == 0:
+                # Stay within the receive buffers
+                time.sleep(0.002)
+        sets = collect_sets(multi)
+    finally:
+        sender.close()
+
+    expected = []
+    for stream in streams:
+        stream = stream.copy()
+        stream[first_lost * packet_bytes // 2:last_lost * packet_bytes // 2] = 0
+        expected.append(stream.reshape(num_frames, -1))
+    numbers = [meta['frame_numbers'] for meta, _ in sets]
+    assert [1, 1] in numbers
+    for meta, buffer in sets:
+        for i, frame_number in enumerate(meta['frame_numbers']):
+            np.testing.assert_array_equal(buffer[i], expected[i][frame_number])
+    assert any(lost for meta, _ in sets for lost in meta['lost_packets'])
@@ -0,0 +1,59 @@
+import pytest
+import yaml
+from profile_cfg import RadarProfile
+
+BASE = [
+    'channelCfg 15 3 0',
+    'adcCfg 2 1',
+    'adcbufCfg -1 0 1 1 1',
+    'profileCfg 0 60 100 6 60 0 0 29.982 0 256 10000 0 0 30',
+]
+
+
+def profile(*lines):
+    return RadarProfile(BASE + list(lines))
+
+
+def load_config():
+    with open('config.yaml', 'r') as file:
+        return yaml.safe_load(file)
+
+
+def test_tdm_tx_order():
+    radar = profile('chirpCfg 0 0 0 0 0 0 0 1', 'chirpCfg 1 1 0 0 0 0 0 2', 'frameCfg 0 1 64 0 40 1 0')
+    assert radar.tx_order == [0, 1]
+    assert radar.num_tx == 2
+    assert radar.chirps_per_frame == 128
+    assert radar.bytes_per_frame == 524288
+
+
+def test_frame_of_one_chirp_is_one_tx():
+    # Both chirps are configured, but the frame loops chirp 0 only
+    radar = profile('chirpCfg 0 0 0 0 0 0 0 1', 'chirpCfg 1 1 0 0 0 0 0 2', 'frameCfg 0 0 128 0 40 1 0')
+    assert radar.tx_order == [0]
+
+
+@pytest.mark.parametrize('chirps', [
+    ['chirpCfg 0 0 0 0 0 0 0 3', 'chirpCfg 1 1 0 0 0 0 0 2'],  # two TX in one chirp
+    ['chirpCfg 0 1 0 0 0 0 0 1'],  # the same TX twice per loop
+])
+def test_rejects_non_tdm(chirps):
+    radar = profile(*chirps, 'frameCfg 0 1 64 0 40 1 0')
+    with pytest.raises(ValueError):
+        radar.num_tx
+
+
+def test_apply_to_checks_tx_count():
+    config = load_config()
+    radar = profile('chirpCfg 0 0 0 0 0 0 0 1', 'chirpCfg 1 1 0 0 0 0 0 2', 'frameCfg 0 1 64 0 40 1 0')
+    applied = radar.apply_to(config)
+    assert applied['radar']['chirps'] == 128
+    assert applied['radar']['num_loops_per_frame'] == config['radar']['num_loops_per_frame']
+    assert applied['dca1000']['dataSizeOneFrame'] == config['dca1000']['dataSizeOneFrame']
+    # adcbufCfg -1 0 1 1 1: sampleSwap 1, channels not interleaved
+    assert applied['radar']['iq_swap'] == 1
+    assert applied['radar']['ch_interleave'] == 1
+
+    single_tx = profile('chirpCfg 0 0 0 0 0 0 0 1', 'frameCfg 0 0 128 0 40 1 0')
+    with pytest.raises(ValueError):
+        single_tx.apply_to(config)
@@ -0,0 +1,181 @@
+import numpy as np
+import pytest
+from reassembly import FrameReassembler
+
+# Small frames that do not start on packet borders: frames of 200 samples in 48 sample packets.
+# Streams carry two frames more than the tests look at, so the last checked one is flushed.
+FRAME_BYTES = 400
+PACKET_BYTES = 96
+NUM_FRAMES = 5
+
+
+def make_stream(num_frames=NUM_FRAMES + 2, first_byte=0):
+    stream = np.arange(num_frames * FRAME_BYTES // 2, dtype=np.int16) + 1
+    packets = []
+    for offset in range(0, len(stream), PACKET_BYTES // 2):
+        packets.append((first_byte + 2 * offset, stream[offset:offset + PACKET_BYTES // 2]))
+    return stream.reshape(num_frames, -1), packets
+
+
+def feed_all(reassembler, packets):
+    frames = []
+    for byte_count, payload in packets:
+        reassembler.feed(byte_count, payload)
+        # Views into the ring, copied before the ring moves on
+        while reassembler.ready:
+            frame, view, lost, _ = reassembler.ready.popleft()
+            frames.append((frame, view.copy(), lost))
+    return frames
+
+
+def checked(frames):
+    return [entry for entry in frames if entry[0] < NUM_FRAMES]
+
+
+def test_in_order():
+    expected, packets = make_stream()
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES)
+    frames = feed_all(reassembler, packets)
+    # The last frame is complete as soon as its last packet is in
+    assert [frame for frame, _, _ in frames] == list(range(NUM_FRAMES + 2))
+    for frame, data, lost in frames:
+        assert lost == 0
+        np.testing.assert_array_equal(data, expected[frame])
+    assert reassembler.lost_packets == 0
+    assert reassembler.late_packets == 0
+
+
+def test_loss_zero_fill():
+    expected, packets = make_stream()
+    lost_packet = 8
+    del packets[lost_packet]
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, loss_policy='zero_fill')
+    frames = checked(feed_all(reassembler, packets))
+    assert [frame for frame, _, _ in frames] == list(range(NUM_FRAMES))
+
+    lo, hi = lost_packet * PACKET_BYTES // 2, (lost_packet + 1) * PACKET_BYTES // 2
+    flat = expected.reshape(-1).copy()
+    flat[lo:hi] = 0
+    # Packet 8 straddles frames 1 and 2, both come out zero filled and count it
+    for frame, data, lost in frames:
+        np.testing.assert_array_equal(data, flat.reshape(expected.shape)[frame])
+        assert lost == (1 if frame in (1, 2) else 0)
+    assert reassembler.lost_packets == 2
+    assert reassembler.frames_dropped == 0
+
+
+def test_loss_drop():
+    _, packets = make_stream()
+    del packets[8]
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, loss_policy='drop')
+    frames = checked(feed_all(reassembler, packets))
+    assert [frame for frame, _, _ in frames] == [0, 3, 4]
+    assert reassembler.frames_dropped == 2
+
+
+def test_reorder_within_window():
+    expected, packets = make_stream()
+    # Swap two packets and hold back the one across the frame 1/2 border until frame 2 is almost in
+    packets[5], packets[6] = packets[6], packets[5]
+    packets.insert(11, packets.pop(8))
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, reorder_frames=1)
+    frames = checked(feed_all(reassembler, packets))
+    assert [frame for frame, _, _ in frames] == list(range(NUM_FRAMES))
+    for frame, data, lost in frames:
+        assert lost == 0
+        np.testing.assert_array_equal(data, expected[frame])
+    assert reassembler.late_packets == 0
+
+
+def test_first_packet_out_of_order():
+    expected, packets = make_stream()
+    packets[0], packets[1] = packets[1], packets[0]
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES)
+    frames = checked(feed_all(reassembler, packets))
+    # Frame 0 is not given up on because its first packet came second
+    assert frames[0][0] == 0
+    np.testing.assert_array_equal(frames[0][1], expected[0])
+    assert reassembler.late_packets == 0
+    assert reassembler.lost_packets == 0
+
+
+def test_joined_mid_frame():
+    expected, packets = make_stream()
+    # The first packet we see is past the start slack into frame 0: the stream starts at frame 1
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, start_slack=2)
+    frames = checked(feed_all(reassembler, packets[3:]))
+    assert [frame for frame, _, _ in frames] == list(range(1, NUM_FRAMES))
+    for frame, data, lost in frames:
+        assert lost == 0
+        np.testing.assert_array_equal(data, expected[frame])
+    assert reassembler.lost_packets == 0
+
+
+def test_backward_jump_resets():
+    expected, packets = make_stream()
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, ring_frames=3)
+    first = feed_all(reassembler, [(byte_count + 10 * FRAME_BYTES, payload) for byte_count, payload in packets])
+    assert first[0][0] == 10
+    # The capture was restarted, byte_count starts over
+    second = checked(feed_all(reassembler, packets))
+    assert [frame for frame, _, _ in second] == list(range(NUM_FRAMES))
+    for frame, data, lost in second:
+        assert lost == 0
+        np.testing.assert_array_equal(data, expected[frame])
+    assert reassembler.late_packets == 0
+
+
+def test_big_gap_skips_ahead():
+    expected, packets = make_stream()
+    gap = 20
+    late = [(byte_count + gap * FRAME_BYTES, payload) for byte_count, payload in packets[len(packets) // 2:]]
+    early = packets[:8]
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, ring_frames=4)
+    frames = feed_all(reassembler, early + late)
+    numbers = [frame for frame, _, _ in frames]
+    assert numbers[0] == 0
+    # Frames between the two bursts are counted as dropped, not walked through one by one
+    assert reassembler.frames_dropped > 0
+    assert all(frame >= gap for frame in numbers[1:] if frame > 1)
+    for frame, data, lost in frames:
+        if frame >= gap and lost == 0:
+            np.testing.assert_array_equal(data, expected[frame - gap])
+
+
+@pytest.mark.parametrize('ring_frames, reorder_frames', [(4, 1), (2, 0), (3, 1)])
+def test_gap_frames_keep_their_data(ring_frames, reorder_frames):
+    num_frames = 9
+    expected, packets = make_stream(num_frames)
+    # Lose everything from partway into frame 1 up to partway into frame 5, so frame 1 is given up on
+    # in the same feed that reuses its slot
+    first_lost, last_lost = 6, 22
+    kept = packets[:first_lost] + packets[last_lost:]
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, ring_frames=ring_frames, reorder_frames=reorder_frames)
+    frames = feed_all(reassembler, kept)
+
+    flat = expected.reshape(-1).copy()
+    flat[first_lost * PACKET_BYTES // 2:last_lost * PACKET_BYTES // 2] = 0
+    zero_filled = flat.reshape(expected.shape)
+    # Small rings skip some of the lost frames altogether, frame 1 always comes out zero filled
+    numbers = [frame for frame, _, _ in frames]
+    assert numbers[:2] == [0, 1] and numbers[-4:] == [5, 6, 7, 8]
+    assert frames[1][2] > 0
+    for frame, data, lost in frames:
+        np.testing.assert_array_equal(data, zero_filled[frame])
+
+
+def test_unfetched_frames_survive_slot_reuse():
+    expected, packets = make_stream()
+    reassembler = FrameReassembler(FRAME_BYTES, PACKET_BYTES, ring_frames=3)
+    # Nothing taken out of ready until the end: frames whose slots were reused were copied
+    for byte_count, payload in packets:
+        reassembler.feed(byte_count, payload)
+    frames = list(reassembler.ready)
+    assert [frame for frame, _, _, _ in frames] == list(range(NUM_FRAMES + 2))
+    for frame, data, _, _ in frames:
+        np.testing.assert_array_equal(data, expected[frame])
+
+
+def test_unknown_loss_policy():
+    with pytest.raises(ValueError):
+        FrameReassembler(FRAME_BYTES, PACKET_BYTES, loss_policy='retry')
@@ -0,0 +1,160 @@
+import json
+import os
+import weakref
+import numpy as np
+import pytest
+from data_fetching import PACKET_HEADER
+import recording
+from recording import FrameRecorder, PacketCaptureReader, RecordingReader, has_packet_headers, open_capture, packet_index_path
+
+FRAME_LEN = 1000
+PACKET_BYTES = 96
+
+
+def make_frames(num_frames, seed=0):
+    return np.random.default_rng(seed).integers(-2000, 2000, (num_frames, FRAME_LEN)).astype(np.int16)
+
+
+def write_packetized(path, stream, packet_bytes=PACKET_BYTES, skip=()):
+    # A CLI capture with sequenceNumberEnable 1: every packet behind its <seq num><byte count> header
+    data = stream.tobytes()
+    with open(path, 'wb') as f:
+        for seq, offset in enumerate(range(0, len(data), packet_bytes), start=1):
+            if seq in skip:
+                continue
+            f.write(PACKET_HEADER.pack(seq, offset & 0xFFFFFFFF, offset >> 32))
+            f.write(data[offset:offset + packet_bytes])
+
+
+def test_recorder_round_trip(tmp_path):
+    frames = make_frames(7)
+    path = str(tmp_path / 'capture.bin')
+    recorder = FrameRecorder(path, FRAME_LEN, capacity_frames=3, flush_every=2)
+    for i, frame in enumerate(frames):
+        recorder.append(frame, lost_packets=i % 2, frame_number=10 + i, timestamp=float(i))
+    recorder.close()
+
+    reader = RecordingReader(path, FRAME_LEN, PACKET_BYTES)
+    assert len(reader) == len(frames)
+    np.testing.assert_array_equal(reader[:], frames)
+    np.testing.assert_array_equal(reader.index['frame_number'], np.arange(10, 17))
+    np.testing.assert_array_equal(reader.lost_packets, np.arange(7) % 2)
+    assert reader.frame_at(3.5) == 3
+
+
+def test_recorder_grows_twice(tmp_path, monkeypatch):
+    frames = make_frames(5)
+    path = str(tmp_path / 'capture.bin')
+    recorder = FrameRecorder(path, FRAME_LEN, capacity_frames=2, flush_every=1)
+    mappings = []
+    resizes = []
+
+    def checked_open(file, mode='r', *args, **kwargs):
+        # Windows refuses to resize a mapped file, so nothing may map it by then
+        if mode == 'r+b':
+            resizes.append(all(mapping() is None for mapping in mappings))
+        return open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(recording, 'open', checked_open, raising=False)
+    for frame in frames:
+        if recorder.count == recorder.capacity:
+            mappings.append(weakref.ref(recorder.frames))
+        recorder.append(frame)
+    assert resizes == [True, True] and recorder.capacity == 6
+    recorder.close()
+
+    reader = RecordingReader(path, FRAME_LEN, PACKET_BYTES)
+    assert len(reader) == len(frames)
+    np.testing.assert_array_equal(reader[:], frames)
+    assert os.path.getsize(path) == frames.nbytes
+
+
+def test_bare_cli_capture(tmp_path):
+    frames = make_frames(4)
+    path = str(tmp_path / 'adc_data.bin')
+    # A trailing partial frame is not a frame
+    np.concatenate([frames.reshape(-1), frames[0, :10]]).tofile(path)
+    assert not has_packet_headers(path, PACKET_BYTES)
+    reader = RecordingReader(path, FRAME_LEN, PACKET_BYTES)
+    assert len(reader) == 4
+    assert reader.index is None
+    np.testing.assert_array_equal(reader[3], frames[3])
+
+
+def test_packetized_cli_capture_is_refused(tmp_path):
+    path = str(tmp_path / 'adc_data_Raw_0.bin')
+    write_packetized(path, make_frames(4), skip={2})
+    assert has_packet_headers(path, PACKET_BYTES)
+    with pytest.raises(ValueError, match='sequenceNumberEnable'):
+        RecordingReader(path, FRAME_LEN, PACKET_BYTES)
+
+
+def packetized_capture(tmp_path, frames, name='adc_data_Raw_0.bin', **kwargs):
+    path = str(tmp_path / name)
+    write_packetized(path, frames.reshape(-1), **kwargs)
+    return path
+
+
+def test_packetized_capture_frames(tmp_path):
+    frames = make_frames(5)
+    reader = PacketCaptureReader(packetized_capture(tmp_path, frames), FRAME_LEN, PACKET_BYTES)
+    assert len(reader) == 5
+    np.testing.assert_array_equal(reader[:], frames)
+    np.testing.assert_array_equal(list(reader)[2], frames[2])
+    np.testing.assert_array_equal(reader.index['frame_number'], np.arange(5))
+    assert not reader.lost_packets.any()
+
+
+def test_packetized_capture_loss_and_reorder(tmp_path):
+    frames = make_frames(5)
+    path = packetized_capture(tmp_path, frames, skip={25})
+    # Swap two packets in the file, the way they would have been written on arrival
+    stride = PACKET_HEADER.size + PACKET_BYTES
+    data = bytearray(open(path, 'rb').read())
+    data[3 * stride:4 * stride], data[4 * stride:5 * stride] = data[4 * stride:5 * stride], data[3 * stride:4 * stride]
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    reader = PacketCaptureReader(path, FRAME_LEN, PACKET_BYTES)
+    assert len(reader) == 5
+    # seq 25 holds bytes 2304..2400, the end of frame 1
+    expected = frames.copy()
+    expected.reshape(-1)[24 * PACKET_BYTES // 2:25 * PACKET_BYTES // 2] = 0
+    np.testing.assert_array_equal(reader[:], expected)
+    np.testing.assert_array_equal(reader.lost_packets, [0, 1, 0, 0, 0])
+
+
+def test_packetized_capture_index_is_cached(tmp_path):
+    frames = make_frames(3)
+    path = packetized_capture(tmp_path, frames)
+    PacketCaptureReader(path, FRAME_LEN, PACKET_BYTES)
+    assert os.path.exists(packet_index_path(path))
+    # A cached index for another frame size is not used
+    reader = PacketCaptureReader(path, FRAME_LEN // 2, PACKET_BYTES)
+    assert len(reader) == 6
+    np.testing.assert_array_equal(reader[5], frames[2, FRAME_LEN // 2:])
+
+
+def test_packetized_capture_wrong_packet_size(tmp_path):
+    path = packetized_capture(tmp_path, make_frames(3))
+    with pytest.raises(ValueError):
+        PacketCaptureReader(path, FRAME_LEN, PACKET_BYTES + 2)
+
+
+def test_open_capture_layout(tmp_path):
+    frames = make_frames(3)
+    packetized = packetized_capture(tmp_path, frames)
+    bare = str(tmp_path / 'bare.bin')
+    frames.tofile(bare)
+    assert isinstance(open_capture(packetized, FRAME_LEN, PACKET_BYTES), PacketCaptureReader)
+    assert isinstance(open_capture(bare, FRAME_LEN, PACKET_BYTES), RecordingReader)
+
+    # The CLI's cf.json one directory up decides over looking at the file
+    data_dir = tmp_path / 'Data'
+    data_dir.mkdir()
+    with open(tmp_path / 'cf.json', 'w') as f:
+        json.dump({'DCA1000Config': {'captureConfig': {'sequenceNumberEnable': 1}}}, f)
+    path = packetized_capture(data_dir, frames)
+    reader = open_capture(path, FRAME_LEN, PACKET_BYTES)
+    assert isinstance(reader, PacketCaptureReader)
+    np.testing.assert_array_equal(reader[:], frames)
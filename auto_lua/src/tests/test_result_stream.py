@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import batch_process
+from aoa import POINT_DTYPE
+from dca1000_emulator import synthetic_frames
+from result_stream import ResultSubscriber, SocketPublisher
+from worker_pool import ProcessingPool
+
+
+@pytest.fixture
+def udp_pair():
+    subscriber = ResultSubscriber('udp', ('127.0.0.1', 0), max_points=8)
+    publisher = SocketPublisher('udp', subscriber.sock.getsockname(), max_points=8)
+    yield publisher, subscriber
+    publisher.close()
+    subscriber.close()
+
+
+def test_early_hand_record_then_full(udp_pair):
+    publisher, subscriber = udp_pair
+    publisher.publish_hand(7, 1.5, True, 0.25)
+    points = np.zeros(3, dtype=POINT_DTYPE)
+    points['x'] = [1, 2, 3]
+    publisher.publish(7, 1.5, True, 0.25, points)
+
+    early = subscriber.recv(timeout=1)
+    assert early['frame_number'] == 7 and not early['complete']
+    assert early['hand_detected'] and early['hand_distance'] == pytest.approx(0.25)
+    assert early['num_points'] == 0
+
+    full = subscriber.recv(timeout=1)
+    assert full['frame_number'] == 7 and full['complete']
+    assert full['num_points'] == 3
+    np.testing.assert_array_equal(full['points']['x'][:3], [1, 2, 3])
+
+
+def test_pool_sends_hand_before_result():
+    config = batch_process.load_config()
+    config['hand_detection'] = dict(config['hand_detection'], fast_path=True)
+    frames = synthetic_frames(config, config['emulator']['targets'], num_frames=2)
+    events = []
+    pool = ProcessingPool(config, num_workers=1,
+                          on_hand=lambda hand_detected, hand_distance, meta: events.append(('hand', meta['frame_number'])))
+    try:
+        for frame_number, frame in enumerate(frames):
+            assert pool.submit(frame, {'frame_number': frame_number})
+        while len(events) < 4:
+            for result in pool.collect(timeout=30):
+                events.append(('result', result['meta']['frame_number']))
+                pool.release(result['slot'])
+    finally:
+        pool.close()
+    for frame_number in range(2):
+        assert events.index(('hand', frame_number)) < events.index(('result', frame_number))
@@ -0,0 +1,133 @@
+import os
+import pty
+import select
+import threading
+import tty
+import pytest
+from profile_cfg import RadarProfile
+from serial_cfg import CLI_PROMPT, CLIError, CLILoader
+
+LINES = [
+    'sensorStop',
+    'flushCfg',
+    'channelCfg 15 3 0',
+    'adcCfg 2 1',
+    'adcbufCfg -1 0 1 1 1',
+    'profileCfg 0 60 100 6 60 0 0 29.982 0 256 10000 0 0 30',
+    'chirpCfg 0 0 0 0 0 0 0 1',
+    'chirpCfg 1 1 0 0 0 0 0 2',
+    'frameCfg 0 1 64 0 40 1 0',
+    'sensorStart',
+]
+
+
+class PtyPort:
+    # The slave side of a pty with the two calls CLILoader needs from a serial.Serial
+    def __init__(self, fd, timeout=1.0):
+        self.fd = fd
+        self.timeout = timeout
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+    def read_until(self, expected):
+        data = b''
+        while not data.endswith(expected):
+            readable, _, _ = select.select([self.fd], [], [], self.timeout)
+            if not readable:
+                break
+            data += os.read(self.fd, 1)
+        return data
+
+
+class FakeDemo:
+    # The mmWave SDK demo's CLI on the master side: echoes each command, answers Done (or an error
+    # for the commands in fail) and prints the prompt, unless the command is in mute
+    def __init__(self, fd, fail=(), mute=()):
+        self.fd = fd
+        self.fail = fail
+        self.mute = mute
+        self.received = []
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        buffer = b''
+        while True:
+            try:
+                data = os.read(self.fd, 1024)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                line = line.decode()
+                self.received.append(line)
+                if line.split()[0] in self.mute:
+                    continue
+                answer = 'Error -1' if line.split()[0] in self.fail else 'Done'
+                os.write(self.fd, f'{line}\r\n{answer}\r\n\r\n'.encode() + CLI_PROMPT)
+
+
+@pytest.fixture
+def pty_pair():
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    yield master, slave
+    for fd in (master, slave):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def test_load_waits_for_done(pty_pair, tmp_path):
+    master, slave = pty_pair
+    demo = FakeDemo(master)
+    loader = CLILoader(PtyPort(slave), cache_path=str(tmp_path / 'loaded'))
+    assert loader.load(RadarProfile(LINES))
+    # Everything up to sensorStart, one command at a time
+    assert demo.received == LINES[:-1]
+    assert loader.commands_sent == len(LINES) - 1
+    assert loader.command('sensorStart') == ['Done']
+
+
+def test_error_fails_fast(pty_pair, tmp_path):
+    master, slave = pty_pair
+    demo = FakeDemo(master, fail=('profileCfg',))
+    loader = CLILoader(PtyPort(slave), cache_path=str(tmp_path / 'loaded'))
+    with pytest.raises(CLIError, match='Error -1'):
+        loader.load(RadarProfile(LINES))
+    # Nothing after the failed command is sent, and the profile does not count as loaded
+    assert demo.received[-1].startswith('profileCfg')
+    assert loader.cached_hash() is None
+
+
+def test_no_prompt(pty_pair):
+    master, slave = pty_pair
+    FakeDemo(master, mute=('flushCfg',))
+    loader = CLILoader(PtyPort(slave, timeout=0.2))
+    with pytest.raises(CLIError, match='No prompt'):
+        loader.command('flushCfg')
+
+
+def test_unchanged_profile_is_skipped(pty_pair, tmp_path):
+    master, slave = pty_pair
+    demo = FakeDemo(master)
+    cache_path = str(tmp_path / 'loaded')
+    profile = RadarProfile(LINES)
+    assert CLILoader(PtyPort(slave), cache_path=cache_path).load(profile)
+    sent = len(demo.received)
+
+    loader = CLILoader(PtyPort(slave), cache_path=cache_path)
+    assert not loader.load(RadarProfile(LINES))
+    assert len(demo.received) == sent
+    # A changed profile, or force, is sent again
+    assert loader.load(profile, force=True)
+    changed = RadarProfile([line.replace('40 1 0', '50 1 0') for line in LINES])
+    assert loader.load(changed)
+    assert len(demo.received) == sent * 3
+    assert loader.cached_hash() == changed.hash()
@@ -0,0 +1,172 @@
+import socket
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+import yaml
+from dca1000_control import ControlThread
+from dca1000_emulator import DCA1000Emulator, synthetic_frames
+from startup import MarkerFile, StartupError, StartupOrchestrator, config_port_probe, data_packet_probe, sensor_startup
+
+
+@pytest.fixture
+def config(tmp_path):
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    # The board on a second loopback address, every port picked by the OS
+    config['dca1000'] = dict(config['dca1000'], static_ip='127.0.0.1', adc_ip='127.0.0.2', data_port=0, config_port=0)
+    config['emulator'] = dict(config['emulator'], frame_rate=0)
+    config['startup'] = dict(config['startup'], marker_file=str(tmp_path / 'auto_communication.status'),
+                             poll_interval=0.01, total_timeout=5,
+                             phase_timeouts=dict(connected=2, configured=2, dca1000=2, streaming=2, first_packet=2))
+    return config
+
+
+@pytest.fixture
+def emulator(config):
+    emulator = DCA1000Emulator(config, synthetic_frames(config, config['emulator']['targets'], num_frames=1))
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+@pytest.fixture
+def host(config, emulator):
+    # The host's data socket and config port client, pointed at the emulator
+    data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    data_socket.bind(('127.0.0.1', 0))
+    emulator.host_data = data_socket.getsockname()
+    config_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    config_socket.bind(('127.0.0.1', 0))
+    host_config = dict(config, dca1000=dict(config['dca1000'], config_port=emulator.config_socket.getsockname()[1]))
+    control = ControlThread(host_config, sock=config_socket)
+    yield SimpleNamespace(config=host_config, dca=SimpleNamespace(data_socket=data_socket), control=control)
+    control.close()
+    data_socket.close()
+
+
+def write_markers(path, phases, delay=0.05):
+    # auto_communication.lua appending its phases while the orchestrator polls
+    def write():
+        for phase in phases:
+            time.sleep(delay)
+            with open(path, 'a') as f:
+                f.write(phase + '\n')
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_phases_in_order():
+    calls = []
+    ready_at = time.monotonic() + 0.05
+    orchestrator = StartupOrchestrator(total_timeout=1, poll_interval=0.01)
+    orchestrator.add_phase('first', lambda: calls.append('first') or True, 1)
+    orchestrator.add_phase('second', lambda: time.monotonic() >= ready_at, 1)
+    report = orchestrator.run()
+    assert list(report) == ['first', 'second']
+    assert calls == ['first']
+    assert report['second'] >= 0.04
+
+
+def test_phase_timeout():
+    orchestrator = StartupOrchestrator(total_timeout=5, poll_interval=0.01)
+    orchestrator.add_phase('ready', lambda: True, 1)
+    orchestrator.add_phase('never', lambda: False, 0.1)
+    start = time.monotonic()
+    with pytest.raises(StartupError, match='never'):
+        orchestrator.run()
+    assert time.monotonic() - start < 1
+    assert 0.1 <= orchestrator.report['never'] < 1
+
+
+def test_total_timeout_caps_phases():
+    orchestrator = StartupOrchestrator(total_timeout=0.2, poll_interval=0.01)
+    orchestrator.add_phase('slow', lambda: False, 10)
+    start = time.monotonic()
+    with pytest.raises(StartupError, match='slow'):
+        orchestrator.run()
+    assert time.monotonic() - start < 1
+
+
+def test_marker_file(tmp_path):
+    marker = MarkerFile(str(tmp_path / 'status'))
+    assert marker.lines() == []
+    assert not marker.probe('connected')()
+    with open(marker.path, 'w') as f:
+        f.write('connected\n\n')
+    assert marker.probe('connected')()
+    assert not marker.probe('configured')()
+    marker.clear()
+    assert marker.lines() == []
+
+
+def test_marker_failure(tmp_path):
+    marker = MarkerFile(str(tmp_path / 'status'))
+    with open(marker.path, 'w') as f:
+        f.write('connected\nfailed start frame\n')
+    with pytest.raises(StartupError, match='failed start frame'):
+        marker.probe('streaming')()
+
+
+def test_config_port_probe(host):
+    assert config_port_probe(host.control, timeout=0.2)()
+
+
+def test_config_port_probe_without_board(config):
+    # Nothing listens on this port, the probe keeps answering False until the phase times out
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(('127.0.0.2', 0))
+    config_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    config_socket.bind(('127.0.0.1', 0))
+    control = ControlThread(dict(config, dca1000=dict(config['dca1000'], config_port=silent.getsockname()[1])), sock=config_socket)
+    try:
+        assert not config_port_probe(control, timeout=0.05)()
+    finally:
+        control.close()
+        silent.close()
+
+
+def test_data_packet_probe(host, emulator):
+    probe = data_packet_probe(host.dca.data_socket)
+    assert not probe()
+    emulator.start_stream(1)
+    emulator.wait()
+    assert probe()
+    # The packet is left for the capture thread
+    assert len(host.dca.data_socket.recv(65536)) > 0
+
+
+def test_sensor_startup(host, emulator):
+    config = host.config
+    marker, orchestrator = sensor_startup(config, host.dca, host.control)
+    marker.clear()
+    write_markers(marker.path, ['connected', 'configured', 'streaming'])
+    # The board streams once the script started the frames
+    threading.Timer(0.3, emulator.start_stream, args=(1,)).start()
+    report = orchestrator.run()
+    assert list(report) == ['connected', 'configured', 'dca1000', 'streaming', 'first_packet']
+    assert sum(report.values()) < config['startup']['total_timeout']
+
+
+def test_sensor_startup_script_failure(host):
+    marker, orchestrator = sensor_startup(host.config, host.dca, host.control)
+    marker.clear()
+    write_markers(marker.path, ['connected', 'failed configure'])
+    start = time.monotonic()
+    with pytest.raises(StartupError, match='failed configure'):
+        orchestrator.run()
+    # Fails as soon as the marker is there, not after the phase timeout
+    assert time.monotonic() - start < 1
+    assert 'configured' not in orchestrator.report
+
+
+def test_sensor_startup_no_packets(host):
+    config = dict(host.config, startup=dict(host.config['startup'], phase_timeouts=dict(
+        host.config['startup']['phase_timeouts'], first_packet=0.2)))
+    marker, orchestrator = sensor_startup(config, host.dca, host.control)
+    marker.clear()
+    write_markers(marker.path, ['connected', 'configured', 'streaming'], delay=0.01)
+    with pytest.raises(StartupError, match='first_packet'):
+        orchestrator.run()
+    assert list(orchestrator.report) == ['connected', 'configured', 'dca1000', 'streaming', 'first_packet']
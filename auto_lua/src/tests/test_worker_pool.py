@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import batch_process
+from dca1000_emulator import synthetic_frames
+from worker_pool import FrameStages, ProcessingPool, result_dtype
+
+
+@pytest.fixture
+def ema_config():
+    config = batch_process.load_config()
+    config['clutter_removal'] = dict(config['clutter_removal'], mode='ema', alpha=0.2, background=None)
+    return config
+
+
+def run(pool, frame, count):
+    # One frame at a time, so either worker may take any of them
+    profiles = []
+    for _ in range(count):
+        assert pool.submit(frame)
+        for result in pool.collect(timeout=30):
+            profiles.append(result['range_profile_db'].copy())
+            pool.release(result['slot'])
+    return profiles
+
+
+def test_reset_clutter_reaches_every_worker(ema_config):
+    scene, changed = synthetic_frames(ema_config, ema_config['emulator']['targets'], num_frames=2, noise=200.0)
+    # A restarted background is seeded by the first frame after the reset, so with the same frame
+    # over and over every result matches a fresh chain's first one
+    fresh = np.zeros(1, dtype=result_dtype(ema_config))[0]
+    FrameStages(ema_config)(changed, fresh)
+
+    pool = ProcessingPool(ema_config, num_workers=2, slots_per_worker=1)
+    try:
+        run(pool, scene, 8)
+        before = run(pool, changed, 1)[0]
+        pool.reset_clutter()
+        after = run(pool, changed, 8)
+    finally:
+        pool.close()
+    assert not np.allclose(before, fresh['range_profile_db'], atol=1e-2)
+    for profile in after:
+        np.testing.assert_allclose(profile, fresh['range_profile_db'], rtol=1e-5, atol=1e-2)
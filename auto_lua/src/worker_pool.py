@@ -0,0 +1,233 @@
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+from data_fetching import deinterleave
+from data_handling import RadarProcessor
+
+
+# Timed steps of FrameStages, in order (detect_hand comes first with hand_detection.fast_path)
+STAGE_NAMES = ('organize', 'process_frame', 'range_fft', 'detect_objects', 'point_cloud', 'detect_hand')
+
+
+def result_dtype(config):
+    # Fixed-size outputs of one frame, written by a worker straight into a shared result slot
+    radar = config['radar']
+    num_range_bins = radar['num_adc_samples']
+    num_doppler_bins = radar['chirps'] // radar['num_tx_antennas']
+    return np.dtype([
+        ('iq', np.complex64, (radar['num_adc_samples'],)),
+        ('sample_profile_db', np.float32, (num_range_bins,)),
+        ('range_profile_db', np.float32, (num_range_bins,)),
+        ('range_doppler_db', np.float32, (num_doppler_bins, num_range_bins)),
+    ])
+
+
+class FrameStages:
+    # The per-frame DSP of RadarSystem: organize, sample power, range / Doppler FFT, point cloud and
+    # hand detection. Array outputs go into a result record, the small ones are returned.
+    # With hand_detection.fast_path the hand is detected from the raw frame before anything else and
+    # on_hand(hand_detected, hand_distance) is called with it right away.
+    def __init__(self, config, on_hand=None):
+        radar = config['radar']
+        self.processor = RadarProcessor(config)
+        self.geometry = (radar['chirps'], radar['num_rx_antennas'], radar['num_adc_samples'])
+        self.lvds = dict(num_lanes=radar['num_lvds_lanes'], iq_swap=radar['iq_swap'], ch_interleave=radar['ch_interleave'])
+        self.frame = np.empty(self.geometry, dtype=np.complex64)
+        self.fast_path = config['hand_detection']['fast_path']
+        self.on_hand = on_hand
+        # Seconds spent in each step by the last call
+        self.timings = dict.fromkeys(STAGE_NAMES, 0.0)
+
+    def __call__(self, raw_frame, result):
+        timings = self.timings
+        if self.fast_path:
+            t0 = time.perf_counter()
+            hand_detected, hand_distance = self.processor.detect_hand_fast(raw_frame)
+            timings['detect_hand'] = time.perf_counter() - t0
+            if self.on_hand is not None:
+                self.on_hand(hand_detected, hand_distance)
+        t0 = time.perf_counter()
+        frame = deinterleave(raw_frame, *self.geometry, out=self.frame, **self.lvds)
+        result['iq'] = frame[0][0]
+        t1 = time.perf_counter()
+        result['sample_profile_db'] = self.processor.process_frame(frame)
+        t2 = time.perf_counter()
+        range_axis, range_profile_db, _ = self.processor.process_range_fft(frame)
+        result['range_profile_db'] = range_profile_db
+        result['range_doppler_db'] = self.processor.range_doppler_db
+        t3 = time.perf_counter()
+        detections = self.processor.detect_objects()
+        t4 = time.perf_counter()
+        points = self.processor.point_cloud(detections)
+        t5 = time.perf_counter()
+        for name, start, end in zip(STAGE_NAMES[:5], (t0, t1, t2, t3, t4), (t1, t2, t3, t4, t5)):
+            timings[name] = end - start
+        if not self.fast_path:
+            hand_detected, hand_distance = self.processor.detect_hand(range_profile_db, range_axis)
+            timings['detect_hand'] = time.perf_counter() - t5
+            if self.on_hand is not None:
+                self.on_hand(hand_detected, hand_distance)
+        return points, hand_detected, hand_distance
+
+    def warm_clutter(self, raw_frames):
+        # Restarts the clutter filters and lets them follow raw_frames, e.g. the frames before a batch chunk
+        self.processor.reset_clutter()
+        if self.processor.clutter is None:
+            return
+        for raw_frame in raw_frames:
+            frame = deinterleave(raw_frame, *self.geometry, out=self.frame, **self.lvds)
+            self.processor.warm_clutter(frame, raw_frame)
+
+
+def attach(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def worker_main(config, frames_name, results_name, num_slots, frame_len, tasks, done):
+    frames_shm, frames = attach(frames_name, (num_slots, frame_len), np.int16)
+    results_shm, results = attach(results_name, num_slots, result_dtype(config))
+    current = {}
+    # Clutter resets this worker has applied, ProcessingPool.reset_clutter() counts up the ones asked for
+    resets = 0
+
+    def send_hand(hand_detected, hand_distance):
+        # The fast path's hand detection goes back ahead of the rest of the chain
+        done.put(('hand', current['slot'], current['seq'], hand_detected, hand_distance))
+
+    stages = FrameStages(config, on_hand=send_hand if config['hand_detection']['fast_path'] else None)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, seq, clutter_resets = task
+            if clutter_resets != resets:
+                stages.processor.reset_clutter()
+                resets = clutter_resets
+            current['slot'], current['seq'] = slot, seq
+            points, hand_detected, hand_distance = stages(frames[slot], results[slot])
+            done.put(('result', slot, seq, points, hand_detected, hand_distance, dict(stages.timings)))
+    finally:
+        del frames, results
+        frames_shm.close()
+        results_shm.close()
+
+
+class ProcessingPool:
+    # Runs FrameStages in worker processes. Frames are copied into shared memory slots and workers
+    # write their array outputs into matching shared result slots, so only slot numbers and the small
+    # per-frame results (point cloud, hand detection) cross the process boundary. Results come back
+    # in submission order whatever order the workers finish in. With hand_detection.fast_path,
+    # on_hand(hand_detected, hand_distance, meta) is called from collect() as soon as a worker has
+    # the hand of a frame, before its full result.
+    def __init__(self, config, num_workers, slots_per_worker=2, on_hand=None):
+        self.num_slots = num_workers * slots_per_worker
+        self.on_hand = on_hand
+        self.frame_len = config['dca1000']['dataSizeOneFrame'] // 2
+        dtype = result_dtype(config)
+        self._frames_shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.frame_len * 2)
+        self._results_shm = shared_memory.SharedMemory(create=True, size=self.num_slots * dtype.itemsize)
+        self.frames = np.ndarray((self.num_slots, self.frame_len), dtype=np.int16, buffer=self._frames_shm.buf)
+        self.results = np.ndarray(self.num_slots, dtype=dtype, buffer=self._results_shm.buf)
+
+        self._free = deque(range(self.num_slots))
+        self._meta = {}
+        self._finished = {}
+        self._next_submit = 0
+        self._next_deliver = 0
+        # Every task carries it, so each worker resets its own clutter filters before its next frame
+        self._clutter_resets = 0
+
+        # spawn is the only start method on Windows, use it everywhere so both behave the same
+        context = mp.get_context('spawn')
+        self._tasks = context.Queue()
+        self._done = context.Queue()
+        self.workers = [context.Process(target=worker_main, daemon=True,
+                                        args=(config, self._frames_shm.name, self._results_shm.name, self.num_slots,
+                                              self.frame_len, self._tasks, self._done))
+                        for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+        self.frames_submitted = 0
+        self.frames_completed = 0
+
+    def submit(self, raw_frame, meta=None):
+        # Returns False when every slot is busy; collect() frees them
+        if not self._free:
+            return False
+        slot = self._free.popleft()
+        self.frames[slot] = raw_frame.reshape(-1)
+        self._meta[slot] = meta
+        self._tasks.put((slot, self._next_submit, self._clutter_resets))
+        self._next_submit += 1
+        self.frames_submitted += 1
+        return True
+
+    def collect(self, timeout=0.0):
+        # In-order results that are ready, waiting up to timeout for the first one. Each result is a
+        # dict whose arrays are views into its shared slot; hand the slot back with release().
+        deadline = time.monotonic() + timeout
+        while True:
+            block = self._next_deliver not in self._finished and self._next_deliver < self._next_submit
+            try:
+                if block:
+                    finished = self._done.get(timeout=max(deadline - time.monotonic(), 0))
+                else:
+                    finished = self._done.get_nowait()
+            except queue.Empty:
+                break
+            if finished[0] == 'hand':
+                _, slot, _, hand_detected, hand_distance = finished
+                if self.on_hand is not None:
+                    self.on_hand(hand_detected, hand_distance, self._meta[slot])
+                continue
+            self._finished[finished[2]] = finished[1:]
+
+        ready = []
+        while self._next_deliver in self._finished:
+            slot, seq, points, hand_detected, hand_distance, timings = self._finished.pop(self._next_deliver)
+            self._next_deliver += 1
+            self.frames_completed += 1
+            record = self.results[slot]
+            ready.append({
+                "slot": slot,
+                "meta": self._meta.pop(slot),
+                "iq": record['iq'],
+                "sample_profile_db": record['sample_profile_db'],
+                "range_profile_db": record['range_profile_db'],
+                "range_doppler_db": record['range_doppler_db'],
+                "points": points,
+                "hand_detected": hand_detected,
+                "hand_distance": hand_distance,
+                "timings": timings,
+            })
+        return ready
+
+    def reset_clutter(self):
+        # Frames submitted from now on are processed with the clutter filters restarted
+        self._clutter_resets += 1
+
+    @property
+    def in_flight(self):
+        return self.num_slots - len(self._free)
+
+    def release(self, slot):
+        self._free.append(slot)
+
+    def close(self):
+        for _ in self.workers:
+            self._tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        del self.frames, self.results
+        self._frames_shm.close()
+        self._frames_shm.unlink()
+        self._results_shm.close()
+        self._results_shm.unlink()
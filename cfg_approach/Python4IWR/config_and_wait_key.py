@@ -1,25 +1,58 @@
-import serial, time
+import argparse, hashlib, os
+import serial
+
+# What the mmWave SDK demo prints once it is ready for the next command
+CLI_PROMPT = b'mmwDemo:/>'
 
 # Configure IWR6843 by serial port
-serial_port_CLI = 'COM6'
-file_cfg = 'cfg/custom_profile.cfg'
-print('Sending ' + file_cfg + ' to IWR6843 on ' + serial_port_CLI)
-CLIport = serial.Serial(serial_port_CLI, 115200, timeout=1)
-if CLIport.is_open:
-    config = [line.rstrip('\r\n') for line in open(file_cfg)]
+parser = argparse.ArgumentParser()
+parser.add_argument('--port', default='COM6')
+parser.add_argument('--cfg', default='cfg/custom_profile.cfg')
+parser.add_argument('--baud', type=int, default=115200)
+parser.add_argument('--timeout', type=float, default=2.0, help='seconds to wait for each command to be acknowledged')
+parser.add_argument('--force', action='store_true', help='send the profile even if it was the last one loaded, e.g. after a power cycle')
+args = parser.parse_args()
+
+
+def send(line):
+    # Waits for the prompt after each command and stops on anything but Done
+    CLIport.write((line + '\n').encode())
+    response = CLIport.read_until(CLI_PROMPT)
+    if not response.endswith(CLI_PROMPT):
+        raise SystemExit('No prompt after ' + line + ', got ' + repr(response))
+    lines = [text.strip() for text in response[:-len(CLI_PROMPT)].decode(errors='replace').splitlines()]
+    lines = [text for text in lines if text and text != line]
+    if 'Done' not in lines:
+        raise SystemExit(line + ' failed: ' + (' | '.join(lines) or 'no response'))
+    print('>>> ' + line)
+
+
+# Commands without comments and blank lines; their hash identifies the profile
+config = []
+for line in open(args.cfg):
+    line = ' '.join(line.split())
+    if line and line[0] != '%':
+        config.append(line)
+digest = hashlib.sha256('\n'.join(config).encode()).hexdigest()
+# Hash of the last profile loaded completely, so an unchanged one is not sent again
+cache_path = args.cfg + '.' + os.path.basename(args.port) + '.loaded'
+
+print('Sending ' + args.cfg + ' to IWR6843 on ' + args.port)
+CLIport = serial.Serial(args.port, args.baud, timeout=args.timeout)
+if not args.force and os.path.exists(cache_path) and open(cache_path).read().strip() == digest:
+    print('Profile unchanged since the last load, not sending it again')
+else:
+    # Dropped first, so a load that stops on an error is never mistaken for a complete one
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    CLIport.reset_input_buffer()
     for i in config:
-        # Skip empty line
-        if(i == ''):
-            continue
-        # Skip comment line
-        if(i[0] == '%'):
-            continue
         # Stop on sensorStart command
-        if (i == 'sensorStart'):
+        if i.split()[0] == 'sensorStart':
             break
-        CLIport.write((i+'\n').encode())
-        print('>>> ' + i)
-        time.sleep(0.01)
+        send(i)
+    with open(cache_path, 'w') as f:
+        f.write(digest)
 
 # Wait key to toggle frame
 sending = False
@@ -29,9 +62,7 @@ while True:
         print('\nFrame ' + 'sending' + ', press Enter to ' + 'stop')
         key_input = input('<<')
         # involke stop
-        CLIport.write(('sensorStop\n').encode())
-        print('>>> sensorStop')
-        time.sleep(0.01)
+        send('sensorStop')
         sending = False
     else:
         print('\nFrame ' + 'stopped' + ', press Enter to ' + 'send')
@@ -41,8 +72,6 @@ while True:
             start_cmd = 'sensorStart 0'
         else:
             start_cmd = 'sensorStart'
-        CLIport.write((start_cmd + '\n').encode())
-        print('>>> ' + start_cmd)
-        time.sleep(0.01)
+        send(start_cmd)
         sending = True
         initial_frame_sent = True
\ No newline at end of file